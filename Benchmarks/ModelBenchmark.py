@@ -0,0 +1,243 @@
+"""
+Timing benchmark suite for the model, with a JSON history to compare runs across commits on the same machine.
+
+Cases (all seeded, so every run does the same work):
+    build       EvacuationModel.__init__ on both map images, from the compiled map and from the image
+    astar       a_star_search on the fixed origin/destination queries of PathFindingBenchmark, also with method='jps'
+    neighbors   Person neighbour queries (radius 6 and 50) with 100, 1000 and 5000 visitors on the map
+    ticks       ticks per second with 50, 500 and 5000 visitors (object engine up to --object-max-visitors)
+    experiment  Experiment.run of 2 replications for ExitType.A
+
+Every result has 'seconds' (lower is better), which is compared to the last run on the same machine in
+Benchmarks/benchmark_history.json (not under version control, as timings depend on the machine).
+
+Usage (from the repository root):
+    python -m Benchmarks.ModelBenchmark                         # all cases, appended to the history
+    python -m Benchmarks.ModelBenchmark --cases astar ticks     # some cases
+    python -m Benchmarks.ModelBenchmark --max-slowdown 0.2      # exit code 1 if a case got more than 20% slower
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from Scripts.EvacuationModel import EvacuationModel
+from Scripts.Experiment import Experiment
+from Scripts.AnimateAgents import Person, Visitor
+from Scripts.Enums import *
+from Scripts.PathFinding import a_star_search
+from Benchmarks.PathFindingBenchmark import get_queries, IMG_PATH
+
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_history.json')
+MAP_PATHS = ['Images/Library_NewPlan2_map.png', 'Images/Library_ToyPlan2_v1.png']
+
+
+def time_call(function, repeat=1):
+    """
+    Calls a function repeat times and returns the shortest duration and the last return value.
+    :param function: function without arguments
+    :param repeat: int
+    :return: float (s), return value
+    """
+    best, value = float('inf'), None
+    for _ in range(repeat):
+        start_t = time.perf_counter()
+        value = function()
+        best = min(best, time.perf_counter() - start_t)
+    return best, value
+
+
+def bench_build(args):
+    results = {}
+    for img_path in MAP_PATHS:
+        name = os.path.splitext(os.path.basename(img_path))[0]
+        for source, compiled_map in (('compiled', True), ('image', False)):
+            build = lambda: EvacuationModel(img_path=img_path, n_visitors=50, seed=0, compiled_map=compiled_map)
+            try:
+                build()  # creates the compiled map and the paths cache if they do not exist yet
+                seconds, _ = time_call(build, repeat=args.repeat)
+                results[f'build:{name}:{source}'] = {'seconds': seconds}
+            except ValueError as error:  # e.g. a map that does not contain all colours of the colour definitions
+                results[f'build:{name}:{source}'] = {'error': str(error)}
+    return results
+
+
+def bench_astar(args):
+    model = EvacuationModel(img_path=IMG_PATH, n_visitors=0, seed=0)
+    queries = get_queries(model)
+    for origin, destination in queries[:1]:
+        a_star_search(model.grid, origin, destination, method='jps')  # builds the search space and jump tables
+
+    results = {}
+    for method in ('astar', 'jps'):
+        def run():
+            expanded = 0
+            for origin, destination in queries:
+                stats = {}
+                a_star_search(model.grid, origin, destination, stats=stats, method=method)
+                expanded += stats['expanded']
+            return expanded
+
+        seconds, expanded = time_call(run, repeat=args.repeat)
+        name = 'astar' if method == 'astar' else f'astar:{method}'
+        results[name] = {'seconds': seconds, 'queries': len(queries), 'ms_per_query': seconds / len(queries) * 1000,
+                         'expanded': expanded}
+    return results
+
+
+def bench_neighbors(args):
+    results = {}
+    for n_visitors in (100, 1000, 5000):
+        model = EvacuationModel(img_path=IMG_PATH, n_visitors=n_visitors, seed=0)
+        persons = [agent for agent in model.schedule.agents if isinstance(agent, Person)]
+
+        def run():
+            n_found = 0
+            for person in persons:
+                n_found += person.get_nr_of_neighbors(Person, radius=6)
+                n_found += len(person.get_neighbors_of_type(Visitor, radius=50))
+            return n_found
+
+        seconds, n_found = time_call(run, repeat=args.repeat)
+        results[f'neighbors:{n_visitors}'] = {'seconds': seconds, 'queries': 2 * len(persons),
+                                              'us_per_query': seconds / (2 * len(persons)) * 1e6,
+                                              'neighbors_found': n_found}
+    return results
+
+
+def bench_ticks(args):
+    results = {}
+    for n_visitors in (50, 500, 5000):
+        for engine in ('object', 'vectorized'):
+            if engine == 'object' and n_visitors > args.object_max_visitors:
+                continue
+            model = EvacuationModel(img_path=IMG_PATH, n_visitors=n_visitors, seed=0, engine=engine,
+                                    max_run_length=args.ticks)
+            start_t = time.perf_counter()
+            n_ticks = 0
+            for n_ticks in range(1, args.ticks + 1):
+                model.step()
+                if model.is_done():
+                    break
+            seconds = time.perf_counter() - start_t
+            results[f'ticks:{engine}:{n_visitors}'] = {'seconds': seconds, 'ticks': n_ticks,
+                                                       'ticks_per_second': n_ticks / seconds}
+    return results
+
+
+def bench_experiment(args):
+    def run():
+        experiment = Experiment()
+        experiment.run(EvacuationModel, n_replications=2, valid_exits=[ExitType.A], n_visitors=50, seed=0)
+        return experiment.evacuation_times[ExitType.A]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, evacuation_times = time_call(run)
+    return {'experiment:A': {'seconds': seconds, 'evacuation_times': evacuation_times}}
+
+
+CASES = {'build': bench_build, 'astar': bench_astar, 'neighbors': bench_neighbors, 'ticks': bench_ticks,
+         'experiment': bench_experiment}
+
+
+def get_machine():
+    """
+    Returns a description of the machine; runs are only compared to runs on the same machine.
+    :return: dict
+    """
+    return {'node': platform.node(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'python': platform.python_version(), 'cpu_count': os.cpu_count()}
+
+
+def get_commit():
+    """
+    Returns the current git commit (with '-dirty' if there are uncommitted changes), or None outside of git.
+    :return: str or None
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if dirty else commit
+
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as handle:
+        return json.load(handle)
+
+
+def compare(results, previous):
+    """
+    Returns the relative change in seconds of every case compared to a previous run (positive is slower).
+    :param results: dict with case name as key and result dict as value
+    :param previous: dict, same format
+    :return: dict with case name as key and float as value
+    """
+    changes = {}
+    for name, result in results.items():
+        before = previous.get(name, {}).get('seconds')
+        if 'seconds' in result and before:
+            changes[name] = result['seconds'] / before - 1
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Timing benchmark suite of the model.')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions of the short cases (the fastest counts)')
+    parser.add_argument('--ticks', type=int, default=40, help='ticks per tick throughput case (the alarm is at 30)')
+    parser.add_argument('--object-max-visitors', type=int, default=500,
+                        help='largest crowd that the tick cases run with the object engine')
+    parser.add_argument('--max-slowdown', type=float, default=None,
+                        help='exit code 1 if a case is slower than the last run by more than this fraction')
+    parser.add_argument('--no-save', action='store_true', help='do not append this run to the history')
+    args = parser.parse_args()
+
+    results = {}
+    for case in args.cases:
+        print(f'Running {case} ...')
+        with contextlib.redirect_stdout(io.StringIO()):  # the model prints its set-up progress
+            results.update(CASES[case](args))
+
+    machine = get_machine()
+    history = load_history()
+    previous = next((run for run in reversed(history) if run['machine'] == machine), None)
+    changes = compare(results, previous['results']) if previous else {}
+
+    print(f"\n{'case':<40}{'seconds':>12}{'change':>10}")
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:<40}{'error':>12}  {result['error']}")
+            continue
+        change = f'{changes[name]:+.1%}' if name in changes else ''
+        print(f"{name:<40}{result['seconds']:>12.3f}{change:>10}")
+    if previous:
+        print(f"\nCompared to {previous['commit']} ({previous['date']})")
+
+    if not args.no_save:
+        history.append({'commit': get_commit(), 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': machine,
+                        'args': vars(args), 'results': results})
+        with open(HISTORY_PATH, 'w') as handle:
+            json.dump(history, handle, indent=1)
+        print(f"Results appended to {HISTORY_PATH}")
+
+    if args.max_slowdown is not None:
+        slower = [name for name, change in changes.items() if change > args.max_slowdown]
+        for name in slower:
+            print(f"\tREGRESSION {name}: {changes[name]:+.1%}")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
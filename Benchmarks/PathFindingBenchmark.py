@@ -0,0 +1,198 @@
+"""
+Regression benchmark for the A* pathfinder (and its Jump Point Search mode) on the library map.
+
+Runs a fixed set of origin/destination queries on Library_NewPlan2_map.png and checks for every query that
+    * the path is a shortest path (its length equals the BFS distance), and
+    * the number of expanded cells (jump points for JPS) did not grow compared to the stored baseline.
+
+Usage (from the repository root):
+    python -m Benchmarks.PathFindingBenchmark                # check against Benchmarks/pathfinding_expansions.json
+    python -m Benchmarks.PathFindingBenchmark --update       # (re)write the baseline
+    python -m Benchmarks.PathFindingBenchmark --method jps   # the same for JPS (pathfinding_expansions_jps.json)
+    python -m Benchmarks.PathFindingBenchmark --compare      # expansions and time of JPS relative to A*
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from Scripts.EvacuationModel import EvacuationModel
+from Scripts.Enums import *
+from Scripts.PathFinding import a_star_search, compute_distance_field, UNWALKABLE_OBJECTS
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pathfinding_expansions.json')
+METHODS = ('astar', 'jps')
+IMG_PATH = 'Images/Library_NewPlan2_map.png'
+
+
+def get_queries(model, n_origins=4, n_other_destinations=5, seed=0):
+    """
+    Returns a fixed list of (origin, destination) queries: n_origins random spawnable cells to every exit, and to
+    n_other_destinations random desks, shelves and help desks. Origins are only drawn from cells that can reach an exit
+    (the map has a few enclosed floor areas).
+    :param model: EvacuationModel
+    :param n_origins: int
+    :param n_other_destinations: int
+    :param seed: int
+    :return: list of tuples (origin, destination)
+    """
+    rng = random.Random(seed)
+    others = sorted(model.destinations[Destination.DESK] + model.destinations[Destination.SHELF] +
+                    model.destinations[Destination.HELPDESK])
+    destinations = sorted(model.destinations[Destination.EXIT]) + rng.sample(others, k=n_other_destinations)
+
+    queries = []
+    exit_distance = model.exit_distance_fields[ExitType.ABC]
+    spawnable_positions = sorted(pos for pos in model.spawnable_positions if exit_distance[pos[1], pos[0]] >= 0)
+    for destination in destinations:
+        for origin in rng.sample(spawnable_positions, k=n_origins):
+            queries.append((origin, destination))
+    return queries
+
+
+def get_baseline_path(method):
+    """
+    Returns the baseline file of a search method.
+    :param method: 'astar' or 'jps'
+    :return: str
+    """
+    return BASELINE_PATH if method == 'astar' else BASELINE_PATH.replace('.json', f'_{method}.json')
+
+
+def run_queries(model, queries, method='astar'):
+    """
+    Runs all queries and returns one record per query with the path length, the optimal length and the expansions.
+    :param model: EvacuationModel
+    :param queries: list of tuples (origin, destination)
+    :param method: search method of a_star_search
+    :return: list of dicts
+    """
+    walkable = model.grid.get_walkable_mask(UNWALKABLE_OBJECTS)
+    distance_fields = {}
+
+    records = []
+    for origin, destination in queries:
+        if destination not in distance_fields:
+            distance_fields[destination] = compute_distance_field(walkable, [destination])[0]
+
+        stats = {}
+        start_t = time.perf_counter()
+        path = a_star_search(model.grid, origin, destination, stats=stats, method=method)
+        duration = time.perf_counter() - start_t
+
+        records.append({'origin': list(origin), 'destination': list(destination),
+                        'path_length': len(path) - 1,
+                        'optimal_length': int(distance_fields[destination][origin[1], origin[0]]),
+                        'expanded': stats['expanded'],
+                        'time_ms': round(duration * 1000, 3)})
+    return records
+
+
+def check(records, baseline, tolerance=0.0):
+    """
+    Compares the records to the baseline and returns a list of problems (empty if all is well).
+    :param records: list of dicts, see run_queries
+    :param baseline: dict with key 'queries' (list of dicts, see run_queries)
+    :param tolerance: float: relative growth of expansions that is still accepted
+    :return: list of str
+    """
+    problems = []
+    expected = {(tuple(r['origin']), tuple(r['destination'])): r for r in baseline['queries']}
+
+    for record in records:
+        key = (tuple(record['origin']), tuple(record['destination']))
+        if record['path_length'] != record['optimal_length']:
+            problems.append(f"{key}: path length {record['path_length']} is not optimal "
+                            f"({record['optimal_length']})")
+        if key not in expected:
+            problems.append(f"{key}: not in baseline, run with --update")
+        elif record['expanded'] > expected[key]['expanded'] * (1 + tolerance):
+            problems.append(f"{key}: {record['expanded']} expansions, baseline {expected[key]['expanded']}")
+    return problems
+
+
+def show_summary(method, records):
+    total_expanded = sum(r['expanded'] for r in records)
+    total_time = sum(r['time_ms'] for r in records)
+    print(f"{method}: {len(records)} queries: {total_expanded} expansions "
+          f"({total_expanded / len(records):.0f} per query), {total_time / len(records):.1f} ms per query")
+
+
+def compare_methods(records, other_records):
+    """
+    Prints the expansions and time of a search method relative to A* per destination, and checks that both found
+    paths of the same length.
+    :param records: list of dicts of A*, see run_queries
+    :param other_records: list of dicts of the other method (same queries)
+    :return: list of str: queries with paths of different length
+    """
+    problems = []
+    per_destination = {}
+    for record, other in zip(records, other_records):
+        if record['path_length'] != other['path_length']:
+            problems.append(f"{tuple(record['origin'])} -> {tuple(record['destination'])}: path length "
+                            f"{other['path_length']}, A* {record['path_length']}")
+        totals = per_destination.setdefault(tuple(record['destination']), [0, 0, 0.0, 0.0])
+        totals[0] += record['expanded']
+        totals[1] += other['expanded']
+        totals[2] += record['time_ms']
+        totals[3] += other['time_ms']
+
+    print(f"\n{'destination':<14}{'expanded':>10}{'ratio':>8}{'time (ms)':>12}{'speed-up':>10}")
+    for destination, (expanded, other_expanded, time_ms, other_time_ms) in per_destination.items():
+        print(f"{str(destination):<14}{other_expanded:>10}{other_expanded / expanded:>8.3f}{other_time_ms:>12.1f}"
+              f"{time_ms / other_time_ms:>10.1f}")
+    expanded, other_expanded, time_ms, other_time_ms = (sum(values) for values in zip(*per_destination.values()))
+    print(f"{'total':<14}{other_expanded:>10}{other_expanded / expanded:>8.3f}{other_time_ms:>12.1f}"
+          f"{time_ms / other_time_ms:>10.1f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A* node expansion regression benchmark.')
+    parser.add_argument('--method', choices=METHODS, default='astar', help='search method of a_star_search')
+    parser.add_argument('--update', action='store_true', help='write the current results as new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='accepted relative growth of expansions')
+    parser.add_argument('--compare', action='store_true', help='compare JPS to A* instead of checking a baseline')
+    args = parser.parse_args()
+
+    model = EvacuationModel(img_path=IMG_PATH, n_visitors=0)
+    queries = get_queries(model)
+    a_star_search(model.grid, *queries[0], method='jps')  # builds the search space and its jump tables
+
+    if args.compare:
+        records = {method: run_queries(model, queries, method=method) for method in METHODS}
+        for method in METHODS:
+            show_summary(method, records[method])
+        problems = compare_methods(records['astar'], records['jps'])
+        for problem in problems:
+            print(f"\tDIFFERENT LENGTH {problem}")
+        return 1 if problems else 0
+
+    records = run_queries(model, queries, method=args.method)
+    show_summary(args.method, records)
+
+    baseline_path = get_baseline_path(args.method)
+    if args.update:
+        with open(baseline_path, 'w') as handle:
+            json.dump({'map': IMG_PATH, 'method': args.method,
+                       'queries': [{k: v for k, v in r.items() if k != 'time_ms'} for r in records]},
+                      handle, indent=1)
+        print(f"Baseline written to {baseline_path}")
+        return 0
+
+    with open(baseline_path, 'r') as handle:
+        baseline = json.load(handle)
+
+    problems = check(records, baseline, tolerance=args.tolerance)
+    for problem in problems:
+        print(f"\tREGRESSION {problem}")
+    if not problems:
+        print("No regressions.")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,34 @@
 import math
 from mesa import Agent
-import random
 from Scripts.Tasks import CompositeTask
 from Scripts.Enums import *
 from Scripts.PathFinding import a_star_search
 
 
 class Person(Agent):
+    """
+    All random draws of a person go through the generator of its model (model.random), so a seeded model is
+    reproducible. Models can also pre-draw the attributes of many persons at once and hand them over as attributes, a
+    dict with gender, age and entrance (and had_safety_training and knows_exits for visitors).
+    """
 
-    def __init__(self, unique_id, model, female_ratio=0.5, adult_ratio=0.7):
+    def __init__(self, unique_id, model, female_ratio=0.5, adult_ratio=0.7, attributes=None):
 
         super().__init__(unique_id, model)
 
         self.gender = Gender.FEMALE
-        self.assign_gender(female_ratio)
-
         self.age = Age.ADULT
-        self.assign_age(adult_ratio)
+        if attributes is not None:
+            self.gender = attributes['gender']
+            self.age = attributes['age']
+        else:
+            self.assign_gender(female_ratio)
+            self.assign_age(adult_ratio)
 
         self.busy = False
 
         self.move_data = MovementData(self.gender)
-        self.emergency_knowledge = EmergencyKnowledge(self)
+        self.emergency_knowledge = EmergencyKnowledge(self, entrance=attributes['entrance'] if attributes else None)
         self.current_task = CompositeTask(self, self.model)
 
     def step(self):
@@ -37,14 +44,28 @@ class Person(Agent):
         :return: nr_of_neighbors: int
         """
 
+        nr_of_neighbors = len(self.get_neighbors_of_type(agent_type, radius=radius))
+
+        return nr_of_neighbors
+
+    def get_neighbors_of_type(self, agent_type, radius):
+        """
+        Return all agents of a specific type in the Moore neighborhood (excluding the own cell) of this agent.
+        Grids with a spatial index of the dynamic agents (TerrainGrid) only look at the agents nearby, other grids
+        (e.g. ToyModel's MultiGrid) visit all cells in the radius and filter out the inanimate agents.
+        :param: agent_type: Agent (Person, Staff, Visitor, or any other)
+        :param: radius: int
+        :return: list of agents
+        """
+        grid = self.model.grid
+        if hasattr(grid, 'get_agents_in_radius'):
+            return grid.get_agents_in_radius(self.pos, radius, agent_type=agent_type, include_center=False)
+
         # get all neighbors (including inanimate agents
-        all_agents = self.model.grid.get_neighbors(pos=self.pos, moore=True, include_center=False, radius=radius)
+        all_agents = grid.get_neighbors(pos=self.pos, moore=True, include_center=False, radius=radius)
 
         # filter out all inanimate agents
-        animate_agents = [x for x in all_agents if isinstance(x, agent_type)]
-        nr_of_neighbors = len(animate_agents)
-
-        return nr_of_neighbors
+        return [x for x in all_agents if isinstance(x, agent_type)]
 
     def scan_environment_for_evacuation(self, agent_type, radius=50):
         """
@@ -54,11 +75,7 @@ class Person(Agent):
         :return: evacuating_ratio: float
         """
 
-        # get all neighbors (including inanimate agents
-        all_agents = self.model.grid.get_neighbors(pos=self.pos, moore=True, include_center=False, radius=radius)
-
-        # filter out all inanimate agents
-        animate_agents = [x for x in all_agents if isinstance(x, agent_type)]
+        animate_agents = self.get_neighbors_of_type(agent_type, radius=radius)
 
         nr_of_neighbors = len(animate_agents)
 
@@ -112,11 +129,7 @@ class Person(Agent):
 
         closest_exit = None
 
-        # get all neighbors (including inanimate agents
-        all_agents = self.model.grid.get_neighbors(pos=self.pos, moore=True, include_center=False, radius=radius)
-
-        # filter out all inanimate agents
-        staff_neighbors = [x for x in all_agents if isinstance(x, Staff)]
+        staff_neighbors = self.get_neighbors_of_type(Staff, radius=radius)
 
         if staff_neighbors:
             closest_staff = staff_neighbors[0]
@@ -167,11 +180,7 @@ class Person(Agent):
         :return visitor_neighbors: list
         """
 
-        # get all neighbors (including inanimate agents
-        all_agents = self.model.grid.get_neighbors(pos=self.pos, moore=True, include_center=False, radius=radius)
-
-        # filter out all inanimate agents
-        visitor_neighbors = [x for x in all_agents if isinstance(x, Visitor)]
+        visitor_neighbors = self.get_neighbors_of_type(Visitor, radius=radius)
 
         return visitor_neighbors
 
@@ -192,7 +201,7 @@ class Person(Agent):
         :param female_ratio: float
         """
 
-        if random.random() <= female_ratio:
+        if self.model.random.random() <= female_ratio:
             self.gender = Gender.FEMALE
         else:
             self.gender = Gender.MALE
@@ -203,7 +212,7 @@ class Person(Agent):
         :param adult_ratio: float
         """
 
-        if random.random() <= adult_ratio:
+        if self.model.random.random() <= adult_ratio:
             self.age = Age.ADULT
         else:
             self.age = Age.CHILD
@@ -211,17 +220,23 @@ class Person(Agent):
 
 class Visitor(Person):
 
-    def __init__(self, unique_id, model, female_ratio=0.5, adult_ratio=0.7, familiarity=0.1):
+    def __init__(self, unique_id, model, female_ratio=0.5, adult_ratio=0.7, familiarity=0.1, attributes=None):
 
-        super().__init__(unique_id, model, female_ratio, adult_ratio)
+        super().__init__(unique_id, model, female_ratio, adult_ratio, attributes)
 
-        self.emergency_knowledge.sample_safety_training(probability=familiarity)  # Few visitors had safety training
-        self.emergency_knowledge.knows_exits = self.emergency_knowledge.get_knows_exits(probability=0.1)
+        if attributes is not None:
+            self.emergency_knowledge.had_safety_training = attributes['had_safety_training']
+            self.emergency_knowledge.knows_exits = attributes['knows_exits']
+        else:
+            self.emergency_knowledge.sample_safety_training(probability=familiarity)  # Few visitors had safety training
+            self.emergency_knowledge.knows_exits = self.emergency_knowledge.get_knows_exits(probability=0.1)
 
     def step(self):
+        profiler = self.model.profiler
 
         # Adjust speed given how many people are close by
-        self.move_data.update_speed(self)
+        with profiler.phase('speed_update'):
+            self.move_data.update_speed(self)
 
         if self.model.alarm.is_activated and \
                 not self.emergency_knowledge.informed_by_staff and \
@@ -236,41 +251,47 @@ class Visitor(Person):
                 self.emergency_knowledge.alarm_timer += 1
 
             # Check whether other persons in proximity are evacuating
-            evacuating_ratio = self.scan_environment_for_evacuation(agent_type=Visitor, radius=50)
+            with profiler.phase('environment_scan'):
+                evacuating_ratio = self.scan_environment_for_evacuation(agent_type=Visitor, radius=50)
             if evacuating_ratio >= 0.5 or self.emergency_knowledge.should_leave():
                 self.emergency_knowledge.is_evacuating = True
 
-        self.current_task.do()
+        with profiler.phase('task_do'):
+            self.current_task.do()
 
 
 class Staff(Person):
 
-    def __init__(self, unique_id, model, female_ratio=0.5, adult_ratio=0.7):
+    def __init__(self, unique_id, model, female_ratio=0.5, adult_ratio=0.7, attributes=None):
 
-        super().__init__(unique_id, model, female_ratio, adult_ratio)
+        super().__init__(unique_id, model, female_ratio, adult_ratio, attributes)
 
         self.had_safety_training = True  # All staff had safety training
         self.exit_location = None
 
     def step(self):
+        profiler = self.model.profiler
 
-        self.move_data.update_speed(self)
+        with profiler.phase('speed_update'):
+            self.move_data.update_speed(self)
 
         # Super simple version of knowing about the alarm
         if self.model.alarm.is_activated:
             self.emergency_knowledge.is_evacuating = True
-        self.current_task.do()
+        with profiler.phase('task_do'):
+            self.current_task.do()
 
 
 class EmergencyKnowledge:
 
-    def __init__(self, person):
+    def __init__(self, person, entrance=None):
 
         self.person = person
         self.had_safety_training = False
         self.exit_time = None
         self.exit_location = None
-        self.entered_via = self.sample_entrance()  # from which entrance/exit they entered the building
+        # from which entrance/exit they entered the building
+        self.entered_via = entrance if entrance is not None else self.sample_entrance()
         self.closest_exit = self.entered_via
         self.heard_alarm = False
         self.alarm_timer = 0
@@ -286,7 +307,7 @@ class EmergencyKnowledge:
         :param probability:     float, between 0.0 and 1.0
         :return:                boolean, whether the person had safety training
         """
-        if random.random() <= probability:
+        if self.person.model.random.random() <= probability:
             self.had_safety_training = True
 
     def get_knows_exits(self, probability=0.1):
@@ -302,7 +323,7 @@ class EmergencyKnowledge:
             knows_exits = True
         # people without safety training know the exits with a probability of 0.1 ('probability')
         else:
-            if random.random() <= probability:
+            if self.person.model.random.random() <= probability:
                 knows_exits = True
         return knows_exits
 
@@ -312,10 +333,16 @@ class EmergencyKnowledge:
         :return: closest_exit: Destination.EXIT
         """
 
-        all_exits = self.person.model.destinations[Destination.EXIT]
-        grid = self.person.model.grid
+        model = self.person.model
         origin = self.person.pos
 
+        # Models with precomputed exit distance fields know the closest exit of every cell
+        if hasattr(model, 'get_closest_exit'):
+            return model.get_closest_exit(origin)
+
+        all_exits = model.destinations[Destination.EXIT]
+        grid = model.grid
+
         path_lengths = [len(a_star_search(grid, origin, x)) for x in all_exits]
 
         # Get index of shortest path
@@ -331,7 +358,7 @@ class EmergencyKnowledge:
         :return: random_exit: pos
         """
         exits = self.person.model.destinations[Destination.EXIT]
-        random_exit = random.choice(exits)
+        random_exit = self.person.model.random.choice(exits)
 
         return random_exit
 
@@ -349,7 +376,51 @@ class MovementData:
         self.default_running_speed = self.get_default_speed(Movement.RUNNING)
         self.walking_speed = self.default_walking_speed
         self.running_speed = self.default_running_speed
-        self.path_to_current_dest = []  # First element is current position.
+        # Path that is followed (a tuple shared with model.all_paths, never modified) and the index of the current
+        # position on it. Moving along the path only moves the cursor.
+        self.path = None
+        self.path_cursor = 0
+        self.destination = None  # destination of the current (or last) walk
+
+    @property
+    def path_to_current_dest(self):
+        """
+        The remaining path (a new list); the first element is the current position.
+        """
+        if self.path is None:
+            return []
+        return list(self.path[self.path_cursor:])
+
+    def set_path(self, path, start=0):
+        """
+        Starts following a path.
+        :param path: tuple of positions, path[start] is the current position
+        :param start: int: index of the current position on the path (a suffix of a cached path, see PathCache.lookup)
+        """
+        self.path = path
+        self.path_cursor = start
+
+    def clear_path(self):
+        self.path = None
+        self.path_cursor = 0
+
+    def get_remaining_path_length(self):
+        """
+        Returns the number of positions left on the path, including the current position.
+        :return: int
+        """
+        if self.path is None:
+            return 0
+        return len(self.path) - self.path_cursor
+
+    def advance_on_path(self, stride_length):
+        """
+        Moves stride_length positions along the path (at most to its end) and returns the new position.
+        :param stride_length: int
+        :return: Tuple
+        """
+        self.path_cursor = min(self.path_cursor + stride_length, len(self.path) - 1)
+        return self.path[self.path_cursor]
 
     def get_default_speed(self, movement):
         """
@@ -378,10 +449,14 @@ class MovementData:
     def update_speed(self, person):
         """
         This function adjust the speed of an agent depending on how many neighbors an agent has in its 6 dm radius.
+        Models with a crowd density raster (EvacuationModel) count the neighbors as of the start of the tick.
         :param person: Person
         """
 
-        nr_of_neighbors = person.get_nr_of_neighbors(agent_type=Person, radius=6)
+        if getattr(person.model, 'crowd_density', None) is not None:
+            nr_of_neighbors = person.model.get_nr_of_people_around(person.pos, radius=6)
+        else:
+            nr_of_neighbors = person.get_nr_of_neighbors(agent_type=Person, radius=6)
 
         if nr_of_neighbors <= 0:
             self.walking_speed = self.default_walking_speed
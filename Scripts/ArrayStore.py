@@ -0,0 +1,58 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+def save_arrays(path, arrays, meta=None):
+    """
+    Writes a bundle of numpy arrays as a directory with one .npy file per array (and an optional meta.json).
+    The bundle is written to a temporary directory next to path and then renamed, so readers never see a half-written
+    bundle. If another process already created path, its bundle is kept and this one is discarded.
+
+    :param path: directory name of the bundle
+    :param arrays: dict with array name as key and numpy array as value
+    :param meta: dict (json serializable) with additional information, optional
+    :return: Boolean: whether this call created the bundle
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), array, allow_pickle=False)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as handle:
+            json.dump(meta or {}, handle)
+        os.rename(tmp_path, path)
+        return True
+    except OSError:
+        if os.path.isdir(path):  # someone else was faster, their bundle has the same content
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return False
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def load_arrays(path, mmap=True):
+    """
+    Loads a bundle written by save_arrays. With mmap=True the arrays are memory-mapped read-only, such that only the
+    parts that are actually used are read from disk.
+
+    :param path: directory name of the bundle
+    :param mmap: Boolean
+    :return: arrays: dict with array name as key and numpy array as value
+             meta: dict
+    """
+    arrays = {}
+    for file_name in os.listdir(path):
+        if file_name.endswith('.npy'):
+            arrays[file_name[:-4]] = np.load(os.path.join(path, file_name), mmap_mode='r' if mmap else None,
+                                             allow_pickle=False)
+
+    with open(os.path.join(path, 'meta.json'), 'r') as handle:
+        meta = json.load(handle)
+
+    return arrays, meta
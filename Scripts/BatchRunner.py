@@ -0,0 +1,61 @@
+import time
+
+from Scripts.Enums import ExitType
+from Scripts.EvacuationModel import EvacuationModel
+from Scripts.ParallelRunner import get_job_seed
+from Scripts.VectorizedEngine import VectorizedEngine
+
+
+class BatchRunner:
+    """
+    Runs several replications of an EvacuationModel together. The first replication loads the map and the paths, the
+    others share them (see EvacuationModel.share_map), and one VectorizedEngine steps the persons of all replications
+    at once: their state is stacked into the same arrays, and every row knows its replication. A tick of N
+    replications is then one pass of array operations instead of N.
+    """
+
+    def __init__(self, n_replications=10, model=EvacuationModel, seed=None, **model_kwargs):
+        """
+        :param n_replications: int
+        :param model: EvacuationModel class (or subclass)
+        :param seed: int: seed of the experiment, every replication gets the same seed as in Experiment.run_parallel
+        :param model_kwargs: arguments of the model, e.g. n_visitors or valid_exits
+        """
+        start_t = time.time()
+        valid_exits = model_kwargs.get('valid_exits', ExitType.ABC)
+        seeds = [None if seed is None else get_job_seed(seed, valid_exits, i) for i in range(n_replications)]
+
+        self.seeds = seeds
+        self.models = [model(seed=seeds[0], **model_kwargs)]
+        for replication_seed in seeds[1:]:
+            self.models.append(model(shared_model=self.models[0], seed=replication_seed, **model_kwargs))
+        self.engine = VectorizedEngine(self.models)
+        self.running = list(range(n_replications))  # replications that are not done yet
+        self.setup_time = round(time.time() - start_t, 2)
+
+    def step(self):
+        """
+        Advances all replications that are not done yet by one tick.
+        """
+        for r in self.running:
+            self.models[r].end_time += 1
+        self.engine.step()
+        for r in self.running:
+            self.models[r].datacollector.collect(self.models[r], *self.engine.get_person_state(r))
+        self.running = [r for r in self.running if not self.models[r].is_done()]
+
+    def is_done(self):
+        return not self.running
+
+    def run(self, max_run_length=1000):
+        """
+        Steps the replications until all of them are done (or max_run_length ticks passed).
+        :param max_run_length: int
+        :return: evacuation_times: list with the evacuation time of every replication
+        """
+        for _ in range(max_run_length):
+            self.step()
+            if self.is_done():
+                break
+
+        return [model.get_total_evacuation_time() for model in self.models]
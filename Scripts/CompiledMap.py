@@ -0,0 +1,81 @@
+"""
+Compiled maps: the result of converting a map image into terrain, positions, destinations and exit distance fields,
+stored as a bundle of .npy arrays (see ArrayStore). EvacuationModel memory-maps a compiled map instead of processing
+the image again, so after the first model on a map, model setup is a file open.
+
+Build (or rebuild) the compiled map of an image from the repository root with:
+    python -m Scripts.CompiledMap Images/Library_NewPlan2_map.png
+"""
+import argparse
+from collections.abc import Sequence
+import hashlib
+import os
+import sys
+
+# Increase when the map processing changes in a way that makes previously compiled maps differ from what it would return
+COMPILED_MAP_VERSION = 1
+
+# Folder in the repository root (independent of the working directory of the notebook)
+DEFAULT_MAP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'CompiledMaps')
+
+
+def get_compiled_map_path(img_path, color_path, map_dir=None):
+    """
+    Returns the directory of the compiled map of an image. The name contains a hash of the image and colour definition
+    files, so editing either of them leads to a new compiled map instead of a stale one.
+    :param img_path: map image file path
+    :param color_path: colour definitions (tsv) file path
+    :param map_dir: folder of the compiled maps, defaults to DEFAULT_MAP_DIR
+    :return: str
+    """
+    digest = hashlib.sha256(f'version={COMPILED_MAP_VERSION};'.encode())
+    for file_path in (img_path, color_path):
+        with open(file_path, 'rb') as handle:
+            digest.update(handle.read())
+
+    name = os.path.splitext(os.path.basename(img_path))[0]
+    return os.path.join(map_dir or DEFAULT_MAP_DIR, f'{name}-{digest.hexdigest()[:16]}')
+
+
+class PositionArray(Sequence):
+    """
+    Read-only list of positions (x, y) backed by an (n, 2) array, e.g. a memory-mapped array of a compiled map.
+    Positions are only converted to tuples when they are accessed, so random.sample over a large list of cells is cheap.
+    """
+
+    def __init__(self, array):
+        """
+        :param array: numpy array (n, 2) with x and y per row
+        """
+        self.array = array
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [tuple(pos) for pos in self.array[index].tolist()]
+        x, y = self.array[index].tolist()
+        return x, y
+
+    def __len__(self):
+        return len(self.array)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compiles a map image for EvacuationModel.')
+    parser.add_argument('img_path', help='map image, e.g. Images/Library_NewPlan2_map.png')
+    parser.add_argument('--color-path', default='Images/object_colours.tsv', help='colour definitions (tsv)')
+    parser.add_argument('--map-dir', default=None, help=f'output folder (default: {DEFAULT_MAP_DIR})')
+    args = parser.parse_args()
+
+    from Scripts.EvacuationModel import EvacuationModel  # EvacuationModel imports this module
+
+    path = get_compiled_map_path(args.img_path, args.color_path, args.map_dir)
+    model = EvacuationModel(img_path=args.img_path, color_path=args.color_path, n_visitors=0, compiled_map=False)
+    if model.save_compiled_map(path):
+        print(f"Compiled map written to {path}")
+    else:
+        print(f"Compiled map already exists: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,356 @@
+"""
+Congestion-aware routing to the exits, repaired incrementally while the crowd moves. Every exit has a route: the cost
+to go from every cell to that exit, where entering a cell costs 1 plus a congestion cost that grows with the number of
+persons around it (taken from the model's occupancy raster). When the crowd moves, only the cells whose congestion
+changed are updated, and the routes are repaired with Lifelong Planning A* (LPA*, the search under D* Lite) rooted at
+the exit, instead of searching again from scratch. One route serves every person that walks to its exit, so the
+cost of a tick does not grow with the number of persons, and a budget bounds the work per tick: repairs that do not
+fit continue in the next tick.
+"""
+from array import array
+from heapq import heappush, heappop
+
+import numpy as np
+
+from Scripts.PathFinding import compute_distance_field, UNREACHABLE
+
+# Cost to go of cells that cannot reach the exit (and cost of blocked cells)
+INFINITE_COST = 1 << 30
+
+# Congestion cost of a cell: CONGESTION_WEIGHT per person (beyond the first) within CONGESTION_RADIUS cells, at most
+# MAX_CONGESTION_COST
+CONGESTION_RADIUS = 3
+CONGESTION_WEIGHT = 2
+MAX_CONGESTION_COST = 30
+
+# Cells only get a new congestion cost if it differs from the one the routes use by at least this much (a crowd that
+# shuffles a little does not trigger repairs)
+MIN_COST_CHANGE = 8
+
+# A person only switches to another exit if that saves at least this much cost
+REROUTE_MARGIN = 20
+
+
+class ExitRoute:
+    """
+    Cost to go from every cell of a SearchSpace to one exit, kept up to date with LPA* over the reversed grid: g is the
+    cost to go per flat cell index, rhs the one-step lookahead (min over the neighbours u of cost[u] + g[u]), and the
+    queue holds the cells where both differ (a lazy heap: entries whose key is outdated are skipped).
+    """
+
+    def __init__(self, space, exit, distance, costs):
+        """
+        :param space: SearchSpace
+        :param exit: position (tuple) of the exit
+        :param distance: numpy int array (height, width): steps to the exit, UNREACHABLE if none (the cost to go while
+                         nobody is around, see compute_distance_field)
+        :param costs: array of the cost of entering every cell (shared by all routes, see CongestionRouter)
+        """
+        self.space = space
+        self.exit = exit
+        self.source = space.to_index(exit)
+        self.costs = costs
+
+        padded = np.full((space.height + 2, space.stride), INFINITE_COST, dtype=np.int64)
+        padded[1:-1, 1:-1] = np.where(distance == UNREACHABLE, INFINITE_COST, distance)
+        self.g = array('q', padded.ravel().tolist())
+        self.rhs = array('q', self.g)
+        self.queue = []
+
+    def get_cost_to_go(self, pos):
+        """
+        Returns the cost to go from a position to the exit. While a repair passes a cell, either of g and rhs can be
+        INFINITE_COST for a moment (g of a cell that got more expensive is reset before it is settled again), so the
+        estimate is the lower of both.
+        :param pos: Tuple
+        :return: int: cost to go, INFINITE_COST if the exit cannot be reached (or the repair has not settled the cell)
+        """
+        index = self.space.to_index(pos)
+        return min(self.g[index], self.rhs[index])
+
+    def get_horizon(self, cells):
+        """
+        Returns the horizon of repair that covers the given cells: the highest cost to go among them (cells that a
+        repair has just reset are reached again when their neighbours are settled).
+        :param cells: numpy int array of flat indices
+        :return: int
+        """
+        if not len(cells):
+            return 0
+        g = np.frombuffer(self.g, dtype=np.int64)
+        rhs = np.frombuffer(self.rhs, dtype=np.int64)
+        cost_to_go = np.minimum(g[cells], rhs[cells])
+        cost_to_go = cost_to_go[cost_to_go < INFINITE_COST]  # cells that the repair has not settled yet
+        return int(cost_to_go.max()) if len(cost_to_go) else 0
+
+    def is_settled(self, pos):
+        """
+        :param pos: Tuple
+        :return: Boolean: whether the exit can be reached from pos and no repair is pending there
+        """
+        index = self.space.to_index(pos)
+        return self.g[index] == self.rhs[index] < INFINITE_COST
+
+    def is_repaired(self, horizon=INFINITE_COST):
+        """
+        :param horizon: int: cost to go up to which the route must be consistent
+        :return: Boolean: whether no repair is pending (up to the horizon)
+        """
+        return not self.queue or self.queue[0][0] > horizon
+
+    def update_cell(self, index):
+        """
+        Recomputes the lookahead of a cell and queues it if it became inconsistent.
+        :param index: int: flat index
+        """
+        if index == self.source or not self.space.walkable[index]:
+            return
+        g, costs = self.g, self.costs
+        right, left, down, up = index + 1, index - 1, index + self.space.stride, index - self.space.stride
+        rhs = min(costs[right] + g[right], costs[left] + g[left], costs[down] + g[down], costs[up] + g[up],
+                  INFINITE_COST)
+        self.rhs[index] = rhs
+        if rhs != g[index]:
+            heappush(self.queue, (min(rhs, g[index]), index))
+
+    def update_costs(self, cells, old_costs):
+        """
+        Updates the lookahead of the neighbours of cells whose cost changed (the cost of entering a cell is the cost
+        of the edges from its neighbours). A cheaper cell can only lower a lookahead, and a more expensive one only
+        matters to the neighbours whose lookahead went through it, so most neighbours take a single comparison.
+        :param cells: list of flat indices (self.costs already holds their new cost)
+        :param old_costs: list of their previous costs
+        :return: int: number of cells
+        """
+        g, rhs, costs, queue = self.g, self.rhs, self.costs, self.queue
+        walkable, offsets, source = self.space.walkable, self.space.offsets, self.source
+        update_cell = self.update_cell
+        for index, old_cost in zip(cells, old_costs):
+            g_index = g[index]
+            if g_index >= INFINITE_COST:
+                continue
+            new, old = costs[index] + g_index, old_cost + g_index
+            for offset in offsets:
+                neighbor = index + offset
+                if new < old:
+                    if new < rhs[neighbor] and neighbor != source and walkable[neighbor]:
+                        rhs[neighbor] = new
+                        heappush(queue, (min(new, g[neighbor]), neighbor))
+                elif rhs[neighbor] == old:
+                    update_cell(neighbor)
+        return len(cells)
+
+    def repair(self, budget, horizon=INFINITE_COST):
+        """
+        Processes the queue in the order of LPA* until the route is consistent up to the horizon or budget cells were
+        expanded. Like D* Lite, which stops once the start of its search is settled, cells that cost more than the
+        horizon to go (i.e. farther away than every person) are left for later.
+        :param budget: int: maximum number of expansions
+        :param horizon: int: cost to go up to which the route must be consistent
+        :return: int: number of expansions
+        """
+        g, rhs, costs, queue = self.g, self.rhs, self.costs, self.queue
+        walkable, offsets, source = self.space.walkable, self.space.offsets, self.source
+        update_cell = self.update_cell
+        n_expanded = 0
+        while queue and n_expanded < budget and queue[0][0] <= horizon:
+            key, index = heappop(queue)
+            g_index, rhs_index = g[index], rhs[index]
+            if g_index == rhs_index or key != min(g_index, rhs_index):
+                continue  # outdated entry
+            n_expanded += 1
+            if g_index > rhs_index:  # cheaper than before: settle it and relax its neighbours
+                g[index] = rhs_index
+                cost = costs[index] + rhs_index
+                for offset in offsets:
+                    neighbor = index + offset
+                    if cost < rhs[neighbor] and neighbor != source and walkable[neighbor]:
+                        rhs[neighbor] = cost
+                        heappush(queue, (min(cost, g[neighbor]), neighbor))
+            else:  # more expensive than before: invalidate it and the neighbours whose lookahead went through it
+                g[index] = INFINITE_COST
+                update_cell(index)
+                cost = costs[index] + g_index
+                for offset in offsets:
+                    neighbor = index + offset
+                    if rhs[neighbor] == cost:
+                        update_cell(neighbor)
+        return n_expanded
+
+    def descend(self, pos, n_steps):
+        """
+        Moves up to n_steps cells towards the exit, every step to the neighbour with the lowest entry cost plus cost to
+        go, among the settled neighbours with a lower cost to go (so a person never walks in circles or into a part of
+        the route that is being repaired). Stops at the exit, or where no neighbour qualifies.
+        :param pos: Tuple: current position
+        :param n_steps: int
+        :return: new position (tuple)
+        """
+        g, costs = self.g, self.costs
+        offsets = self.space.offsets
+        index = self.space.to_index(pos)
+        for _ in range(n_steps):
+            current = g[index]
+            best, best_value = -1, INFINITE_COST
+            for offset in offsets:
+                neighbor = index + offset
+                if g[neighbor] < current and costs[neighbor] + g[neighbor] < best_value:
+                    best, best_value = neighbor, costs[neighbor] + g[neighbor]
+            if best < 0:
+                break
+            index = best
+        return self.space.to_pos(index)
+
+
+class CongestionRouter:
+    """
+    The routes to a list of exits, over costs that follow the crowd: call update with the positions of the persons
+    once per tick, then walk with ExitRoute.descend and choose exits with get_best_exit.
+    """
+
+    def __init__(self, space, exits, budget=2000, radius=CONGESTION_RADIUS, weight=CONGESTION_WEIGHT,
+                 max_cost=MAX_CONGESTION_COST, min_change=MIN_COST_CHANGE, reroute_margin=REROUTE_MARGIN):
+        """
+        :param space: SearchSpace
+        :param exits: list of positions (tuples)
+        :param budget: int: maximum number of cost updates and expansions per tick (all routes together)
+        :param radius: int: radius (cells) of the neighbourhood whose persons make a cell congested
+        :param weight: int: congestion cost per person
+        :param max_cost: int: maximum congestion cost of a cell
+        :param min_change: int: smallest change of the congestion cost of a cell that is applied
+        :param reroute_margin: int: cost that another exit must save before get_best_exit switches to it
+        """
+        self.space = space
+        self.budget = budget
+        self.radius = radius
+        self.weight = weight
+        self.max_cost = max_cost
+        self.min_change = min_change
+        self.reroute_margin = reroute_margin
+
+        self.walkable = walkable = space.mask.reshape(space.height + 2, space.stride)[1:-1, 1:-1]
+        self.congestion = np.zeros(walkable.size, dtype=np.int64)  # congestion cost that the routes use, per cell
+        self.congested = np.zeros(0, dtype=np.int64)  # cells (y * width + x) with a congestion cost, sorted
+        self.blocked = np.zeros(0, dtype=np.int64)  # blocked cells, sorted
+        self.costs = array('q', [1]) * space.size
+        self.routes = {tuple(pos): ExitRoute(space, tuple(pos), compute_distance_field(walkable, [pos])[0], self.costs)
+                       for pos in exits}
+        self.stats = {'updates': 0, 'cells_changed': 0, 'cells_deferred': 0, 'expanded': 0}
+
+    def get_congestion(self, positions):
+        """
+        Returns the cells with a congestion cost for the given positions of the persons, and their cost (blocked cells
+        cost INFINITE_COST). Only the neighbourhoods of the persons are counted, so the cost does not depend on the size
+        of the map.
+        :param positions: numpy int array (n, 2): position of every person
+        :return: numpy int64 arrays: sorted cells (y * width + x), their congestion cost
+        """
+        r = self.radius
+        height, width = self.walkable.shape
+        dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+        around_y = (positions[:, 1, None] + dy.ravel()).ravel()
+        around_x = (positions[:, 0, None] + dx.ravel()).ravel()
+        inside = (around_y >= 0) & (around_y < height) & (around_x >= 0) & (around_x < width)
+
+        cells, around = np.unique(around_y[inside] * width + around_x[inside], return_counts=True)
+        congestion = np.minimum(self.weight * (around - 1), self.max_cost).astype(np.int64)
+        cells, congestion = cells[congestion > 0], congestion[congestion > 0]
+
+        if len(self.blocked):
+            merged = np.union1d(cells, self.blocked)
+            merged_congestion = np.zeros(len(merged), dtype=np.int64)
+            merged_congestion[np.searchsorted(merged, cells)] = congestion
+            merged_congestion[np.searchsorted(merged, self.blocked)] = INFINITE_COST
+            cells, congestion = merged, merged_congestion
+        return cells, congestion
+
+    def set_blocked(self, positions, blocked=True):
+        """
+        Blocks cells (e.g. a closed door or a fire) or opens them again; the routes take this into account in the next
+        update.
+        :param positions: list of positions (tuples)
+        :param blocked: Boolean
+        """
+        width = self.walkable.shape[1]
+        cells = np.array([y * width + x for x, y in positions], dtype=np.int64)
+        if blocked:
+            self.blocked = np.union1d(self.blocked, cells)
+        else:
+            self.blocked = np.setdiff1d(self.blocked, cells)
+
+    def update(self, positions):
+        """
+        Brings the costs up to date with the positions of the persons and repairs the routes, within the budget: cells
+        whose cost changed by at least min_change are applied first, largest changes first and at most half of the
+        budget (the others in a later tick), and the rest of the budget goes to the repairs, up to the cost to go of
+        the farthest person.
+        :param positions: numpy int array (n, 2): position of every person
+        :return: int: number of cost updates and expansions in this tick
+        """
+        cells, congestion = self.get_congestion(positions)
+        candidates = np.union1d(cells, self.congested)  # the cells that are congested now or were before
+        target = np.zeros(len(candidates), dtype=np.int64)
+        target[np.searchsorted(candidates, cells)] = congestion
+        change = np.abs(target - self.congestion[candidates])
+        changed = np.flatnonzero((change >= self.min_change) & self.walkable.ravel()[candidates])
+
+        n_routes = max(len(self.routes), 1)
+        n_applied = min(len(changed), self.budget // (2 * n_routes))
+        self.stats['cells_deferred'] += len(changed) - n_applied
+        if n_applied < len(changed):
+            changed = changed[np.argsort(-change[changed], kind='stable')[:n_applied]]
+        self.congestion[candidates[changed]] = target[changed]
+        self.congested = candidates[self.congestion[candidates] != 0]
+
+        ys, xs = np.divmod(candidates[changed], self.walkable.shape[1])
+        indices = ((ys + 1) * self.space.stride + xs + 1).tolist()
+        old_costs = [self.costs[index] for index in indices]
+        for index, cost in zip(indices, (1 + target[changed]).tolist()):
+            self.costs[index] = min(cost, INFINITE_COST)
+
+        work = 0
+        for route in self.routes.values():
+            work += route.update_costs(indices, old_costs)
+        occupied = (positions[:, 1] + 1) * self.space.stride + positions[:, 0] + 1
+        for route in self.routes.values():
+            work += route.repair(max((self.budget - work) // n_routes, 0), horizon=route.get_horizon(occupied))
+
+        self.stats['updates'] += 1
+        self.stats['cells_changed'] += len(indices)
+        self.stats['expanded'] += work
+        return work
+
+    def get_route(self, exit):
+        """
+        :param exit: position (tuple)
+        :return: ExitRoute or None if the exit has no route
+        """
+        return self.routes.get(tuple(exit))
+
+    def get_best_exit(self, pos, current_exit=None):
+        """
+        Returns the exit with the lowest cost to go from a position, but keeps the current exit unless another one is
+        cheaper by at least reroute_margin (persons do not change their mind over small differences).
+        :param pos: Tuple
+        :param current_exit: position (tuple) of the exit the person is walking to, optional
+        :return: position (tuple) of the exit, or current_exit if no exit can be reached
+        """
+        costs = {exit: route.get_cost_to_go(pos) for exit, route in self.routes.items()}
+        best = min(costs, key=costs.get, default=None)
+        if best is None or costs[best] >= INFINITE_COST:
+            return current_exit
+        if current_exit not in self.routes:
+            return best
+        current_cost = costs[current_exit]
+        if current_cost >= INFINITE_COST and not self.routes[current_exit].is_repaired():
+            return current_exit  # a repair is passing: wait for it rather than switch on a transient value
+        if costs[best] + self.reroute_margin <= current_cost:
+            return best
+        return current_exit
+
+    def get_stats(self):
+        """
+        :return: dict with the number of updates, changed and deferred cells, cost updates and expansions, and entries
+                 left in the queues of the routes
+        """
+        return dict(self.stats, queued=sum(len(route.queue) for route in self.routes.values()))
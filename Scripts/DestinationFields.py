@@ -0,0 +1,260 @@
+"""
+Distance tables of the walk destinations (desks, shelves and helpdesks): one breadth-first distance field per
+destination cell, such that walking to a destination is a descent on its field instead of an A* search. The fields
+only store the walkable cells of the map (as uint16 steps), which makes them about half as large as full rasters, and
+they are stored as an array bundle next to the compiled map (see ArrayStore), so they are computed once per map.
+
+Build (or rebuild) the fields of a map from the repository root with:
+    python -m Scripts.DestinationFields Images/Library_NewPlan2_map.png --n-workers 4
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import sys
+import time
+
+import numpy as np
+
+from Scripts.ArrayStore import save_arrays, load_arrays
+from Scripts.Enums import Destination
+from Scripts.PathFinding import compute_distance_field, UNREACHABLE, NEIGHBOR_OFFSETS
+
+# Increase when the fields change in a way that makes previously stored fields differ from what build would return
+DESTINATION_FIELDS_VERSION = 1
+
+# Destinations of visitor walks that get a distance field
+FIELD_DESTINATIONS = (Destination.DESK, Destination.SHELF, Destination.HELPDESK)
+
+# Value of a stored field for cells from which the destination cannot be reached
+FIELD_UNREACHABLE = np.iinfo(np.uint16).max
+
+
+def get_destination_fields_path(compiled_map_path):
+    """
+    Returns the directory of the destination fields of a compiled map.
+    :param compiled_map_path: directory of the compiled map (see CompiledMap.get_compiled_map_path)
+    :return: str
+    """
+    return f'{compiled_map_path}-destinations-v{DESTINATION_FIELDS_VERSION}'
+
+
+class DestinationFields:
+    """
+    Distance fields of a list of destination cells. distances[k, cell_index[y, x]] is the number of steps from (x, y)
+    to destination k (FIELD_UNREACHABLE if there is no path); cell_index is -1 for cells that are not stored.
+    """
+
+    def __init__(self, destinations, cell_index, distances):
+        """
+        :param destinations: list of positions (tuples), one per field
+        :param cell_index: numpy int32 array (height, width): column of every stored cell in distances, -1 otherwise
+        :param distances: numpy uint16 array (len(destinations), number of stored cells)
+        """
+        self.destinations = destinations
+        self.field_ids = {pos: k for k, pos in enumerate(destinations)}
+        self.cell_index = cell_index
+        self.distances = distances
+
+    @classmethod
+    def build(cls, walkable, destinations, n_workers=1):
+        """
+        Computes the distance fields of all destinations with a breadth-first search each (compute_distance_field),
+        spread over a ProcessPoolExecutor.
+        :param walkable: numpy bool array (height, width)
+        :param destinations: list of positions (tuples), duplicates get one field
+        :param n_workers: int: number of processes (None: all CPUs, 1: no process pool)
+        :return: DestinationFields
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        destinations = list(dict.fromkeys(tuple(pos) for pos in destinations))
+
+        stored = walkable.copy()
+        for x, y in destinations:
+            stored[y, x] = True
+        cell_index = np.full(walkable.shape, -1, dtype=np.int32)
+        cells = np.flatnonzero(stored)
+        cell_index.ravel()[cells] = np.arange(len(cells), dtype=np.int32)
+        distances = np.empty((len(destinations), len(cells)), dtype=np.uint16)
+
+        chunks = [chunk.tolist() for chunk in np.array_split(np.arange(len(destinations)), 4 * n_workers)
+                  if len(chunk)]
+        if n_workers == 1 or len(chunks) <= 1:
+            _init_field_worker(walkable, cells)
+            for chunk in chunks:
+                distances[chunk] = _run_field_job([destinations[k] for k in chunk])
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_field_worker,
+                                     initargs=(walkable, cells)) as executor:
+                futures = {executor.submit(_run_field_job, [destinations[k] for k in chunk]): chunk
+                           for chunk in chunks}
+                for future in as_completed(futures):
+                    distances[futures[future]] = future.result()
+
+        return cls(destinations, cell_index, distances)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads fields written by save(); the distances are memory-mapped, so only the fields in use are read.
+        :param path: directory of the fields
+        :return: DestinationFields
+        """
+        arrays, _ = load_arrays(path, mmap=True)
+        return cls([(x, y) for x, y in arrays['destinations'].tolist()], arrays['cell_index'], arrays['distances'])
+
+    def save(self, path, meta=None):
+        """
+        Writes the fields as a bundle of arrays (see ArrayStore.save_arrays).
+        :param path: directory of the fields
+        :param meta: dict with additional information, optional
+        :return: Boolean: whether this call created the bundle (False if another process was faster)
+        """
+        arrays = {'destinations': np.array(self.destinations, dtype=np.int32).reshape(-1, 2),
+                  'cell_index': self.cell_index,
+                  'distances': self.distances}
+        meta = dict(meta or {}, n_fields=len(self.destinations), version=DESTINATION_FIELDS_VERSION,
+                    created=time.strftime('%Y-%m-%d %H:%M:%S'))
+        return save_arrays(path, arrays, meta)
+
+    def get_field_id(self, destination):
+        """
+        Returns the field of a destination, or -1 if it has none.
+        :param destination: Tuple
+        :return: int
+        """
+        return self.field_ids.get(tuple(destination), -1)
+
+    def get_distance(self, field_id, pos):
+        """
+        Returns the number of steps from a position to the destination of a field (FIELD_UNREACHABLE if none).
+        :param field_id: int
+        :param pos: Tuple
+        :return: int
+        """
+        index = self.cell_index[pos[1], pos[0]]
+        return int(self.distances[field_id, index]) if index >= 0 else FIELD_UNREACHABLE
+
+    def descend(self, field_id, pos, n_steps):
+        """
+        Moves up to n_steps cells downhill on a field, i.e. along a shortest path to its destination (same steps as
+        PathFinding.descend_distance_field). Positions that cannot reach the destination are returned unchanged.
+        :param field_id: int
+        :param pos: Tuple: current position
+        :param n_steps: int: number of cells to move
+        :return: new position (tuple)
+        """
+        field = self.distances[field_id]
+        cell_index = self.cell_index
+        height, width = cell_index.shape
+        x, y = pos
+        distance = self.get_distance(field_id, pos)
+        if distance == FIELD_UNREACHABLE:
+            return pos
+
+        for _ in range(n_steps):
+            if distance == 0:
+                break
+            for dx, dy in NEIGHBOR_OFFSETS:
+                next_x, next_y = x + dx, y + dy
+                if 0 <= next_x < width and 0 <= next_y < height:
+                    index = cell_index[next_y, next_x]
+                    if index >= 0 and field[index] == distance - 1:
+                        x, y = next_x, next_y
+                        distance -= 1
+                        break
+
+        return x, y
+
+    def get_distances(self, field_ids, x, y):
+        """
+        Returns get_distance for many persons at once.
+        :param field_ids: numpy int array
+        :param x: numpy int array
+        :param y: numpy int array
+        :return: numpy int64 array
+        """
+        index = self.cell_index[y, x]
+        distance = self.distances[field_ids, np.maximum(index, 0)].astype(np.int64)
+        return np.where(index >= 0, distance, FIELD_UNREACHABLE)
+
+    def descend_many(self, field_ids, x, y, n_steps):
+        """
+        Moves many persons up to n_steps cells down their field at once (same steps as descend).
+        :param field_ids: numpy int array
+        :param x: numpy int array
+        :param y: numpy int array
+        :param n_steps: numpy int array
+        :return: new x and y (numpy int arrays)
+        """
+        height, width = self.cell_index.shape
+        x, y = x.copy(), y.copy()
+        distance = self.get_distances(field_ids, x, y)
+        n_steps = np.where(distance == FIELD_UNREACHABLE, 0, n_steps)
+
+        for step in range(int(n_steps.max()) if len(n_steps) else 0):
+            going = (step < n_steps) & (distance > 0)
+            if not np.any(going):
+                break
+            moved = np.zeros(len(x), dtype=bool)
+            for dx, dy in NEIGHBOR_OFFSETS:
+                next_x, next_y = x + dx, y + dy
+                candidate = going & ~moved & (next_x >= 0) & (next_x < width) & (next_y >= 0) & (next_y < height)
+                candidate[candidate] = self.get_distances(field_ids[candidate], next_x[candidate],
+                                                          next_y[candidate]) == distance[candidate] - 1
+                x = np.where(candidate, next_x, x)
+                y = np.where(candidate, next_y, y)
+                moved |= candidate
+            distance = np.where(moved, distance - 1, distance)
+
+        return x, y
+
+
+# Walkability and stored cells of a field worker process, set by _init_field_worker
+_worker_walkable = None
+_worker_cells = None
+
+
+def _init_field_worker(walkable, cells):
+    """
+    Initializer of the DestinationFields.build worker processes.
+    """
+    global _worker_walkable, _worker_cells
+    _worker_walkable = walkable
+    _worker_cells = cells
+
+
+def _run_field_job(destinations):
+    """
+    Computes the fields of some destinations over the stored cells in a field worker process.
+    :return: numpy uint16 array (len(destinations), number of stored cells)
+    """
+    fields = np.empty((len(destinations), len(_worker_cells)), dtype=np.uint16)
+    for k, destination in enumerate(destinations):
+        distance = compute_distance_field(_worker_walkable, [destination])[0].ravel()[_worker_cells]
+        fields[k] = np.where((distance == UNREACHABLE) | (distance >= FIELD_UNREACHABLE), FIELD_UNREACHABLE, distance)
+    return fields
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Computes the destination fields of a map for EvacuationModel.')
+    parser.add_argument('img_path', help='map image, e.g. Images/Library_NewPlan2_map.png')
+    parser.add_argument('--color-path', default='Images/object_colours.tsv', help='colour definitions (tsv)')
+    parser.add_argument('--n-workers', type=int, default=None, help='number of processes (default: all CPUs)')
+    args = parser.parse_args()
+
+    from Scripts.EvacuationModel import EvacuationModel  # EvacuationModel imports this module
+
+    model = EvacuationModel(img_path=args.img_path, color_path=args.color_path, n_visitors=0,
+                            destination_fields=False)
+    path = get_destination_fields_path(model.compiled_map_path)
+    start_t = time.time()
+    if model.compute_destination_fields(path, n_workers=args.n_workers):
+        print(f"Destination fields written to {path} ({round(time.time() - start_t, 1)} s)")
+    else:
+        print(f"Destination fields already exist: {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
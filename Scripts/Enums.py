@@ -1,4 +1,4 @@
-from enum import Enum
+from enum import Enum, IntEnum
 
 
 class BasicTaskName(Enum):
@@ -60,3 +60,25 @@ class ExitType(Enum):
     BC = 4
     AC = 5
     ABC = 6
+
+
+class CellType(IntEnum):
+    """
+    This enum contains the static cell types of the terrain raster (stored as uint8). Plain floor and doors are FLOOR.
+    """
+    FLOOR = 0
+    WALL = 1
+    OBSTACLE = 2
+    OUT_OF_BOUNDS = 3
+    DESK = 4
+    DESK_INTERACTIVE = 5
+    HELPDESK = 6
+    HELPDESK_INTERACTIVE_FOR_HELPER = 7
+    HELPDESK_INTERACTIVE_FOR_HELPEE = 8
+    OFFICE = 9
+    SHELF = 10
+    SHELF_INTERACTIVE = 11
+    EXIT = 12
+    EXITA = 13
+    EXITB = 14
+    EXITC = 15
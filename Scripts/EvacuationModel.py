@@ -1,21 +1,44 @@
 from PIL import Image
 import numpy as np
 import pandas as pd
-import time, pickle, os
+import time, pickle, os, glob, shutil, random
 from ast import literal_eval
+from functools import partial
 from mesa import Model
 from mesa.time import RandomActivation
 from mesa.space import MultiGrid
-from mesa.datacollection import DataCollector
 
 import Scripts.InanimateAgents as IA
 from Scripts.AnimateAgents import *
 from Scripts.Enums import *
-from Scripts.PathFinding import a_star_search
+from Scripts.PathFinding import a_star_search, batch_a_star_search, compute_distance_field, get_search_space, \
+    UNWALKABLE_OBJECTS, UNREACHABLE
+from Scripts.CompiledMap import PositionArray, get_compiled_map_path, COMPILED_MAP_VERSION
+from Scripts.ArrayStore import save_arrays, load_arrays
+from Scripts.PathCache import PathCache, get_path_cache_key, DEFAULT_CACHE_DIR
+from Scripts.HierarchicalPathFinding import hierarchical_search, get_abstract_graph, get_hierarchy_path
+from Scripts.DestinationFields import DestinationFields, get_destination_fields_path, FIELD_DESTINATIONS, \
+    FIELD_UNREACHABLE
+from Scripts.CongestionRouting import CongestionRouter
+from Scripts.Terrain import TerrainGrid, get_cell_type
+from Scripts.SpatialIndex import CrowdTable
+from Scripts.VarianceReduction import AntitheticRandom
+from Scripts.VectorizedEngine import VectorizedEngine
+from Scripts.MetricsRecorder import MetricsRecorder
+from Scripts.Profiler import Profiler, NULL_PROFILER
 
 # current_img_path = 'Images/Library_ToyPlan2_v1.png'
 current_img_path = 'Images/Library_NewPlan2_map.png'
 
+# Exit groups (sub destinations) that are open for each exit type
+EXIT_GROUPS = {ExitType.A: [Destination.EXITA],
+               ExitType.B: [Destination.EXITB],
+               ExitType.C: [Destination.EXITC],
+               ExitType.AB: [Destination.EXITA, Destination.EXITB],
+               ExitType.BC: [Destination.EXITB, Destination.EXITC],
+               ExitType.AC: [Destination.EXITA, Destination.EXITC],
+               ExitType.ABC: [Destination.EXITA, Destination.EXITB, Destination.EXITC]}
+
 
 def nprgb_to_hex(row):
     """
@@ -26,6 +49,26 @@ def nprgb_to_hex(row):
     return str('%02x%02x%02x' % (row[0], row[1], row[2]))
 
 
+def pack_rgb(rgb):
+    """
+    Packs the R, G and B channels of an array (..., >=3) into one uint32 key per colour.
+    :param rgb: numpy array
+    :return: numpy uint32 array
+    """
+    rgb = np.asarray(rgb)
+    return (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2].astype(np.uint32)
+
+
+def unpack_rgb(keys):
+    """
+    Inverse of pack_rgb.
+    :param keys: numpy uint32 array
+    :return: numpy uint8 array (..., 3)
+    """
+    keys = np.asarray(keys, dtype=np.uint32)
+    return np.stack([(keys >> 16) & 255, (keys >> 8) & 255, keys & 255], axis=-1).astype(np.uint8)
+
+
 def get_border_dims(img_path=current_img_path):
     """
     Returns height and width values of an image. Used for creating a canvas before the model call. Hacky.
@@ -44,29 +87,74 @@ class EvacuationModel(Model):
     (Requires external txt file detailing the colours to agents)
     img_path='Images/Library_NewPlan2_map.png'
     img_path='Images/Library_ToyPlan2_v1.png'
+    compiled_map=True: load the compiled map of img_path (created on first use, see CompiledMap.py),
+    compiled_map='CompiledMaps/...': load this compiled map, compiled_map=False: always process the image
+    engine='object': step every agent on its own, engine='vectorized': step all persons at once (see VectorizedEngine.py)
+    sync_agents: with engine='vectorized', write the state of the persons back into their agents and the grid after
+    every tick, for the visualization and other readers of agent.pos (without it, agents keep their initial state)
+    shared_model: model on the same map whose static data (map and paths) is reused instead of loaded, e.g. replications
+    seed: seed of the model's random generators (self.random for all draws of agents and tasks, self.np_random for
+    drawing the attributes of persons in bulk), None for a random seed
+    antithetic: draw 1 - u for every uniform draw u of the model with the same seed (see VarianceReduction.py)
+    max_run_length: number of ticks the metrics recorder (self.datacollector, see MetricsRecorder.py) keeps
+    profile: measure the time of the phases of every tick in self.profiler (see Profiler.py)
+    path_cache_size, path_cache_bytes: bounds of the paths that self.all_paths keeps in memory (LRU, None for no
+    bound), share_path_suffixes: serve paths from any cell on a cached path (see PathCache.py)
+    destination_fields: walk to desks, shelves and helpdesks down precomputed distance fields instead of A* paths
+    (only with a compiled map; the first model builds them on all CPUs and stores about 270 MB next to the compiled
+    map, so they are off by default, see DestinationFields.py)
+    pathfinding='astar': find the paths that are not cached with A* (shortest paths), pathfinding='hierarchical': with
+    HPA* over clusters of the map (much faster, paths about 5% longer, see HierarchicalPathFinding.py),
+    pathfinding='jps': with Jump Point Search (shortest paths like A*, about 12x faster on the library map)
+    congestion_replanning: evacuating persons walk to their exit along routes that avoid crowded cells, repaired
+    incrementally every tick with at most replanning_budget cell updates, and staff and visitors that know the exits
+    switch to less crowded exits (object engine only, see CongestionRouting.py)
     """
 
     def __init__(self, img_path=current_img_path,
                  color_path='Images/object_colours.tsv', n_visitors=50, n_officestaff=10, female_ratio=0.5,
-                 adult_ratio=0.5, familiarity=0.1, valid_exits=ExitType.ABC):
+                 adult_ratio=0.5, familiarity=0.1, valid_exits=ExitType.ABC, compiled_map=True,
+                 engine='object', sync_agents=False, shared_model=None, seed=None, antithetic=False,
+                 max_run_length=1000, profile=False, path_cache_size=20000, path_cache_bytes=None,
+                 share_path_suffixes=False, destination_fields=False, pathfinding='astar',
+                 congestion_replanning=False, replanning_budget=2000):
         super().__init__()
+        # own generators per model (not module or class level), so models in one process do not share random numbers
+        self.antithetic = antithetic
+        self.random = AntitheticRandom(seed) if antithetic else random.Random(seed)
+        self.np_random = np.random.default_rng(self.random.getrandbits(64))
+        self.profiler = Profiler() if profile else NULL_PROFILER
+        self.img_path = img_path
         self.female_ratio = female_ratio
         self.adult_ratio = adult_ratio
         self.familiarity = familiarity
         self.valid_exits = valid_exits
+        self.path_cache_limits = {'max_paths': path_cache_size, 'max_bytes': path_cache_bytes,
+                                  'share_suffixes': share_path_suffixes}
 
         self.id_counter = 0
         self.n_staff = 0
         self.n_visitors = n_visitors
         self.n_officestaff = n_officestaff
         self.safe_agents = set()
+        self.exit_usage = {}  # exit position -> number of persons that left through it
 
         # stores spawnable points in list
         self.spawnable_positions = []
         self.office_positions = []
         self.helpdesk_positions = []
         self.staff_agents = []
-        self.all_paths = {}  # dict of all paths from office spots to all exits.
+        self.all_paths = {}  # PathCache (dict-like) of all paths from office spots to all exits.
+        self.exit_distance_fields = {}  # per exit type: steps from every cell to the closest open exit
+        self.exit_field_labels = {}  # per exit type: index (in exit_field_sources) of the closest open exit per cell
+        self.exit_field_sources = {}  # per exit type: list of exit cells
+        self.exit_cell_fields = {}  # exit cell -> distance field of its exit group, see get_exit_distance_field
+        self.destination_fields = None  # DestinationFields of the desks, shelves and helpdesks
+        self.occupancy = None  # number of persons per cell at the start of the current tick
+        self.crowd_density = None  # CrowdTable (summed-area table) of self.occupancy
+        self.person_positions = None  # numpy int array (n, 2) of the positions that self.occupancy counts
+        self.counted_rows = None  # positions and placed flags of the grid's agent_positions that self.occupancy counts
+        self.router = None  # CongestionRouter of the exits, with congestion_replanning
         self.step_start = True
 
         self.destinations = {Destination.DESK: [],
@@ -77,15 +165,85 @@ class EvacuationModel(Model):
                              Destination.EXITC: [],
                              Destination.HELPDESK: []}
 
-        im = Image.open(img_path)
-        im_np = np.array(im)
-        self.gridsize = im_np.shape[:-1]  # pixel size of map (incl. out of bounds area)
-        self.grid = MultiGrid(width=self.gridsize[1], height=self.gridsize[0], torus=False)
+        # the map image is processed once and then loaded from its compiled map (see CompiledMap.py)
+        if shared_model is not None:
+            self.compiled_map_path = shared_model.compiled_map_path
+            map_loaded = True
+        elif compiled_map is True:
+            self.compiled_map_path = get_compiled_map_path(img_path, color_path)
+            map_loaded = os.path.isdir(self.compiled_map_path)
+        else:  # path of a compiled map, or False to always process the image
+            self.compiled_map_path = compiled_map or None
+            map_loaded = self.compiled_map_path is not None
+        if shared_model is not None:
+            self.share_map(shared_model)
+        elif map_loaded:
+            self.load_compiled_map(self.compiled_map_path)
+        else:
+            self.process_map_image(img_path, color_path)
+
+        self.grid = TerrainGrid(self.terrain, torus=False, tracked_type=Person)
+        if profile:
+            self.grid.agent_index.stats = self.profiler.counters
         self.schedule = RandomActivation(self)
 
         self.alarm = IA.Alarm(self.next_id(), self)
         self.end_time = - self.alarm.starting_time
         self.grid.place_agent(self.alarm, (100, 100))
+
+        self.not_spawnable_objects = [IA.Wall, IA.Obstacle,
+                                      IA.Desk, IA.OutOfBounds, IA.Exit,
+                                      IA.ExitA, IA.ExitB, IA.ExitC,
+                                      IA.HelpDesk,
+                                      IA.Shelf, IA.DeskInteractive,
+                                      IA.HelpdeskInteractiveForHelpee,
+                                      IA.HelpdeskInteractiveForHelper,
+                                      IA.ShelfInteractive]
+        if not map_loaded:
+            self.compute_exit_distance_fields()
+            if compiled_map is True:
+                self.save_compiled_map(self.compiled_map_path)
+        self.map_exits = self.destinations[Destination.EXIT]  # all exits of the map, before set_up_exits
+        self.set_up_exits()
+        self.set_up_exit_cell_fields()
+        if shared_model is not None:
+            self.all_paths = shared_model.all_paths
+            self.destination_fields = shared_model.destination_fields
+        else:
+            self.batchcompute_all_exits(overwrite=False, test=False)  # batchcompute must come after exit setup
+            if destination_fields and self.compiled_map_path is not None:
+                self.load_destination_fields()
+        self.set_up_pathfinding(pathfinding)
+        if congestion_replanning:
+            if engine != 'object':
+                raise ValueError("congestion_replanning is only supported by the object engine")
+            self.router = CongestionRouter(get_search_space(self.grid), self.destinations[Destination.EXIT],
+                                           budget=replanning_budget)
+        self.spawn_visitors(n=self.n_visitors)
+        self.spawn_staff_and_get_exits_paths(n=self.n_officestaff)
+
+        self.sync_agents = sync_agents
+        if engine == 'vectorized':
+            self.engine = VectorizedEngine([self])
+        elif engine == 'object':
+            self.engine = None
+        else:
+            raise ValueError(f"Unknown engine: {engine}")
+
+        self.datacollector = MetricsRecorder(exits=self.destinations[Destination.EXIT], capacity=max_run_length)
+
+    def process_map_image(self, img_path, color_path):
+        """
+        Converts the pixels of the map image into the terrain raster, spawnable positions, office and help desk
+        positions and destinations (using the colour definitions of color_path).
+        :param img_path: map image file path
+        :param color_path: colour definitions (tsv) file path
+        """
+        im = Image.open(img_path)
+        im_np = np.array(im)
+        self.gridsize = im_np.shape[:-1]  # pixel size of map (incl. out of bounds area)
+        # static library objects are kept in a raster of CellType values (filled in fill_grid), not as agents
+        self.terrain = np.zeros(self.gridsize, dtype=np.uint8)
         try:
             if np.all(im_np[:, :, 3].flatten(order='C') == 255):  # checks if transparencies present in image
                 im_np = np.delete(im_np, 3, 2)
@@ -94,8 +252,6 @@ class EvacuationModel(Model):
 
         # convert 2d rgb coords to 1d (even though ndarray is 3d, incl. RGB dimension)
         self.rgbcoords_1d = im_np.reshape((im_np.shape[0] * im_np.shape[1], im_np.shape[2]))
-        # retrieve colour palettes in map
-        self.colours_all, colours_all_per_occurrence = np.unique(self.rgbcoords_1d, return_counts=True, axis=0)
         self.colour_to_obj_map = pd.read_csv(color_path, sep='\t',
                                              index_col=2)
         self.colours_defined = np.array([np.array(literal_eval(self.colour_to_obj_map.loc[colour, 'RGB'])) for colour in
@@ -103,68 +259,149 @@ class EvacuationModel(Model):
         index_map = list(zip(self.colour_to_obj_map.index, self.colours_defined))  # map object to RGB colours
         # self.indices = index_map
 
+        # label every pixel with the index of its colour in the defined colour set (outliers snapped to the closest)
+        self.labels = self.classify_pixels()
+        self.rgbcoords_1d = self.colours_defined.astype(np.uint8)[self.labels]  # pixel change
+
+        # ToyModel-like grid entity populating and visitor spawning
+        self.fill_grid(index_map)  # fill immobile objects into the terrain raster only
+
+    def classify_pixels(self):
+        """
+        Labels every pixel with the index (in self.colours_defined) of its colour, in one vectorized pass:
+        RGB values are packed into uint32 keys, looked up in the sorted keys of the defined colour set with
+        np.searchsorted, and the few distinct outlier colours are snapped to their closest relative at once
+        (see process_colour_outliers).
+        :return: numpy uint8 array with one label per pixel (1D, same order as self.rgbcoords_1d)
+        """
+        pixel_keys = pack_rgb(self.rgbcoords_1d)
+        defined_keys = pack_rgb(self.colours_defined)
+        order = np.argsort(defined_keys)
+        sorted_keys = defined_keys[order]
+
+        positions = np.minimum(np.searchsorted(sorted_keys, pixel_keys), len(sorted_keys) - 1)
+        matched = sorted_keys[positions] == pixel_keys
+        labels = order[positions]
+
         # check for membership between image and defined colour set, sanity check
-        # below: finds the indices where RGB in one array is found in another, returns 2 arrays of indices
-        membership_check = np.where((self.colours_defined == self.colours_all[:, None]).all(-1))
-        if len(membership_check[1]) != len(self.colour_to_obj_map.index):
-            excluded = list(set(list(range(len(self.colour_to_obj_map.index)))) - set(membership_check[1]))
-            excluded_name = [self.colour_to_obj_map.iloc[color, 1] for color in excluded]
+        present = np.bincount(labels[matched], minlength=len(defined_keys)) > 0
+        if not np.all(present):
+            excluded_name = [self.colour_to_obj_map.iloc[color, 1] for color in np.flatnonzero(~present)]
             raise ValueError(f"Membership check failed: defined colour set item index/indices {excluded_name} "
                              f"not in image")
 
-        # detect outlier colours from set exclusion
-        # below: finds non-matching colours based on defined set
-        self.outliers = np.where((self.colours_all[:, None] != self.colours_defined).any(-1).all(1))[0]
+        # detect outlier colours from set exclusion, and give them the label of their closest relative
+        outlier_keys, outlier_inverse = np.unique(pixel_keys[~matched], return_inverse=True)
+        self.outliers = unpack_rgb(outlier_keys)
+        labels[~matched] = self.process_colour_outliers(self.outliers)[outlier_inverse]
 
-        self.process_colour_outliers() # pixel change
-        # ToyModel-like grid entity populating and visitor spawning
-        self.fill_grid(index_map)  # fill immobile objects only
-        self.not_spawnable_objects = [IA.Wall, IA.Obstacle,
-                                      IA.Desk, IA.OutOfBounds, IA.Exit,
-                                      IA.ExitA, IA.ExitB, IA.ExitC,
-                                      IA.HelpDesk,
-                                      IA.Shelf, IA.DeskInteractive,
-                                      IA.HelpdeskInteractiveForHelpee,
-                                      IA.HelpdeskInteractiveForHelper,
-                                      IA.ShelfInteractive]
-        self.set_up_exits()
-        self.batchcompute_all_exits(overwrite=False, test=False)  # batchcompute must come after exit setup
-        self.spawn_visitors(n=self.n_visitors)
-        self.spawn_staff_and_get_exits_paths(n=self.n_officestaff)
+        return labels.astype(np.uint8)
 
-
-        self.datacollector = DataCollector(model_reporters={"safe_agents": self.get_nr_of_safe_agents})
-
-    def process_colour_outliers(self):
+    def process_colour_outliers(self, outlier_colours):
         """
-        Processes colour outliers to their closest relative.
+        Processes colour outliers to their closest relative (all outliers at once, broadcasted against the defined set).
         Does the following:
         1. delta1: Gets the difference between outlier colour and the defined colour set
         2. delta2: Finds the difference between R/G/B of highest diff and of lowest diff.
             Tells if a shade is darker/lighter.
         3. if: checks if there's no clear 'closer parent' (especially greys), then look for the smallest sum of delta1 (replacing default delta2)
         4. parent: encodes change of colour
+        :param outlier_colours: numpy array (n, 3) with RGB values
+        :return: numpy array (n,) with the index of the parent colour in self.colours_defined
+        """
+        delta1 = self.colours_defined[None, :, :].astype(np.int64) - outlier_colours[:, None, :3].astype(np.int64)
+        delta2 = np.amax(delta1, axis=2) - np.amin(delta1, axis=2)
+
+        select = delta2 < np.amin(delta2, axis=1, keepdims=True) + 10
+        no_clear_parent = np.sum(select, axis=1) > 1
+        check1 = np.where(select, np.sum(np.abs(delta1), axis=2), np.iinfo(np.int64).max)
+
+        return np.where(no_clear_parent, np.argmin(check1, axis=1), np.argmin(delta2, axis=1))
+
+    def save_compiled_map(self, path):
+        """
+        Writes the processed map (terrain, pixel labels, positions, destinations and exit distance fields) as a
+        compiled map, see CompiledMap.py. Must be called after self.compute_exit_distance_fields()
+        :param path: directory of the compiled map
+        :return: Boolean: whether this call created the compiled map (False if it already existed)
+        """
+        def to_array(positions):
+            return np.array(positions, dtype=np.int32).reshape(-1, 2)
+
+        arrays = {'terrain': self.terrain,
+                  'labels': self.labels,
+                  'colours_defined': self.colours_defined.astype(np.int32),
+                  'outliers': self.outliers,
+                  'spawnable_positions': to_array(self.spawnable_positions),
+                  'office_positions': to_array(self.office_positions),
+                  'helpdesk_positions': to_array(self.helpdesk_positions)}
+        for destination, positions in self.destinations.items():
+            arrays[f'destination_{destination.name}'] = to_array(positions)
+        for exit_type in self.exit_distance_fields:
+            arrays[f'exit_distance_{exit_type.name}'] = self.exit_distance_fields[exit_type]
+            arrays[f'exit_label_{exit_type.name}'] = self.exit_field_labels[exit_type]
+            arrays[f'exit_sources_{exit_type.name}'] = to_array(self.exit_field_sources[exit_type])
+
+        meta = {'img_path': self.img_path, 'gridsize': list(self.gridsize), 'version': COMPILED_MAP_VERSION}
+        return save_arrays(path, arrays, meta)
+
+    def load_compiled_map(self, path):
         """
-        # self.limbo_check = []
-        for colour in self.outliers:
-            ref_set = self.colours_defined  # for refresh per step, since this is mutable
-            current = self.colours_all[colour, :]
-            delta1 = ref_set - current
-            check1 = np.sum(np.abs(delta1), axis=1)
-            delta2 = np.amax(delta1, axis=1) - np.amin(delta1, axis=1)
-            if np.sum(delta2 < np.amin(delta2) + 10) > 1:
-                select = delta2 < np.amin(delta2 + 10)
-                delta1 = delta1[select, :]
-                ref_set = self.colours_defined[select, :]
-                delta2 = np.sum(np.abs(delta1), axis=1)
-            parent = ref_set[np.argmin(np.abs(delta2))]
-            locations = self.find_colour_coords(current)
-            for loc in locations:
-                self.rgbcoords_1d[loc,:] = parent
-            # self.limbo_check.append((current, parent))
-
-        if len(np.unique(self.rgbcoords_1d, axis=0)) != len(self.colours_defined):
-            raise ValueError('RGB correction issue, colours in corrected array not the same as defined set.')
+        Loads a compiled map written by save_compiled_map. The rasters are memory-mapped (read-only), so loading does
+        not depend on the size of the map. Replaces self.process_map_image() and self.compute_exit_distance_fields().
+        :param path: directory of the compiled map
+        """
+        arrays, meta = load_arrays(path, mmap=True)
+
+        def to_list(name):
+            return [(x, y) for x, y in arrays[name].tolist()]
+
+        self.gridsize = tuple(meta['gridsize'])
+        self.terrain = arrays['terrain']
+        self.labels = arrays['labels']
+        self.colours_defined = arrays['colours_defined']
+        self.outliers = arrays['outliers']
+        self.rgbcoords_1d = None  # built from the labels on first use
+
+        self.spawnable_positions = PositionArray(arrays['spawnable_positions'])  # large, converted on access
+        self.office_positions = to_list('office_positions')
+        self.helpdesk_positions = to_list('helpdesk_positions')
+        for destination in self.destinations:
+            self.destinations[destination] = to_list(f'destination_{destination.name}')
+        for exit_type in ExitType:
+            self.exit_distance_fields[exit_type] = arrays[f'exit_distance_{exit_type.name}']
+            self.exit_field_labels[exit_type] = arrays[f'exit_label_{exit_type.name}']
+            self.exit_field_sources[exit_type] = to_list(f'exit_sources_{exit_type.name}')
+
+    @property
+    def rgbcoords_1d(self):
+        """
+        RGB colour of every pixel (1D, outliers snapped to their closest defined colour). Models on a compiled map only
+        build it from the labels when it is used, as it is as large as the map.
+        :return: numpy uint8 array (height * width, 3)
+        """
+        if self._rgbcoords_1d is None:
+            self._rgbcoords_1d = self.colours_defined.astype(np.uint8)[self.labels]
+        return self._rgbcoords_1d
+
+    @rgbcoords_1d.setter
+    def rgbcoords_1d(self, rgbcoords_1d):
+        self._rgbcoords_1d = rgbcoords_1d
+
+    def share_map(self, model):
+        """
+        Reuses the processed map (terrain, positions, destinations and exit distance fields) of another model on the
+        same map. Replaces self.load_compiled_map(). The arrays are shared, not copied; none of them change after setup.
+        :param model: EvacuationModel
+        """
+        for name in ('gridsize', 'terrain', 'labels', 'colours_defined', 'outliers', '_rgbcoords_1d',
+                     'spawnable_positions', 'office_positions', 'helpdesk_positions',
+                     'exit_distance_fields', 'exit_field_labels', 'exit_field_sources'):
+            setattr(self, name, getattr(model, name))
+
+        # only the exits depend on the valid exits of a model (see set_up_exits)
+        self.destinations = dict(model.destinations)
+        self.destinations[Destination.EXIT] = model.map_exits
 
     def is_done(self):
         return len(self.safe_agents) >= self.n_staff + self.n_visitors
@@ -178,9 +415,23 @@ class EvacuationModel(Model):
         return self.id_counter - 1
 
     def step(self):
-        self.end_time += 1
-        self.schedule.step()
-        self.datacollector.collect(self)
+        with self.profiler.phase('step'):
+            self.end_time += 1
+            if self.engine is not None:
+                self.engine.step()
+                if self.sync_agents:
+                    with self.profiler.phase('sync_agents'):
+                        self.engine.sync_agents()
+            else:
+                with self.profiler.phase('crowd_density'):
+                    self.update_crowd_density()
+                if self.router is not None and self.alarm.is_activated:
+                    with self.profiler.phase('replanning'):
+                        self.profiler.count('replanning_work', self.router.update(self.person_positions))
+                with self.profiler.phase('schedule'):
+                    self.schedule.step()
+            with self.profiler.phase('metrics'):
+                self.datacollector.collect(self)
         # if self.end_time >= 0:
             # if self.end_time % 50 == 0:
             #     print(f"Current epoch: {self.end_time} ")
@@ -209,12 +460,214 @@ class EvacuationModel(Model):
             self.destinations[Destination.EXIT] = self.destinations[Destination.EXITA] + self.destinations[
                 Destination.EXITC]
 
+    def compute_exit_distance_fields(self):
+        """
+        Computes one distance field per exit group (A, B, C) with a multi-source BFS over the walkable cells, and
+        combines them into the fields of all exit types (AB, BC, AC, ABC) by taking the closest open group per cell.
+        Walking agents descend these fields towards their exit, and the closest exit of a cell becomes a lookup.
+        Only uses the exit groups (not the valid exits), so the fields can be stored in the compiled map.
+        """
+        walkable = self.grid.get_walkable_mask(UNWALKABLE_OBJECTS)
+
+        group_fields = {}
+        for exit_type, groups in EXIT_GROUPS.items():
+            if len(groups) == 1:
+                group_fields[groups[0]] = compute_distance_field(walkable, self.destinations[groups[0]])
+
+        for exit_type, groups in EXIT_GROUPS.items():
+            distances = np.stack([group_fields[group][0] for group in groups])
+            labels = np.stack([group_fields[group][1] for group in groups])
+
+            # unreachable cells must never win the comparison between groups
+            distances = np.where(distances == UNREACHABLE, np.iinfo(np.int32).max, distances)
+            closest_group = np.argmin(distances, axis=0)
+            distance = np.take_along_axis(distances, closest_group[None], axis=0)[0]
+            label = np.take_along_axis(labels, closest_group[None], axis=0)[0]
+
+            # labels refer to the exits of the group they belong to, shift them to the concatenated list of exits
+            offsets = np.cumsum([0] + [len(self.destinations[group]) for group in groups[:-1]])
+            label = np.where(label >= 0, label + offsets[closest_group], -1)
+
+            self.exit_distance_fields[exit_type] = np.where(distance == np.iinfo(np.int32).max, UNREACHABLE,
+                                                            distance).astype(np.int32)
+            self.exit_field_labels[exit_type] = label.astype(np.int32)
+            self.exit_field_sources[exit_type] = [pos for group in groups for pos in self.destinations[group]]
+
+    def get_closest_exit(self, pos, exit_type=None):
+        """
+        Returns the closest exit (cell) from a position, looked up in the precomputed exit distance fields.
+        :param pos: Tuple
+        :param exit_type: ExitType, defaults to the valid exits of this model
+        :return: position of exit (tuple) or None if no exit can be reached
+        """
+        if exit_type is None:
+            exit_type = self.valid_exits
+
+        label = self.exit_field_labels[exit_type][pos[1], pos[0]]
+        if label < 0:
+            return None
+        return self.exit_field_sources[exit_type][label]
+
+    def set_up_exit_cell_fields(self):
+        """
+        Maps every exit cell to the distance field of its exit group (see get_exit_distance_field).
+        """
+        self.exit_cell_fields = {}
+        for exit_type, groups in EXIT_GROUPS.items():
+            if len(groups) == 1:
+                for pos in self.exit_field_sources[exit_type]:
+                    self.exit_cell_fields.setdefault(tuple(pos), self.exit_distance_fields[exit_type])
+
+    def get_exit_distance_field(self, destination):
+        """
+        Returns the distance field of the exit group that the exit cell destination belongs to, or None if there is no
+        such field. Its descent leads to the closest cell of that exit, which is not necessarily destination itself if
+        the exit spans several cells (Walk.do then takes the reached cell as the exit).
+        :param destination: Tuple
+        :return: numpy int32 array or None
+        """
+        return self.exit_cell_fields.get(destination)
+
+    def set_up_pathfinding(self, pathfinding):
+        """
+        Sets self.path_search, the function (with the signature of a_star_search) that finds the paths of walks that
+        are not in self.all_paths. The abstract graph of hierarchical pathfinding is built (or loaded from next to the
+        compiled map) here, not in the first walk.
+        :param pathfinding: 'astar', 'jps' or 'hierarchical'
+        """
+        if pathfinding == 'astar':
+            self.path_search = a_star_search
+        elif pathfinding == 'jps':
+            get_search_space(self.grid).get_jump_tables()
+            self.path_search = partial(a_star_search, method='jps')
+        elif pathfinding == 'hierarchical':
+            path = get_hierarchy_path(self.compiled_map_path) if self.compiled_map_path is not None else None
+            get_abstract_graph(self.grid, path=path)
+            self.path_search = hierarchical_search
+        else:
+            raise ValueError(f"Unknown pathfinding {pathfinding}, use 'astar', 'jps' or 'hierarchical'")
+
+    def load_destination_fields(self, n_workers=None):
+        """
+        Loads the distance fields of the desks, shelves and helpdesks of the compiled map, and computes them first if
+        they do not exist yet.
+        :param n_workers: int: number of processes for computing (None: all CPUs)
+        """
+        path = get_destination_fields_path(self.compiled_map_path)
+        if not os.path.isdir(path):
+            print("> Destination fields not found. Computing destination fields...")
+            start_t = time.time()
+            self.compute_destination_fields(path, n_workers=n_workers)
+            print(f"\t>>Destination fields computed ({round(time.time() - start_t, 1)} s).")
+        self.destination_fields = DestinationFields.load(path)
+
+    def compute_destination_fields(self, path, n_workers=None):
+        """
+        Computes the distance fields of all desks, shelves and helpdesks and stores them in path.
+        :param path: directory of the fields, see DestinationFields.get_destination_fields_path
+        :param n_workers: int: number of processes (None: all CPUs)
+        :return: Boolean: whether this call created the fields (False if they already existed)
+        """
+        if os.path.isdir(path):
+            return False
+        walkable = self.grid.get_walkable_mask(UNWALKABLE_OBJECTS)
+        destinations = [pos for destination in FIELD_DESTINATIONS for pos in self.destinations[destination]]
+        fields = DestinationFields.build(walkable, destinations, n_workers=n_workers)
+        return fields.save(path, meta={'img_path': self.img_path})
+
+    def get_destination_field(self, origin, destination):
+        """
+        Returns the distance field (see DestinationFields) whose descent leads from origin to destination, or None if
+        destination has no field or cannot be reached from origin.
+        :param origin: Tuple
+        :param destination: Tuple
+        :return: int or None
+        """
+        if self.destination_fields is None:
+            return None
+        field_id = self.destination_fields.get_field_id(destination)
+        if field_id < 0 or self.destination_fields.get_distance(field_id, origin) == FIELD_UNREACHABLE:
+            return None
+        return field_id
+
+    def get_congestion_route(self, origin, destination):
+        """
+        Returns the congestion-aware route (see CongestionRouting.ExitRoute) to the exit destination, or None if the
+        model does not replan, or if the route has no settled cost to go from origin (unreachable or being repaired).
+        :param origin: Tuple
+        :param destination: Tuple
+        :return: ExitRoute or None
+        """
+        if self.router is None:
+            return None
+        route = self.router.get_route(destination)
+        if route is None or not route.is_settled(origin):
+            return None
+        return route
+
+    def update_crowd_density(self):
+        """
+        Counts the persons per cell and integrates these counts into a summed-area table, once per tick. The crowd
+        around any cell (see get_nr_of_people_around) then takes four lookups instead of a scan of the neighborhood.
+        The counts are kept between ticks and only change at the cells of the persons that moved, and the table only
+        has the rows and columns that hold persons (see CrowdTable).
+        """
+        positions, placed = self.grid.agent_positions.get_rows()
+        if self.occupancy is None:
+            self.occupancy = np.zeros(self.gridsize, dtype=np.int32)
+            self.counted_rows = (np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=bool))
+
+        # rows added since the last tick were not counted yet
+        counted_positions, counted = self.counted_rows
+        n_new = len(placed) - len(counted)
+        counted_positions = np.concatenate([counted_positions, np.zeros((n_new, 2), dtype=np.int64)])
+        counted = np.concatenate([counted, np.zeros(n_new, dtype=bool)])
+
+        changed = (placed != counted) | (placed & np.any(positions != counted_positions, axis=1))
+        left, entered = changed & counted, changed & placed
+        np.subtract.at(self.occupancy, (counted_positions[left, 1], counted_positions[left, 0]), 1)
+        np.add.at(self.occupancy, (positions[entered, 1], positions[entered, 0]), 1)
+        self.counted_rows = (positions.copy(), placed.copy())
+
+        self.person_positions = positions[placed]
+        self.crowd_density = CrowdTable(self.person_positions)
+
+    def get_nr_of_people_around(self, pos, radius):
+        """
+        Returns the number of persons in the Moore neighborhood of a position (excluding the cell itself, like
+        Person.get_nr_of_neighbors), as counted at the start of the current tick by update_crowd_density.
+        :param pos: Tuple
+        :param radius: int
+        :return: int
+        """
+        return self.crowd_density.sum_in_radius(pos, radius) - int(self.occupancy[pos[1], pos[0]])
+
     def get_total_evacuation_time(self):
         return self.end_time
 
     def get_nr_of_safe_agents(self, dummy=1):
         return len(self.safe_agents)
 
+    def get_safe_agents_per_tick(self):
+        if self.datacollector.truncated:
+            raise ValueError(f"The run took more than max_run_length={self.datacollector.capacity} ticks, so the safe "
+                             f"agents of its earliest ticks were overwritten")
+        return self.datacollector.get('safe_agents').astype(int).tolist()
+
+    def get_person_state(self):
+        """
+        Returns the positions and current speeds (running speed when evacuating, else walking speed) of the persons in
+        the building.
+        :return: numpy int array (n, 2) and numpy float array (n,)
+        """
+        if self.engine is not None:
+            return self.engine.get_person_state(0)
+        persons = [agent for agent in self.schedule.agents if isinstance(agent, Person) and agent.pos is not None]
+        positions = np.array([person.pos for person in persons], dtype=np.int64).reshape(-1, 2)
+        speeds = np.array([person.move_data.running_speed if person.emergency_knowledge.is_evacuating
+                           else person.move_data.walking_speed for person in persons], dtype=float)
+        return positions, speeds
+
     def find_colour_coords(self, RGB_value):
         """
         With given RGB values, return an array of all found coordinates
@@ -226,19 +679,27 @@ class EvacuationModel(Model):
 
     def fill_grid(self, index_map):
         """
-        Iterates through colour list, finds pixels matching said colour,
+        Iterates through colour list, takes the pixels labelled with said colour,
         Saves spawnable tiles and destination tiles in respective data types
-        Loads library objects (walls, desks) and office staff (in specific seats)
+        Writes library objects (walls, desks) into the terrain raster as CellType values (no Item agents are created)
         In terms of functionality to ToyModel methods, it does:
             * fill_grid() {the ToyModel version}
             * add_exit_to_correct_keys()
             * get_all_spawnable_cells()
-            * spawn_staff()
         :param index_map: list of tuples with Dataframe indices and associated colours
         """
+        # static objects: one lookup of the cell type per pixel label (1D coords are the flat indices of the raster)
+        cell_types = np.array([get_cell_type(self.colour_to_obj_map.loc[obj, 'Entity_category'])
+                               for obj, _ in index_map], dtype=np.uint8)
+        self.terrain.flat[:] = cell_types[self.labels]
+
+        # pixel indices grouped by label (one stable sort instead of one search per colour)
+        pixels_by_label = np.argsort(self.labels, kind='stable')
+        label_bounds = np.concatenate([[0], np.cumsum(np.bincount(self.labels, minlength=len(index_map)))])
+
         # iterate through object_colours.tsv's entity names & colours
-        for obj, c in index_map:
-            idxs = self.find_colour_coords(c)[0]
+        for label, (obj, c) in enumerate(index_map):
+            idxs = pixels_by_label[label_bounds[label]:label_bounds[label + 1]]
             y = idxs // self.gridsize[1]  # converts 1D coords to 2D
             x = idxs % self.gridsize[1]
             coords = list(zip([int(ix) for ix in x], [int(iy) for iy in y]))
@@ -280,29 +741,7 @@ class EvacuationModel(Model):
                         self.destinations[sub_destination].extend(coords)
             except:  # catches NaNs being floats
                 continue
-
-            # Office entities
-            staff_types = ('Office', 'HelpDeskInteractiveForHelper')
-
-            # iterates through coords of the same colour
-            for x, y in coords:
-                try:
-                    # disaggregating x and y to force typecasting to int (TEMP. DEACTIVATED)
-                    # x = int(x)
-                    # y = int(y)
-                    # below: use Entity_category string from object_colours.tsv to match
-                    # with the classes from inanimate agents (hence alias IA)
-                    # parentheses after: initiate the matched inanimate class with its associated args
-                    if self.colour_to_obj_map.loc[obj, 'Entity_category'] not in staff_types:
-                        object = getattr(IA, self.colour_to_obj_map.loc[obj, 'Entity_category'])(self.next_id(),
-                                                                                                 self)
-                        self.grid.place_agent(object, pos=(x, y))
-
-
-                except TypeError:
-                    # Catches TypeError for walkable tiles (since only unwalkables are placed)
-                    continue
-        # print("\tMappingModel.py: all grid objects transferred to MESA grid entities.")
+        # print("\tMappingModel.py: all grid objects transferred to terrain raster.")
 
     def spawn_visitors(self, n):
         """
@@ -311,16 +750,41 @@ class EvacuationModel(Model):
         :return:
         """
 
-        positions = random.sample(self.spawnable_positions, k=n)
-        for pos in positions:
+        positions = self.random.sample(self.spawnable_positions, k=n)
+        attributes = self.draw_person_attributes(n)
+        for pos, person_attributes in zip(positions, attributes):
             visitor = Visitor(self.next_id(), self, female_ratio=self.female_ratio,
-                              adult_ratio=self.adult_ratio, familiarity=self.familiarity)
+                              adult_ratio=self.adult_ratio, familiarity=self.familiarity, attributes=person_attributes)
 
             self.grid.place_agent(agent=visitor, pos=pos)
             self.schedule.add(visitor)
 
 
 
+    def draw_person_attributes(self, n):
+        """
+        Draws the random attributes of n persons at once with self.np_random: gender, age and entrance (as in
+        Person.assign_gender, Person.assign_age and EmergencyKnowledge.sample_entrance), and whether they had safety
+        training and know the exits (as in EmergencyKnowledge.sample_safety_training and get_knows_exits; for visitors).
+        :param n: int: number of persons
+        :return: list with one attributes dict per person
+        """
+        draws = self.np_random.random((n, 5))
+        if self.antithetic:
+            draws = 1.0 - draws
+        exits = self.destinations[Destination.EXIT]
+        # from a uniform draw too, so persons get the same entrance with common random numbers
+        entrances = np.minimum((draws[:, 4] * len(exits)).astype(int), len(exits) - 1) if exits else [None] * n
+
+        had_safety_training = draws[:, 2] <= self.familiarity
+        knows_exits = had_safety_training | (draws[:, 3] <= 0.1)
+
+        return [{'gender': Gender.FEMALE if draws[i, 0] <= self.female_ratio else Gender.MALE,
+                 'age': Age.ADULT if draws[i, 1] <= self.adult_ratio else Age.CHILD,
+                 'entrance': exits[entrances[i]] if exits else None,
+                 'had_safety_training': bool(had_safety_training[i]),
+                 'knows_exits': bool(knows_exits[i])} for i in range(n)]
+
     def spawn_staff_and_get_exits_paths(self, n=3):
         """
         Does the following:
@@ -336,14 +800,15 @@ class EvacuationModel(Model):
         outliers = list(self.encoded_starts - (set(self.office_positions + self.helpdesk_positions)))
         if len(outliers) != 0:
             print(f"Position(s) detected: {outliers}. Will be ignored.")
-        positions = random.sample(self.encoded_starts, k=n-1)
-        empties = list(set(self.encoded_starts) - set(positions))
+        positions = self.random.sample(sorted(self.encoded_starts), k=n-1)
+        empties = sorted(set(self.encoded_starts) - set(positions))
         positions.extend(self.helpdesk_positions)  # addition of fixed/constant helpdesk locations
         valid_exits = self.destinations[Destination.EXIT]
+        attributes = self.draw_person_attributes(len(positions))
 
-        for pos in positions:
+        for pos, person_attributes in zip(positions, attributes):
             staffpax = Staff(self.next_id(), self, female_ratio=self.female_ratio,
-                             adult_ratio=self.adult_ratio)
+                             adult_ratio=self.adult_ratio, attributes=person_attributes)
             self.grid.place_agent(agent=staffpax, pos=pos)
             self.schedule.add(staffpax)
             self.staff_agents.append(staffpax)  # all staff agents in a central list
@@ -356,61 +821,142 @@ class EvacuationModel(Model):
                     break
                 except KeyError:  # catch times with weird values for spaces
                     print(f"\tMapModel: {pos} not found in all_paths, recalculating")
-                    pos = random.sample(empties, k=1)
+                    pos = self.random.choice(empties)
                     empties.remove(pos)
 
             self.n_staff += 1
         # print(f"EvacuationModel: all {len(positions)} Staff entities' destinations encoded.")
 
-    def batchcompute_all_exits(self, overwrite=False, save_name='office_to_exit_paths', test=False):
+    def batchcompute_all_exits(self, overwrite=False, cache_dir=None, test=False, n_workers=1):
         """
         For all exits, compute the shortest path from all office spots to said exits.
         BatchCompute must be called after self.set_exits()
-        :overwrite: bool for overwriting current pre-saved map
+        The paths are stored in a content-addressed PathCache in cache_dir: its key is a hash of the walkability raster
+        and the queries (see get_path_cache_key), so a changed floor plan never reuses stale paths, and experiments
+        that share the folder share the paths. While constructing, every finished path is streamed into a partial
+        pickle of this process, so an interrupted run resumes where it (or any other process) stopped.
+        :overwrite: bool for overwriting the cached paths of the current map
+        :cache_dir: folder of the path caches, defaults to PathCache in the repository root
+        :n_workers: int: number of processes for constructing (None: all CPUs, 1: no process pool)
         :return: None
         """
-        # check if file exists, if not then run, if overwrite=True, then go
-        construct = False
-        if test:  # test overrides all, but doesn't save
-            construct = True
+        if cache_dir is None:
+            cache_dir = DEFAULT_CACHE_DIR
+
+        # paths to the exits of all groups, not only the valid ones, such that the cache serves every exit type
+        all_exits = [pos for group in EXIT_GROUPS[ExitType.ABC] for pos in self.destinations[group]]
+        all_sources = self.office_positions + self.helpdesk_positions
+        if test:  # for diagnostic, test overrides all, but doesn't save
+            all_sources = all_sources[:2]
+        queries = [(pos, exit) for pos in all_sources for exit in all_exits]
+
+        key = get_path_cache_key(get_search_space(self.grid), queries)
+        cache_path = os.path.join(cache_dir, key)
+
+        # check if cache exists, if not then run, if overwrite=True, then go
+        partial_prefix = os.path.join(cache_dir, f'{key}.partial')
+        if not test and os.path.isdir(cache_path):
+            if not overwrite:
+                self.all_paths = PathCache.load(cache_path, **self.path_cache_limits)
+                self.remove_partial_paths(partial_prefix)
+                return
+            print('> Overwriting paths cache, constructing...')
+            shutil.rmtree(cache_path, ignore_errors=True)
+        elif not test:
+            print("> Paths cache not found. Constructing paths cache...")
+
+        # unbounded while constructing (every path is saved), bounded once loaded from the saved cache
+        if test:
+            self.all_paths = PathCache(width=self.grid.width, **self.path_cache_limits)
         else:
-            if os.path.isfile(f'{save_name}.pickle'):
-                # print("> Paths file available.")
-                if overwrite:
-                    print('> Overwriting Paths file, constructing...')
-                    construct = True
-                else:
-                    with open(f"{save_name}.pickle", 'rb') as read:
-                        self.all_paths = pickle.load(read)
-                    # print("EvacuationModel: all_paths loaded from pickle.")
-            else:
-                print("> Paths file not found. Constructing paths file...")
-                construct = True
-
-        if construct:
-            all_exits = self.destinations[Destination.EXIT]
-            all_sources = self.office_positions + self.helpdesk_positions
-            print(all_sources)
-            self.timer = []
-            print(f"\n> Calculating all paths for all exits (for office spots), total: {len(self.office_positions)}."
-                  "\n> Average time per epoch: <1 min. Make yourself comfortable.")
-            for epoch, pos in enumerate(all_sources):
-                start_t = time.time()
-                print(f'\t>> Epoch: {epoch + 1}/{len(all_sources)}')
-                # iterate through exits
-                for idx, exit in enumerate(all_exits):
-                    paths = [a_star_search(self.grid, pos, exit)]
-                    lengths = [len(a) for a in paths]
-                    shortest_path = paths[lengths.index(min(lengths))]
-                    self.all_paths[(pos, exit)] = shortest_path
-                self.timer.append(round(time.time() - start_t, 1))
-                if test:  # for diagnostic
-                    if epoch + 1 == 2:
-                        break
+            self.all_paths = PathCache(width=self.grid.width, share_suffixes=False)
+        if not test and not overwrite:
+            for origin, destination, path in self.load_partial_paths(partial_prefix):
+                self.all_paths[(origin, destination)] = path
+        queries = [query for query in queries if query not in self.all_paths]
+
+        print(f"\n> Calculating all paths for all exits (for office spots), total: {len(all_sources)} "
+              f"({len(queries)} paths left).")
+        start_t = time.time()
+        if test:
+            def store_path(origin, destination, path):
+                self.all_paths[(origin, destination)] = path
+
+            batch_a_star_search(self.grid, queries, callback=store_path, n_workers=n_workers)
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(self.get_partial_name(partial_prefix), 'ab') as partial:
+                def store_path(origin, destination, path):
+                    self.all_paths[(origin, destination)] = path
+                    pickle.dump((origin, destination, path), partial, protocol=pickle.HIGHEST_PROTOCOL)
+                    partial.flush()
+
+                batch_a_star_search(self.grid, queries, callback=store_path, n_workers=n_workers)
+        self.timer = round(time.time() - start_t, 1)
+        print(f"\t>>All paths to all exits calculated ({self.timer} s).")
+
+        if not test:
+            self.all_paths.save(cache_path, meta={'img_path': self.img_path, 'n_queries': len(self.all_paths)})
+            self.all_paths = PathCache.load(cache_path, **self.path_cache_limits)
+            try:
+                os.remove(self.get_partial_name(partial_prefix))
+            except OSError:
+                pass
+
+    @staticmethod
+    def get_partial_name(partial_prefix):
+        """
+        Returns the partial pickle that the current process appends its paths to (every process has its own).
+        :param partial_prefix: file name prefix of the partial pickles
+        :return: str
+        """
+        return f'{partial_prefix}.{os.getpid()}.pickle'
+
+    @staticmethod
+    def remove_partial_paths(partial_prefix):
+        """
+        Removes the partial pickles of a paths cache that exists (the processes that wrote them can not add anything to
+        it). Files that cannot be removed, e.g. because they are still open on Windows, are left.
+        :param partial_prefix: file name prefix of the partial pickles
+        """
+        for partial_name in glob.glob(f'{partial_prefix}.*.pickle'):
+            try:
+                os.remove(partial_name)
+            except OSError:
+                pass
 
-            print("\t>>All paths to all exits calculated.")
-            with open(f'{save_name}.pickle', 'wb') as handle:
-                pickle.dump(self.all_paths, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    @staticmethod
+    def load_partial_paths(partial_prefix):
+        """
+        Reads the (origin, destination, path) records of interrupted batchcompute_all_exits runs (of any process).
+        The files of other processes are only read: they may still be writing to them, so their records end at the
+        first incomplete record. A record that was cut off in the file of the current process (left by an earlier
+        process with the same pid) is truncated from it, so that the records this process appends can be read again.
+        :param partial_prefix: file name prefix of the partial pickles
+        :return: list of tuples (origin, destination, path)
+        """
+        records = []
+        own_name = EvacuationModel.get_partial_name(partial_prefix)
+        for partial_name in glob.glob(f'{partial_prefix}.*.pickle'):
+            is_own = os.path.abspath(partial_name) == os.path.abspath(own_name)
+            with open(partial_name, 'r+b' if is_own else 'rb') as partial:
+                end_of_last_record = 0
+                while True:
+                    try:
+                        records.append(pickle.load(partial))
+                        end_of_last_record = partial.tell()
+                    except (EOFError, pickle.UnpicklingError, ValueError, TypeError):
+                        break
+                size = partial.seek(0, os.SEEK_END)
+                if size > end_of_last_record and is_own:
+                    print(f"> Truncated a cut-off record ({size - end_of_last_record} bytes) from {partial_name}.")
+                    partial.truncate(end_of_last_record)
+                elif size > end_of_last_record:
+                    print(f"> Skipped an incomplete record ({size - end_of_last_record} bytes) at the end of "
+                          f"{partial_name} (cut off, or still being written).")
+        if records:
+            print(f"> Resuming from partial paths files: {len(records)} paths already calculated.")
+        return records
 
 # test = EvacuationModel()
 # if __name__ ==  "__main__ ":
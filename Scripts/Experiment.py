@@ -1,5 +1,9 @@
 from Scripts.Visualization import *
 from Scripts.EvacuationModel import *
+from Scripts.BatchRunner import BatchRunner
+from Scripts.ParallelRunner import get_job_seed, run_jobs
+from Scripts.VarianceReduction import paired_confidence_interval
+from Scripts.ResultsSink import ResultsSink, get_result, read_results
 from Scripts.Enums import *
 import seaborn as sns
 import pandas as pd
@@ -9,7 +13,12 @@ import pickle
 
 class Experiment:
 
-    def __init__(self):
+    def __init__(self, results_path=None, results_format='parquet'):
+        """
+        :param results_path: folder that the result of every replication is streamed to as soon as it is finished
+                             (see ResultsSink), None to only keep the results in memory
+        :param results_format: 'parquet' or 'csv'
+        """
 
         print('Setting up the experiment ...\n')
         self.start_time = time.time()
@@ -24,12 +33,21 @@ class Experiment:
         self.average_evacuation_times = {ExitType.A: 0, ExitType.B: 0, ExitType.C: 0, ExitType.AB: 0,
                                          ExitType.BC: 0, ExitType.AC: 0, ExitType.ABC: 0}
 
+        # Confidence interval of the mean difference in evacuation time to the baseline exit type (see run_paired)
+        self.paired_differences = {}
+
+        self.results_sink = ResultsSink(results_path, file_format=results_format) if results_path else None
+        self.parameters = {}  # model parameters of the current run, stored with every replication in the sink
+
     def run(self, model, n_replications=10, visualize=False, max_run_length=1000, n_visitors=50, n_officestaff=10, female_ratio=0.5,
-            adult_ratio=0.5, familiarity=0.1, map_img_path=None, valid_exits=None):
+            adult_ratio=0.5, familiarity=0.1, map_img_path=None, valid_exits=None, batched=False, seed=None):
         """
         This function runs the entire experiment with all its variations.
+        With batched=True, the replications of an exit type are stepped together (see BatchRunner).
+        With a seed, every replication gets its own seed derived from it (the same as in run_parallel).
         """
         self.display_inputs(n_replications, max_run_length, n_visitors, female_ratio, adult_ratio, familiarity)
+        self.set_parameters(n_visitors, n_officestaff, female_ratio, adult_ratio, familiarity, max_run_length)
         self.model = model
         self.map_path = map_img_path
         print(f"\nSet Map object currently {self.map_path}.")
@@ -44,19 +62,150 @@ class Experiment:
                                                                 max_run_length=max_run_length, n_visitors=n_visitors,
                                                                 n_officestaff=n_officestaff,
                                                                 female_ratio=female_ratio, adult_ratio=adult_ratio,
-                                                                familiarity=familiarity, valid_exits=ex)
+                                                                familiarity=familiarity, valid_exits=ex,
+                                                                batched=batched, seed=seed)
 
             self.average_evacuation_times[ex] = sum(self.evacuation_times[ex]) / len(self.evacuation_times[ex])
 
             if visualize:
                 break
 
+        self.flush_results()
+        run_time = round(time.time() - self.start_time, 2)
+        print(f'Run time: {run_time} seconds')
+
+    def run_parallel(self, model, n_replications=10, max_run_length=1000, n_visitors=50, n_officestaff=10,
+                     female_ratio=0.5, adult_ratio=0.5, familiarity=0.1, valid_exits=None, seed=0, n_workers=None,
+                     queue_dir=None):
+        """
+        Runs the entire experiment like run(), but every (exit type, replication) is a job with its own seed (derived
+        from seed), and the jobs run on all cores (see ParallelRunner). Results are merged in replication order, so an
+        experiment with the same seed gives the same evacuation times no matter how many workers run it.
+        :param seed: int: seed of the experiment
+        :param n_workers: int: number of processes, defaults to the number of CPUs
+        :param queue_dir: folder of a file-based job queue (optional, e.g. shared with workers on other machines)
+        """
+        self.display_inputs(n_replications, max_run_length, n_visitors, female_ratio, adult_ratio, familiarity)
+        self.set_parameters(n_visitors, n_officestaff, female_ratio, adult_ratio, familiarity, max_run_length)
+        self.model = model
+
+        if valid_exits is None:
+            valid_exits = [x for x in ExitType]
+
+        # build the compiled map and the paths cache once, before the workers would all build them at the same time
+        model(n_visitors=0, n_officestaff=1)
+
+        model_kwargs = {'n_visitors': n_visitors, 'n_officestaff': n_officestaff, 'female_ratio': female_ratio,
+                        'adult_ratio': adult_ratio, 'familiarity': familiarity}
+        jobs = [{'model': model, 'model_kwargs': model_kwargs, 'exit_type': ex, 'replication': i,
+                 'seed': get_job_seed(seed, ex, i), 'max_run_length': max_run_length}
+                for ex in valid_exits for i in range(n_replications)]
+
+        print(f"\nRunning {len(jobs)} replications for exit types: {[str(ex) for ex in valid_exits]}")
+        results = {ex: [None] * n_replications for ex in valid_exits}
+
+        def store_result(result):
+            results[result['exit_type']][result['replication']] = result['evacuation_time']
+            self.execution_times.append(result['run_time'])
+            self.record_result(result)
+
+        run_jobs(jobs, callback=store_result, n_workers=n_workers, queue_dir=queue_dir)
+        self.flush_results()
+
+        for ex in valid_exits:
+            self.evacuation_times[ex] = results[ex]
+            self.average_evacuation_times[ex] = sum(results[ex]) / len(results[ex])
+
+        run_time = round(time.time() - self.start_time, 2)
+        print(f'Run time: {run_time} seconds')
+
+    def run_paired(self, model, baseline=ExitType.ABC, min_replications=10, max_replications=100,
+                   target_half_width=10.0, confidence=0.95, antithetic=False, max_run_length=1000, n_visitors=50,
+                   n_officestaff=10, female_ratio=0.5, adult_ratio=0.5, familiarity=0.1, valid_exits=None, seed=0,
+                   n_workers=1):
+        """
+        Compares the exit types to a baseline with common random numbers: replication i of every exit type gets the
+        same seed, i.e. the same visitors, staff, spawn positions and (as far as their paths do not diverge) task
+        draws, so the difference of their evacuation times only measures the effect of the exits. Replications are
+        added in rounds until the confidence interval of the mean paired difference of every exit type is at most
+        target_half_width wide on each side (or max_replications is reached).
+        :param baseline: ExitType that all other exit types are compared to
+        :param min_replications: int: replications before the stopping rule is checked for the first time
+        :param max_replications: int: replications after which the experiment stops anyway
+        :param target_half_width: float: stop once every half width is at most this many seconds
+        :param confidence: float: confidence level of the intervals
+        :param antithetic: Boolean: replications come in pairs whose second model draws 1 - u for every draw u of the
+                           first one, and the mean of a pair is one observation
+        :param seed: int: seed of the experiment
+        :param n_workers: int: number of processes per round (see ParallelRunner.run_jobs)
+        """
+        self.display_inputs(min_replications, max_run_length, n_visitors, female_ratio, adult_ratio, familiarity)
+        self.set_parameters(n_visitors, n_officestaff, female_ratio, adult_ratio, familiarity, max_run_length)
+        self.model = model
+
+        if valid_exits is None:
+            valid_exits = [x for x in ExitType]
+        if baseline not in valid_exits:
+            valid_exits = [baseline] + list(valid_exits)
+
+        if n_workers != 1:
+            model(n_visitors=0, n_officestaff=1)  # build the compiled map and the paths cache once (see run_parallel)
+
+        model_kwargs = {'n_visitors': n_visitors, 'n_officestaff': n_officestaff, 'female_ratio': female_ratio,
+                        'adult_ratio': adult_ratio, 'familiarity': familiarity}
+        replications_per_observation = 2 if antithetic else 1
+        results = {ex: [] for ex in valid_exits}
+
+        print(f"\nRunning paired replications for exit types: {[str(ex) for ex in valid_exits]}")
+        n_replications = 0
+        n_new = max(min_replications, 2) * replications_per_observation
+        while n_new > 0:
+            jobs = []
+            for i in range(n_replications, n_replications + n_new):
+                # an antithetic pair shares its seed, all exit types of a replication share it too
+                replication_seed = get_job_seed(seed, None, i // replications_per_observation)
+                kwargs = dict(model_kwargs, antithetic=True) if antithetic and i % 2 == 1 else model_kwargs
+                jobs += [{'model': model, 'model_kwargs': kwargs, 'exit_type': ex, 'replication': i,
+                          'seed': replication_seed, 'max_run_length': max_run_length} for ex in valid_exits]
+            for ex in valid_exits:
+                results[ex] += [None] * n_new
+
+            def store_result(result):
+                results[result['exit_type']][result['replication']] = result['evacuation_time']
+                self.execution_times.append(result['run_time'])
+                self.record_result(result, antithetic=antithetic and result['replication'] % 2 == 1)
+
+            run_jobs(jobs, callback=store_result, n_workers=n_workers, report_every=0)
+            self.flush_results()
+            n_replications += n_new
+
+            observations = {ex: [sum(times[j:j + replications_per_observation]) / replications_per_observation
+                                 for j in range(0, n_replications, replications_per_observation)]
+                            for ex, times in results.items()}
+            self.paired_differences = {ex: paired_confidence_interval(observations[ex], observations[baseline],
+                                                                      confidence=confidence)
+                                       for ex in valid_exits if ex != baseline}
+            widest = max((d['half_width'] for d in self.paired_differences.values()), default=0.0)
+            print(f'\t\t{n_replications} replications, widest half width: {widest:.1f} seconds')
+
+            if widest <= target_half_width or n_replications >= max_replications:
+                break
+            # estimate the number of observations that reach the target (the half width shrinks with 1/sqrt(n))
+            n_observations = n_replications // replications_per_observation
+            n_needed = int(n_observations * (widest / target_half_width) ** 2) + 1 - n_observations
+            n_left = (max_replications - n_replications) // replications_per_observation
+            n_new = min(max(n_needed, 1), n_left) * replications_per_observation
+
+        for ex in valid_exits:
+            self.evacuation_times[ex] = results[ex]
+            self.average_evacuation_times[ex] = sum(results[ex]) / len(results[ex])
+
         run_time = round(time.time() - self.start_time, 2)
         print(f'Run time: {run_time} seconds')
 
     def run_n_replications(self, n_replications=10, visualize=False, max_run_length=1000, n_visitors=10,
                            n_officestaff=10,female_ratio=0.5,
-                           adult_ratio=0.5, familiarity=0.1, valid_exits=ExitType.ABC):
+                           adult_ratio=0.5, familiarity=0.1, valid_exits=ExitType.ABC, batched=False, seed=None):
 
         """
         This function runs n_replications of the model for a specific exit type.
@@ -68,17 +217,37 @@ class Experiment:
         :param adult_ratio: float
         :param familiarity: float
         :param valid_exits: ExitType
+        :param batched: Boolean: step all replications together (not with visualize)
+        :param seed: int: seed of the experiment (None for random seeds)
         :return: total_evacuation_times_per_replication: list
         """
         total_evacuation_times_per_replication = []
         message = f'\tRunning {n_replications} replications:' if not visualize else ""
         print(message)
+
+        if batched and not visualize:
+            runner = BatchRunner(n_replications=n_replications, model=self.model, n_visitors=n_visitors,
+                                 n_officestaff=n_officestaff, female_ratio=female_ratio, adult_ratio=adult_ratio,
+                                 familiarity=familiarity, valid_exits=valid_exits, seed=seed,
+                                 max_run_length=max_run_length)
+            total_evacuation_times_per_replication = runner.run(max_run_length=max_run_length)
+
+            run_time = round(time.time() - self.cum_time[-1], 2)
+            self.execution_times.append(run_time)
+            self.cum_time.append(time.time())
+            for i, (batch_model, batch_seed) in enumerate(zip(runner.models, runner.seeds)):
+                self.record_result(get_result(batch_model, valid_exits, i, batch_seed,
+                                              round(run_time / n_replications, 2)))
+            print(f'\t\t{n_replications} replications in one batch')
+            return total_evacuation_times_per_replication
         for i in range(n_replications):
 
             evac_time = self.run_one_replication(visualize=visualize, max_run_length=max_run_length, n_visitors=n_visitors,
                                                  n_officestaff=n_officestaff,
                                                  female_ratio=female_ratio, adult_ratio=adult_ratio, familiarity=familiarity,
-                                                 valid_exits=valid_exits, model=self.model, map_img_path=self.map_path)
+                                                 valid_exits=valid_exits, model=self.model, map_img_path=self.map_path,
+                                                 seed=None if seed is None else get_job_seed(seed, valid_exits, i),
+                                                 replication=i)
 
             if visualize:
                 break
@@ -88,7 +257,8 @@ class Experiment:
         return total_evacuation_times_per_replication
 
     def run_one_replication(self, visualize=False, max_run_length=1000, n_officestaff=10, n_visitors=10, female_ratio=0.5, adult_ratio=0.5,
-                            familiarity=0.1, valid_exits=ExitType.ABC, model=EvacuationModel, map_img_path=None):
+                            familiarity=0.1, valid_exits=ExitType.ABC, model=EvacuationModel, map_img_path=None,
+                            seed=None, replication=0):
         """
         Runs one simulation, either with a visualization or without. It returns the evacuation time for this run.
         :param map_img_path:
@@ -100,6 +270,8 @@ class Experiment:
         :param familiarity: float [0,1]
         :param valid_exits: ExitType
         :param model: func, either ToyModel or MapModel
+        :param seed: int: seed of the model (None for a random seed)
+        :param replication: int: number of the replication (for the results sink)
         :return evac_time: int
         """
 
@@ -113,8 +285,11 @@ class Experiment:
             # Init model
             # model = MapModel(n_visitors=n_visitors,  female_ratio=female_ratio, adult_ratio=adult_ratio,
             #                  familiarity=familiarity, valid_exits=valid_exits)
+            seed_kwargs = {} if seed is None else {'seed': seed}  # not every model takes a seed
+            if issubclass(model, EvacuationModel):
+                seed_kwargs['max_run_length'] = max_run_length  # size of the metrics recorder
             model = model(n_visitors=n_visitors, female_ratio=female_ratio, adult_ratio=adult_ratio,
-                             familiarity=familiarity,n_officestaff=n_officestaff, valid_exits=valid_exits)
+                             familiarity=familiarity,n_officestaff=n_officestaff, valid_exits=valid_exits, **seed_kwargs)
 
             # Run model
             for i in range(max_run_length):
@@ -130,8 +305,29 @@ class Experiment:
             run_time = round(time.time() - self.cum_time[-1], 2)
             self.execution_times.append(run_time)
             self.cum_time.append(time.time())
+            self.record_result(get_result(model, valid_exits, replication, seed, run_time))
             return evac_time
 
+    def set_parameters(self, n_visitors, n_officestaff, female_ratio, adult_ratio, familiarity, max_run_length):
+        """
+        Sets the model parameters of the current run, which are stored with every replication in the results sink.
+        """
+        self.parameters = {'n_visitors': n_visitors, 'n_officestaff': n_officestaff, 'female_ratio': female_ratio,
+                           'adult_ratio': adult_ratio, 'familiarity': familiarity, 'max_run_length': max_run_length}
+
+    def record_result(self, result, **parameters):
+        """
+        Streams the result of a replication to the results sink (if the experiment has one).
+        :param result: dict, see ResultsSink.get_result
+        :param parameters: additional parameters of this replication
+        """
+        if self.results_sink is not None:
+            self.results_sink.add(result, parameters={**self.parameters, **parameters})
+
+    def flush_results(self):
+        if self.results_sink is not None:
+            self.results_sink.flush()
+
     def show_evacuation_time_averages(self):
         """
         Show the mean evacuation time per exit type.
@@ -141,6 +337,16 @@ class Experiment:
         for k, v in self.average_evacuation_times.items():
             print(f'{k}: {v}')
 
+    def show_paired_differences(self):
+        """
+        Show the mean difference in evacuation time to the baseline exit type with its confidence interval per exit
+        type (see run_paired).
+        """
+
+        print("Mean difference in evacuation time to the baseline per exit type:\n")
+        for k, v in self.paired_differences.items():
+            print(f"{k}: {v['mean']:.1f} [{v['lower']:.1f}, {v['upper']:.1f}] (n={v['n']})")
+
     def show_boxplot_evacuation_times(self, outliers=False):
         """
         Show boxplots of average evacuation times for all exit types.
@@ -231,6 +437,24 @@ class Experiment:
 
         return evac_times, average_evac_times
 
+    def load_results(self, path='./OutputData/results/', run_ids=None):
+        """
+        Loads the evacuation times of a results folder (see ResultsSink) and overwrites the current experiment's data,
+        like combine_results does for pickles.
+        :param path: folder of the results
+        :param run_ids: list of run ids to include, None for all runs in the folder
+        """
+        columns = ['run_id', 'exit_type', 'replication', 'evacuation_time']
+        frame = read_results(path, table='replications', columns=columns)
+        if run_ids is not None:
+            frame = frame[frame['run_id'].isin(run_ids)]
+
+        self.evacuation_times = {}
+        self.average_evacuation_times = {}
+        for name, group in frame.sort_values(['run_id', 'replication']).groupby('exit_type', sort=False):
+            self.evacuation_times[ExitType[name]] = group['evacuation_time'].tolist()
+            self.average_evacuation_times[ExitType[name]] = group['evacuation_time'].mean()
+
     def combine_results(self, to_include):
         """
         This function takes the individual dictionaries and overwrites the current experiment's data.
@@ -0,0 +1,378 @@
+"""
+Hierarchical pathfinding (HPA*): the walkable raster is divided into square clusters, and every free segment of the
+border between two neighbouring clusters (an entrance, e.g. a door or a corridor) gets a transition, i.e. a pair of
+adjacent cells on both sides of the border. The transition cells are the nodes of an abstract graph, whose
+edges are the steps across the borders and the shortest paths between the nodes of a cluster (breadth-first searches
+within the cluster). A query connects origin and destination to the nodes of their clusters, searches the small
+abstract graph with A*, and refines every abstract edge into cells with the local searches. The paths are close to,
+but not always exactly, the shortest paths; the work per query depends on the number of clusters on the way instead
+of the number of cells that A* expands.
+
+The abstract graph of a map is stored as an array bundle next to the compiled map (see ArrayStore), see
+EvacuationModel(pathfinding='hierarchical'). Compare with A* on the queries of PathFindingBenchmark with:
+    python -m Scripts.HierarchicalPathFinding --cluster-size 32
+"""
+import argparse
+import os
+from heapq import heappush, heappop
+import sys
+import time
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from Scripts.ArrayStore import save_arrays, load_arrays
+from Scripts.PathFinding import compute_distance_field, get_walkable_mask, UNREACHABLE, UNWALKABLE_OBJECTS, \
+    NEIGHBOR_OFFSETS
+
+# Increase when the abstract graph changes in a way that makes previously stored graphs differ from what build returns
+HIERARCHY_VERSION = 1
+
+# Width and height of the clusters (cells)
+DEFAULT_CLUSTER_SIZE = 32
+
+# Maximum number of local distance fields (of the nodes and of recent origins and destinations) kept in memory
+MAX_LOCAL_FIELDS = 20000
+
+
+def get_hierarchy_path(compiled_map_path, cluster_size=DEFAULT_CLUSTER_SIZE):
+    """
+    Returns the directory of the abstract graph of a compiled map.
+    :param compiled_map_path: directory of the compiled map (see CompiledMap.get_compiled_map_path)
+    :param cluster_size: int
+    :return: str
+    """
+    return f'{compiled_map_path}-hierarchy-c{cluster_size}-v{HIERARCHY_VERSION}'
+
+
+def get_entrances(free, start, end):
+    """
+    Returns the transitions of the free segments of a border between two clusters: the middle of every segment.
+    (Transitions at both ends of long segments, as in the original HPA*, give slightly shorter paths, but they lead
+    everyone along the same walls, and the crowds that form there slow evacuations down considerably.)
+    :param free: numpy bool array: whether the cells on both sides of the border are walkable, along the border
+    :param start: int: first index of the border
+    :param end: int: index after the border
+    :return: list of ints (indices along the border)
+    """
+    padded = np.concatenate([[False], free[start:end], [False]]).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return [start + (segment_start + segment_end - 1) // 2
+            for segment_start, segment_end in zip(changes[::2], changes[1::2])]
+
+
+class AbstractGraph:
+    """
+    Abstract graph of the clusters of a walkable raster, answers point-to-point queries with find_path.
+    """
+
+    def __init__(self, walkable, cluster_size, node_positions, edges):
+        """
+        :param walkable: numpy bool array (height, width)
+        :param cluster_size: int
+        :param node_positions: list of positions (tuples) of the transition cells
+        :param edges: numpy int array (m, 3): node, node, cost (every edge once)
+        """
+        self.walkable = walkable
+        self.height, self.width = walkable.shape
+        self.cluster_size = cluster_size
+        self.n_columns = -(-self.width // cluster_size)
+        self.node_positions = node_positions
+        self.node_ids = {pos: node for node, pos in enumerate(node_positions)}
+
+        self.cluster_nodes = {}  # cluster -> nodes in it
+        for node, pos in enumerate(node_positions):
+            self.cluster_nodes.setdefault(self.get_cluster(pos), []).append(node)
+        self.neighbors = [[] for _ in node_positions]  # node -> list of (node, cost)
+        for a, b, cost in np.asarray(edges).reshape(-1, 3).tolist():
+            self.neighbors[a].append((b, cost))
+            self.neighbors[b].append((a, cost))
+
+        self.local_fields = {}  # position -> distance field of its cluster (window) with the position as source
+
+    @classmethod
+    def build(cls, walkable, cluster_size=DEFAULT_CLUSTER_SIZE):
+        """
+        Finds the entrances between all neighbouring clusters and the costs between the nodes of every cluster.
+        :param walkable: numpy bool array (height, width)
+        :param cluster_size: int
+        :return: AbstractGraph
+        """
+        height, width = walkable.shape
+        node_positions = []
+        node_ids = {}
+        edges = []
+
+        def add_node(pos):
+            if pos not in node_ids:
+                node_ids[pos] = len(node_positions)
+                node_positions.append(pos)
+            return node_ids[pos]
+
+        # vertical borders (between a cluster and its right neighbour) and horizontal borders (and the one below)
+        for x in range(cluster_size, width, cluster_size):
+            free = walkable[:, x - 1] & walkable[:, x]
+            for y0 in range(0, height, cluster_size):
+                for y in get_entrances(free, y0, min(y0 + cluster_size, height)):
+                    edges.append((add_node((x - 1, int(y))), add_node((x, int(y))), 1))
+        for y in range(cluster_size, height, cluster_size):
+            free = walkable[y - 1, :] & walkable[y, :]
+            for x0 in range(0, width, cluster_size):
+                for x in get_entrances(free, x0, min(x0 + cluster_size, width)):
+                    edges.append((add_node((int(x), y - 1)), add_node((int(x), y)), 1))
+
+        graph = cls(walkable, cluster_size, node_positions, np.zeros((0, 3), dtype=np.int64))
+        for nodes in graph.cluster_nodes.values():
+            for i, a in enumerate(nodes):
+                field, (x0, y0) = graph.get_local_field(node_positions[a])
+                for b in nodes[i + 1:]:
+                    bx, by = node_positions[b]
+                    cost = int(field[by - y0, bx - x0])
+                    if cost != UNREACHABLE:
+                        edges.append((a, b, cost))
+
+        local_fields = graph.local_fields
+        graph = cls(walkable, cluster_size, node_positions, np.array(edges, dtype=np.int64).reshape(-1, 3))
+        graph.local_fields = local_fields  # the fields of the nodes are needed again to refine paths
+        return graph
+
+    @classmethod
+    def load(cls, path, walkable):
+        """
+        Loads an abstract graph written by save().
+        :param path: directory of the graph
+        :param walkable: numpy bool array (height, width) of the same map
+        :return: AbstractGraph
+        """
+        arrays, meta = load_arrays(path, mmap=False)
+        node_positions = [(x, y) for x, y in arrays['node_positions'].tolist()]
+        return cls(walkable, meta['cluster_size'], node_positions, arrays['edges'])
+
+    def save(self, path, meta=None):
+        """
+        Writes the nodes and edges as a bundle of arrays (see ArrayStore.save_arrays).
+        :param path: directory of the graph
+        :param meta: dict with additional information, optional
+        :return: Boolean: whether this call created the bundle (False if another process was faster)
+        """
+        edges = [(a, b, cost) for a, neighbors in enumerate(self.neighbors) for b, cost in neighbors if a < b]
+        arrays = {'node_positions': np.array(self.node_positions, dtype=np.int32).reshape(-1, 2),
+                  'edges': np.array(edges, dtype=np.int32).reshape(-1, 3)}
+        meta = dict(meta or {}, cluster_size=self.cluster_size, n_nodes=len(self.node_positions),
+                    version=HIERARCHY_VERSION, created=time.strftime('%Y-%m-%d %H:%M:%S'))
+        return save_arrays(path, arrays, meta)
+
+    def get_cluster(self, pos):
+        """
+        :param pos: Tuple
+        :return: int: index of the cluster that contains pos
+        """
+        return (pos[1] // self.cluster_size) * self.n_columns + pos[0] // self.cluster_size
+
+    def get_local_field(self, pos):
+        """
+        Returns the distance field of the cluster of pos (a breadth-first search that does not leave the cluster) with
+        pos as source, and the position of the top left cell of the cluster.
+        :param pos: Tuple
+        :return: numpy int32 array (cluster height, cluster width), Tuple
+        """
+        x0 = pos[0] // self.cluster_size * self.cluster_size
+        y0 = pos[1] // self.cluster_size * self.cluster_size
+        field = self.local_fields.get(pos)
+        if field is None:
+            if len(self.local_fields) >= MAX_LOCAL_FIELDS:
+                self.local_fields.clear()
+            window = self.walkable[y0:y0 + self.cluster_size, x0:x0 + self.cluster_size]
+            field = self.local_fields[pos] = compute_distance_field(window, [(pos[0] - x0, pos[1] - y0)])[0]
+        return field, (x0, y0)
+
+    def trace(self, pos, source):
+        """
+        Returns the cells of the shortest path from pos to source within their cluster (down the local field).
+        :param pos: Tuple
+        :param source: Tuple in the cluster of pos
+        :return: list of positions from pos to source (both included), empty if source cannot be reached
+        """
+        field, (x0, y0) = self.get_local_field(source)
+        height, width = field.shape
+        x, y = pos[0] - x0, pos[1] - y0
+        distance = int(field[y, x])
+        if distance == UNREACHABLE:
+            return []
+
+        path = [pos]
+        while distance > 0:
+            for dx, dy in NEIGHBOR_OFFSETS:
+                next_x, next_y = x + dx, y + dy
+                if 0 <= next_x < width and 0 <= next_y < height and field[next_y, next_x] == distance - 1:
+                    x, y = next_x, next_y
+                    distance -= 1
+                    break
+            path.append((x + x0, y + y0))
+        return path
+
+    def get_node_costs(self, pos):
+        """
+        Returns the steps between a position and the nodes of its cluster that it can reach within the cluster.
+        :param pos: Tuple
+        :return: list of (node, cost)
+        """
+        field, (x0, y0) = self.get_local_field(pos)
+        costs = []
+        for node in self.cluster_nodes.get(self.get_cluster(pos), []):
+            x, y = self.node_positions[node]
+            cost = int(field[y - y0, x - x0])
+            if cost != UNREACHABLE:
+                costs.append((node, cost))
+        return costs
+
+    def find_path(self, origin, destination, stats=None):
+        """
+        Returns a path from origin to destination: the shortest path within their cluster if they share one, otherwise
+        the refined shortest path over the abstract graph. Like a_star_search, the path is just [origin, destination]
+        if the destination cannot be reached.
+        :param origin: Tuple
+        :param destination: Tuple
+        :param stats: dict (optional), receives 'expanded' (number of abstract nodes expanded)
+        :return: list of positions from origin to destination (both included)
+        """
+        origin, destination = tuple(origin), tuple(destination)
+        if stats is not None:
+            stats['expanded'] = 0
+        if origin == destination:
+            return [origin]
+        if self.get_cluster(origin) == self.get_cluster(destination):
+            path = self.trace(origin, destination)
+            if path:
+                return path
+
+        goal_costs = dict(self.get_node_costs(destination))
+        if not goal_costs:
+            return [origin, destination]
+        goal_x, goal_y = destination
+
+        # A* over the abstract graph from the origin (-1) to the destination (-2), with the Manhattan distance, which
+        # never overestimates the cost of an abstract edge (the length of a path within a cluster)
+        g_score = {-1: 0}
+        parent = {}
+        closed = set()
+        counter = 0
+        frontier = [(0, counter, -1)]
+        while frontier:
+            _, _, current = heappop(frontier)
+            if current == -2:
+                break
+            if current in closed:
+                continue
+            closed.add(current)
+            if stats is not None:
+                stats['expanded'] += 1
+
+            if current == -1:
+                neighbors = self.get_node_costs(origin)
+            else:
+                neighbors = self.neighbors[current]
+                if current in goal_costs:
+                    neighbors = neighbors + [(-2, goal_costs[current])]
+            for node, cost in neighbors:
+                new_cost = g_score[current] + cost
+                if node in closed or new_cost >= g_score.get(node, new_cost + 1):
+                    continue
+                g_score[node] = new_cost
+                parent[node] = current
+                if node == -2:
+                    h = 0
+                else:
+                    x, y = self.node_positions[node]
+                    h = abs(x - goal_x) + abs(y - goal_y)
+                counter += 1
+                heappush(frontier, (new_cost + h, counter, node))
+        if -2 not in parent:
+            return [origin, destination]
+
+        nodes = [parent[-2]]
+        while nodes[-1] != -1:
+            nodes.append(parent[nodes[-1]])
+        nodes = nodes[-2::-1]
+
+        # refine: steps across borders are single cells, edges within a cluster the local shortest paths
+        path = self.trace(origin, self.node_positions[nodes[0]])
+        for a, b in zip(nodes, nodes[1:]):
+            pos_a, pos_b = self.node_positions[a], self.node_positions[b]
+            if self.get_cluster(pos_a) != self.get_cluster(pos_b):
+                path.append(pos_b)
+            else:
+                path += self.trace(pos_a, pos_b)[1:]
+        path += self.trace(self.node_positions[nodes[-1]], destination)[1:]
+        return path
+
+
+# Abstract graphs per grid and cluster size (the static objects never change after model set-up)
+_abstract_graphs = WeakKeyDictionary()
+
+
+def get_abstract_graph(grid, cluster_size=DEFAULT_CLUSTER_SIZE, path=None):
+    """
+    Returns the (cached) abstract graph of a grid. With path, the graph is loaded from there, or built and saved
+    there if it does not exist yet.
+    :param grid: MultiGrid or TerrainGrid
+    :param cluster_size: int
+    :param path: directory of the stored graph, see get_hierarchy_path, optional
+    :return: AbstractGraph
+    """
+    graphs = _abstract_graphs.setdefault(grid, {})
+    if cluster_size not in graphs:
+        walkable = get_walkable_mask(grid, UNWALKABLE_OBJECTS)
+        if path is not None and os.path.isdir(path):
+            graphs[cluster_size] = AbstractGraph.load(path, walkable)
+        else:
+            graphs[cluster_size] = AbstractGraph.build(walkable, cluster_size)
+            if path is not None:
+                graphs[cluster_size].save(path)
+    return graphs[cluster_size]
+
+
+def hierarchical_search(grid, origin, destination, stats=None, cluster_size=DEFAULT_CLUSTER_SIZE):
+    """
+    Finds a path with HPA*, a drop-in for PathFinding.a_star_search (see EvacuationModel(pathfinding=...)).
+    :param grid: MultiGrid or TerrainGrid
+    :param origin: Tuple
+    :param destination: Tuple
+    :param stats: dict (optional), receives 'expanded' (number of abstract nodes expanded)
+    :param cluster_size: int
+    :return: list of positions from origin to destination ([origin, destination] if it cannot be reached)
+    """
+    return get_abstract_graph(grid, cluster_size).find_path(origin, destination, stats=stats)
+
+
+def main():
+    from Scripts.EvacuationModel import EvacuationModel
+    from Scripts.PathFinding import a_star_search
+    from Benchmarks.PathFindingBenchmark import get_queries, IMG_PATH
+
+    parser = argparse.ArgumentParser(description='Compares hierarchical pathfinding with A*.')
+    parser.add_argument('--cluster-size', type=int, default=DEFAULT_CLUSTER_SIZE)
+    args = parser.parse_args()
+
+    model = EvacuationModel(img_path=IMG_PATH, n_visitors=0, seed=0)
+    queries = get_queries(model)
+
+    start_t = time.perf_counter()
+    graph = AbstractGraph.build(get_walkable_mask(model.grid, UNWALKABLE_OBJECTS), args.cluster_size)
+    print(f"Abstract graph: {len(graph.node_positions)} nodes, built in {time.perf_counter() - start_t:.2f} s")
+
+    for name, search in (('A*', lambda o, d: a_star_search(model.grid, o, d)), ('HPA*', graph.find_path)):
+        search(*queries[0])  # builds the search space of A* and the first local fields
+        start_t = time.perf_counter()
+        lengths = [len(search(origin, destination)) for origin, destination in queries]
+        duration = time.perf_counter() - start_t
+        print(f"{name:<6}{duration / len(queries) * 1000:>10.2f} ms/query, mean length {np.mean(lengths):.1f}")
+        if name == 'A*':
+            shortest = lengths
+    overhead = [length / best - 1 for length, best in zip(lengths, shortest) if best]
+    print(f"HPA* paths are {np.mean(overhead):.1%} longer on average (at most {max(overhead):.1%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
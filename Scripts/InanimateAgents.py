@@ -123,8 +123,9 @@ class Alarm(Agent):
 
     def step(self):
 
-        self.timer -= 1
-        if self.timer <= 0:
-            self.is_activated = True
-            self.model.schedule.remove(self)
+        with self.model.profiler.phase('alarm'):
+            self.timer -= 1
+            if self.timer <= 0:
+                self.is_activated = True
+                self.model.schedule.remove(self)
 
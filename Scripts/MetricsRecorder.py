@@ -0,0 +1,167 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from Scripts.ArrayStore import save_arrays
+from Scripts.SpatialIndex import CrowdTable
+
+MODEL_METRICS = ('safe_agents', 'persons_inside', 'mean_speed', 'max_density')
+EXIT_METRICS = ('exit_throughput', 'exit_queue')
+
+
+class MetricsRecorder:
+    """
+    Records metrics of a model once per tick into preallocated numpy ring buffers (one row per tick; the oldest rows
+    are overwritten once more than capacity ticks were recorded, which sets truncated and warns once). Model metrics
+    have one value per tick, exit metrics one value per exit and tick:
+        safe_agents: number of persons that left the building
+        persons_inside: number of persons in the building
+        mean_speed: mean current speed (running speed when evacuating, else walking speed) of the persons inside
+        max_density: highest number of persons within density_radius of a person (incl. the person)
+        exit_throughput: number of persons that left through an exit in this tick
+        exit_queue: number of persons within queue_radius of an exit
+    Further model metrics can be added as functions of the model. Like Mesa's DataCollector, model_vars holds the
+    model metrics per name, so the recorder works with ChartModule.
+    """
+
+    def __init__(self, exits, capacity=1000, metrics=MODEL_METRICS + EXIT_METRICS, custom_metrics=None,
+                 density_radius=6, queue_radius=5):
+        """
+        :param exits: list of exit positions (columns of the exit metrics)
+        :param capacity: int: number of ticks kept, e.g. the max_run_length of the run
+        :param metrics: names of the built-in metrics to record
+        :param custom_metrics: dict with name as key and function(model) -> float as value, optional
+        :param density_radius: int: radius of max_density (cells)
+        :param queue_radius: int: radius of exit_queue (cells)
+        """
+        unknown = set(metrics) - set(MODEL_METRICS + EXIT_METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics: {sorted(unknown)}")
+
+        self.exits = [tuple(pos) for pos in exits]
+        self.exit_array = np.array(self.exits, dtype=np.int64).reshape(-1, 2)
+        self.capacity = max(int(capacity), 1)
+        self.custom_metrics = dict(custom_metrics or {})
+        self.model_metrics = [name for name in metrics if name in MODEL_METRICS] + list(self.custom_metrics)
+        self.exit_metrics = [name for name in metrics if name in EXIT_METRICS]
+        self.density_radius = density_radius
+        self.queue_radius = queue_radius
+
+        self.values = {name: np.zeros(self.capacity, dtype=float) for name in self.model_metrics}
+        self.values.update({name: np.zeros((self.capacity, len(self.exits)), dtype=float) for name in self.exit_metrics})
+        self.ticks = np.zeros(self.capacity, dtype=np.int64)
+        self.n_records = 0
+        self.last_exit_usage = np.zeros(len(self.exits), dtype=float)
+
+    def collect(self, model, positions=None, speeds=None):
+        """
+        Records the metrics of the current tick.
+        :param model: EvacuationModel
+        :param positions: numpy int array (n, 2) with the positions of the persons inside, defaults to
+                          model.get_person_state()
+        :param speeds: numpy float array (n,) with their current speeds
+        """
+        if positions is None:
+            positions, speeds = model.get_person_state()
+        if self.n_records == self.capacity:
+            warnings.warn(f"MetricsRecorder: more than {self.capacity} ticks recorded, the earliest ticks are "
+                          f"overwritten (increase capacity, e.g. the model's max_run_length)", RuntimeWarning)
+        row = self.n_records % self.capacity
+        self.ticks[row] = model.end_time
+        values = self.values
+
+        if 'safe_agents' in values:
+            values['safe_agents'][row] = len(model.safe_agents)
+        if 'persons_inside' in values:
+            values['persons_inside'][row] = len(positions)
+        if 'mean_speed' in values:
+            values['mean_speed'][row] = speeds.mean() if len(speeds) else 0.0
+        if 'max_density' in values:
+            values['max_density'][row] = self.get_max_density(positions)
+        if 'exit_throughput' in values:
+            exit_usage = np.array([model.exit_usage.get(pos, 0) for pos in self.exits], dtype=float)
+            values['exit_throughput'][row] = exit_usage - self.last_exit_usage
+            self.last_exit_usage = exit_usage
+        if 'exit_queue' in values:
+            distances = np.abs(positions[:, None, :] - self.exit_array[None, :, :]).max(axis=2)
+            values['exit_queue'][row] = (distances <= self.queue_radius).sum(axis=0)
+        for name, function in self.custom_metrics.items():
+            values[name][row] = function(model)
+
+        self.n_records += 1
+
+    def get_max_density(self, positions):
+        """
+        Returns the highest number of persons in the Moore neighborhood (density_radius) of any person, with a
+        CrowdTable of the persons (whose size depends on the number of persons, not on the area they are spread over).
+        :param positions: numpy int array (n, 2)
+        :return: int
+        """
+        if not len(positions):
+            return 0
+        return int(CrowdTable(positions).sum_in_radius_many(positions, self.density_radius).max())
+
+    @property
+    def truncated(self):
+        """
+        Whether the earliest recorded ticks were overwritten (more than capacity ticks were recorded).
+        :return: Boolean
+        """
+        return self.n_records > self.capacity
+
+    def get_rows(self):
+        """
+        Returns the ring buffer rows of the recorded ticks in chronological order.
+        :return: numpy int array
+        """
+        if self.n_records <= self.capacity:
+            return np.arange(self.n_records)
+        start = self.n_records % self.capacity
+        return np.concatenate([np.arange(start, self.capacity), np.arange(start)])
+
+    def get(self, name):
+        """
+        Returns the recorded values of a metric in chronological order.
+        :param name: str
+        :return: numpy array (ticks,) or (ticks, exits) for exit metrics
+        """
+        return self.values[name][self.get_rows()]
+
+    @property
+    def model_vars(self):
+        return {name: self.get(name).tolist() for name in self.model_metrics}
+
+    def get_arrays(self):
+        """
+        Returns the recorded ticks and all metrics in chronological order.
+        :return: dict with name as key and numpy array as value (incl. 'tick' and 'exits')
+        """
+        rows = self.get_rows()
+        arrays = {name: values[rows] for name, values in self.values.items()}
+        arrays['tick'] = self.ticks[rows]
+        arrays['exits'] = self.exit_array
+        return arrays
+
+    def to_frame(self):
+        """
+        Returns the recorded metrics as a DataFrame with one row per tick and one column per model metric and per
+        exit metric and exit (e.g. exit_queue_376_158).
+        :return: pandas DataFrame
+        """
+        arrays = self.get_arrays()
+        columns = {'tick': arrays['tick']}
+        columns.update({name: arrays[name] for name in self.model_metrics})
+        for name in self.exit_metrics:
+            for j, (x, y) in enumerate(self.exits):
+                columns[f'{name}_{x}_{y}'] = arrays[name][:, j]
+        return pd.DataFrame(columns)
+
+    def save(self, path, meta=None):
+        """
+        Saves the recorded metrics as an array bundle (see ArrayStore.save_arrays).
+        :param path: directory name of the bundle
+        :param meta: dict (json serializable), optional
+        :return: Boolean: whether the bundle was written
+        """
+        return save_arrays(path, self.get_arrays(), meta=meta)
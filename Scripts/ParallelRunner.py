@@ -0,0 +1,228 @@
+"""
+Parallel replications: every (exit type, replication) of an experiment is one job with its own seed, and jobs run
+either on a process pool or on worker processes that share a file-based job queue (a folder). With the queue, more
+workers (e.g. on other machines that see the same folder) can join a running experiment with:
+    python -m Scripts.ParallelRunner <queue_dir>
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import os
+import pickle
+import subprocess
+import sys
+import time
+import uuid
+
+import numpy as np
+
+from Scripts.ResultsSink import get_result
+
+
+def get_job_seed(seed, exit_type, replication):
+    """
+    Returns the seed of one job, derived from the experiment seed, such that every job gets the same (independent)
+    random numbers no matter which process runs it or in which order.
+    :param seed: int: seed of the experiment
+    :param exit_type: ExitType, or None for the seed that a replication shares between all exit types (common random
+                      numbers)
+    :param replication: int
+    :return: int
+    """
+    spawn_key = (replication,) if exit_type is None else (exit_type.value, replication)
+    sequence = np.random.SeedSequence(seed, spawn_key=spawn_key)
+    return int(sequence.generate_state(1)[0])
+
+
+def run_job(job):
+    """
+    Runs one replication of a job (in any process) and returns its result.
+    :param job: dict with model (class that takes a seed and max_run_length), model_kwargs (dict), exit_type, replication, seed and max_run_length
+    :return: dict with exit_type, replication, seed, evacuation_time, run_time (s) and per-tick data, see
+             ResultsSink.get_result
+    """
+    start_t = time.time()
+    model = job['model'](valid_exits=job['exit_type'], seed=job['seed'], max_run_length=job['max_run_length'],
+                         **job['model_kwargs'])
+    for _ in range(job['max_run_length']):
+        model.step()
+        if model.is_done():
+            break
+
+    return get_result(model, job['exit_type'], job['replication'], job['seed'], round(time.time() - start_t, 2))
+
+
+def run_jobs(jobs, callback, n_workers=None, queue_dir=None, report_every=1):
+    """
+    Runs jobs in parallel and hands every result to callback as soon as its job is finished.
+    :param jobs: list of job dicts, see run_job
+    :param callback: function(result), called in the calling process for every finished job
+    :param n_workers: int: number of processes, defaults to the number of CPUs. With 1 everything runs in-process.
+    :param queue_dir: folder of a file-based job queue; if given, n_workers worker processes are started on it instead
+                      of a process pool
+    :param report_every: int: print the progress after every report_every finished jobs (0 for no reports)
+    :return: None
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    start_t = time.time()
+
+    def report(n_jobs_done):
+        if report_every and (n_jobs_done % report_every == 0 or n_jobs_done == len(jobs)):
+            duration = time.time() - start_t
+            remaining = duration / n_jobs_done * (len(jobs) - n_jobs_done)
+            print(f'\t>> {n_jobs_done}/{len(jobs)} replications done ({duration:.0f} s, ~{remaining:.0f} s left)')
+
+    if queue_dir is not None:
+        for n_jobs_done, result in enumerate(FileJobQueue(queue_dir).run(jobs, n_workers=n_workers), start=1):
+            callback(result)
+            report(n_jobs_done)
+        return
+
+    if n_workers == 1 or len(jobs) <= 1:
+        for n_jobs_done, job in enumerate(jobs, start=1):
+            callback(run_job(job))
+            report(n_jobs_done)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for n_jobs_done, future in enumerate(as_completed(futures), start=1):
+            callback(future.result())
+            report(n_jobs_done)
+
+
+class FileJobQueue:
+    """
+    Job queue in a folder, for worker processes that do not share a process pool. Every job is a pickle in pending/.
+    A worker claims a job by renaming it into running/ (atomic, so every job is claimed once) and writes its result
+    into done/. Jobs that were claimed by a worker that died can be put back with requeue_running().
+    """
+
+    def __init__(self, queue_dir):
+        """
+        :param queue_dir: folder of the queue
+        """
+        self.queue_dir = queue_dir
+        for name in ('pending', 'running', 'done'):
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+
+    def get_path(self, state, name=''):
+        return os.path.join(self.queue_dir, state, name)
+
+    def put(self, jobs):
+        """
+        Adds jobs to the queue.
+        :param jobs: list of job dicts, see run_job
+        :return: names: list with the file name of every job
+        """
+        names = []
+        for job in jobs:
+            name = f"{job['exit_type'].name}-{job['replication']:05d}-{uuid.uuid4().hex[:8]}.pickle"
+            self.write(self.get_path('pending', name), job)
+            names.append(name)
+        return names
+
+    @staticmethod
+    def write(path, data):
+        """
+        Writes a pickle under a temporary name and renames it, so nobody reads a half-written file.
+        """
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as handle:
+            pickle.dump(data, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def claim(self):
+        """
+        Claims the next pending job.
+        :return: name: str and job: dict, or None if no job is pending
+        """
+        for name in sorted(os.listdir(self.get_path('pending'))):
+            if not name.endswith('.pickle'):
+                continue
+            try:
+                os.rename(self.get_path('pending', name), self.get_path('running', name))
+            except OSError:  # claimed by another worker
+                continue
+            with open(self.get_path('running', name), 'rb') as handle:
+                return name, pickle.load(handle)
+        return None
+
+    def complete(self, name, result):
+        """
+        Stores the result of a claimed job.
+        :param name: str: file name of the job
+        :param result: dict, see run_job
+        """
+        self.write(self.get_path('done', name), result)
+        os.remove(self.get_path('running', name))
+
+    def requeue_running(self):
+        """
+        Puts all claimed but unfinished jobs back into pending/ (e.g. after workers crashed).
+        """
+        for name in os.listdir(self.get_path('running')):
+            if name.endswith('.pickle'):
+                os.rename(self.get_path('running', name), self.get_path('pending', name))
+
+    def work(self):
+        """
+        Runs pending jobs until none is left.
+        :return: int: number of jobs done
+        """
+        n_done = 0
+        while True:
+            claimed = self.claim()
+            if claimed is None:
+                return n_done
+            name, job = claimed
+            self.complete(name, run_job(job))
+            n_done += 1
+
+    def run(self, jobs, n_workers=1, poll_interval=1.0):
+        """
+        Puts jobs into the queue, starts n_workers worker processes on it and yields the results of these jobs as they
+        come in (other workers may join). Raises a RuntimeError if all workers stopped before the jobs were done.
+        :param jobs: list of job dicts, see run_job
+        :param n_workers: int
+        :param poll_interval: float: seconds between two looks into done/
+        :return: generator of result dicts
+        """
+        remaining = set(self.put(jobs))
+        repository_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        workers = [subprocess.Popen([sys.executable, '-m', 'Scripts.ParallelRunner', os.path.abspath(self.queue_dir)],
+                                    cwd=repository_root) for _ in range(n_workers)]
+        try:
+            while remaining:
+                finished = [name for name in os.listdir(self.get_path('done')) if name in remaining]
+                for name in finished:
+                    with open(self.get_path('done', name), 'rb') as handle:
+                        result = pickle.load(handle)
+                    remaining.remove(name)
+                    yield result
+                if not finished:
+                    if all(worker.poll() is not None for worker in workers):
+                        # jobs that are neither claimed (by other workers) nor done will not be done anymore
+                        in_progress = set(os.listdir(self.get_path('running'))) | set(os.listdir(self.get_path('done')))
+                        if not remaining & in_progress:
+                            raise RuntimeError(f'All workers stopped, {len(remaining)} jobs were not done')
+                    time.sleep(poll_interval)
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the jobs of a file-based job queue (see FileJobQueue).')
+    parser.add_argument('queue_dir', help='folder of the job queue')
+    args = parser.parse_args()
+
+    n_done = FileJobQueue(args.queue_dir).work()
+    print(f"Worker {os.getpid()}: {n_done} jobs done")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import hashlib
+import os
+import sys
+import time
+
+import numpy as np
+
+from Scripts.ArrayStore import save_arrays, load_arrays
+
+# Increase when the pathfinding changes in a way that makes previously cached paths differ from what it would return
+PATH_CACHE_VERSION = 1
+
+# Estimated sizes (CPython, 64 bit) for the memory footprint: a suffix index entry (dict slot and (key, index) tuple)
+# and a shared position tuple with its two ints
+SUFFIX_ENTRY_NBYTES = 100
+POSITION_NBYTES = 120
+
+# Cache folder in the repository root (independent of the working directory of the notebook)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'PathCache')
+
+
+def get_path_cache_key(space, queries, params=None):
+    """
+    Returns the content address of a set of paths: a hash of the walkability raster that the paths were computed on,
+    the pathfinding parameters and the (origin, destination) queries. Whenever the map image, the colour definitions
+    or the unwalkable object types change the raster, the key changes too, so stale paths are never reused.
+
+    :param space: SearchSpace the paths are computed on
+    :param queries: list of tuples (origin, destination)
+    :param params: dict with further pathfinding parameters that influence the paths, optional
+    :return: str: hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(f'version={PATH_CACHE_VERSION};shape={space.height}x{space.width};'.encode())
+    digest.update(repr(sorted((params or {}).items())).encode())
+    digest.update(space.mask.tobytes())
+    digest.update(np.asarray(sorted(queries), dtype=np.int32).tobytes())
+    return digest.hexdigest()[:32]
+
+
+class PathCache(MutableMapping):
+    """
+    Dict-like store of paths (tuples of positions) by (origin, destination), as used for model.all_paths. Paths are
+    shared by all persons that follow them, so they are immutable tuples.
+    Paths saved with save() are stored as int32 arrays: flat cell indices (y * width + x) of all paths concatenated,
+    and offsets marking where each path starts. A loaded cache memory-maps these arrays and decodes a path only when it
+    is requested. Paths that are added at runtime are kept in memory.
+
+    The paths in memory (added at runtime, or decoded from the stored arrays) form an LRU cache that can be bounded by
+    the number of paths (max_paths) and by their estimated size in bytes (max_bytes): the least recently used paths
+    are evicted first. Stored paths stay available after eviction (they are decoded again), runtime paths have to be
+    computed again. All paths share their position tuples (one per cell, so this table is bounded by the grid), and
+    with share_suffixes a path also serves every origin on it: the rest of a shortest path is a shortest path to the
+    same destination, so lookup() returns the cached path together with the index of the origin on it (a suffix hit).
+    Suffix hits are off by default: persons rarely ask for a path from a cell on a cached path to the same destination
+    (none in a replication with 100 visitors), while the index of all cells takes about 10 times the memory of the
+    paths.
+    """
+
+    def __init__(self, width, arrays=None, max_paths=None, max_bytes=None, share_suffixes=False):
+        """
+        :param width: int: width of the grid (to convert positions to flat indices)
+        :param arrays: dict with the arrays 'origins', 'destinations', 'offsets' and 'cells' (see save), optional
+        :param max_paths: int: maximum number of paths in memory, None for no limit
+        :param max_bytes: int: maximum estimated size of the paths in memory, None for no limit
+        :param share_suffixes: Boolean: index the cells of every path in memory for suffix hits
+        """
+        self.width = width
+        self.paths = OrderedDict()  # (origin, destination) -> path, least recently used first
+        self.arrays = arrays
+        self.stored_index = None  # (origin, destination) -> row in arrays, built on first access
+        self.max_paths = max_paths
+        self.max_bytes = max_bytes
+        self.share_suffixes = share_suffixes
+        self.suffixes = {}  # destination -> {cell: ((origin, destination) of a path through the cell, index on it)}
+        self.positions = {}  # flat cell index -> position tuple, shared by all paths
+        self.nbytes = 0  # estimated size of the paths in memory (incl. their suffix index entries)
+        self.hits = 0
+        self.suffix_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Loads a cache that was written by save().
+        :param path: directory of the cache
+        :param kwargs: limits of the cache, see __init__
+        :return: PathCache
+        """
+        arrays, meta = load_arrays(path, mmap=True)
+        return cls(width=meta['width'], arrays=arrays, **kwargs)
+
+    def save(self, path, meta=None):
+        """
+        Writes all paths of this cache as one bundle of int32 arrays (see ArrayStore.save_arrays).
+        :param path: directory of the cache
+        :param meta: dict with additional information, optional
+        :return: Boolean: whether this call created the bundle (False if another process was faster)
+        """
+        keys = list(self)
+        paths = [self[key] for key in keys]
+
+        offsets = np.zeros(len(paths) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum([len(p) for p in paths])
+        arrays = {'origins': np.array([self.to_index(o) for o, _ in keys], dtype=np.int32),
+                  'destinations': np.array([self.to_index(d) for _, d in keys], dtype=np.int32),
+                  'offsets': offsets,
+                  'cells': np.array([self.to_index(pos) for p in paths for pos in p], dtype=np.int32)}
+
+        meta = dict(meta or {}, width=self.width, n_paths=len(paths), version=PATH_CACHE_VERSION,
+                    created=time.strftime('%Y-%m-%d %H:%M:%S'))
+        return save_arrays(path, arrays, meta)
+
+    def set_limits(self, max_paths=None, max_bytes=None):
+        """
+        Bounds the paths in memory (see __init__) and evicts paths that exceed the new limits.
+        :param max_paths: int or None
+        :param max_bytes: int or None
+        """
+        self.max_paths = max_paths
+        self.max_bytes = max_bytes
+        self.evict()
+
+    def to_index(self, pos):
+        return pos[1] * self.width + pos[0]
+
+    def to_pos(self, index):
+        y, x = divmod(int(index), self.width)
+        return x, y
+
+    def get_position(self, pos):
+        """
+        Returns the shared tuple of a position.
+        :param pos: Tuple
+        :return: Tuple
+        """
+        index = pos[1] * self.width + pos[0]
+        shared = self.positions.get(index)
+        if shared is None:
+            shared = self.positions[index] = (int(pos[0]), int(pos[1]))
+        return shared
+
+    def get_stored_index(self):
+        """
+        Returns the dict (origin, destination) -> row of the stored arrays.
+        """
+        if self.stored_index is None:
+            self.stored_index = {}
+            if self.arrays is not None:
+                for row, (o, d) in enumerate(zip(self.arrays['origins'].tolist(), self.arrays['destinations'].tolist())):
+                    self.stored_index[(self.to_pos(o), self.to_pos(d))] = row
+        return self.stored_index
+
+    def get_path_nbytes(self, path):
+        """
+        Returns the estimated size of a path in memory: the tuple (the shared positions are not counted) and, with
+        share_suffixes, its entries in the suffix index.
+        :param path: tuple
+        :return: int
+        """
+        return sys.getsizeof(path) + (SUFFIX_ENTRY_NBYTES * len(path) if self.share_suffixes else 0)
+
+    def lookup(self, origin, destination):
+        """
+        Returns a path from origin to destination as (path, start): path[start] is origin and path[-1] is destination.
+        Counts a hit for a path with this origin and destination, a suffix hit for a path that passes origin, and a
+        miss if there is none (then the caller computes the path and adds it).
+        :param origin: Tuple
+        :param destination: Tuple
+        :return: (tuple, int) or None
+        """
+        key = (origin, destination)
+        path = self.paths.get(key)
+        if path is not None:
+            self.paths.move_to_end(key)
+            self.hits += 1
+            return path, 0
+        if key in self.get_stored_index():
+            self.hits += 1
+            return self[key], 0
+        if self.share_suffixes:
+            entry = self.suffixes.get(destination, {}).get(origin)
+            if entry is not None:
+                owner, start = entry
+                self.paths.move_to_end(owner)
+                self.suffix_hits += 1
+                return self.paths[owner], start
+        self.misses += 1
+        return None
+
+    def add(self, key, path):
+        """
+        Adds a path to memory (with shared positions) and evicts the least recently used paths if needed.
+        :param key: (origin, destination)
+        :param path: sequence of positions
+        :return: tuple: the path as it is stored
+        """
+        if key in self.paths:
+            self.remove(key)
+        path = tuple(self.get_position(pos) for pos in path)
+        self.paths[key] = path
+        self.nbytes += self.get_path_nbytes(path)
+        if self.share_suffixes:
+            cells = self.suffixes.setdefault(key[1], {})
+            for i, pos in enumerate(path):
+                cells.setdefault(pos, (key, i))
+        self.evict()
+        return path
+
+    def remove(self, key):
+        """
+        Removes a path from memory (a stored path stays available in the arrays).
+        :param key: (origin, destination)
+        """
+        path = self.paths.pop(key)
+        self.nbytes -= self.get_path_nbytes(path)
+        if self.share_suffixes:
+            cells = self.suffixes[key[1]]
+            for pos in path:
+                entry = cells.get(pos)
+                if entry is not None and entry[0] == key:
+                    del cells[pos]
+            if not cells:
+                del self.suffixes[key[1]]
+
+    def evict(self):
+        """
+        Removes the least recently used paths from memory until the cache is within its limits.
+        """
+        while self.paths and ((self.max_paths is not None and len(self.paths) > self.max_paths) or
+                              (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            self.remove(next(iter(self.paths)))
+            self.evictions += 1
+
+    def get_stats(self):
+        """
+        Returns the hit rate (exact and suffix hits per lookup), the number of evictions and the memory footprint.
+        :return: dict
+        """
+        lookups = self.hits + self.suffix_hits + self.misses
+        return {'hits': self.hits, 'suffix_hits': self.suffix_hits, 'misses': self.misses,
+                'hit_rate': (self.hits + self.suffix_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'paths_in_memory': len(self.paths), 'nbytes': self.nbytes,
+                'positions_nbytes': POSITION_NBYTES * len(self.positions)}
+
+    def __getitem__(self, key):
+        path = self.paths.get(key)
+        if path is not None:
+            self.paths.move_to_end(key)
+            return path
+
+        row = self.get_stored_index()[key]  # raises KeyError for unknown paths, just like a dict
+        offsets = self.arrays['offsets']
+        cells = np.asarray(self.arrays['cells'][offsets[row]:offsets[row + 1]]).tolist()
+        positions = self.positions
+        path = tuple(positions[index] if index in positions else self.get_position(self.to_pos(index))
+                     for index in cells)
+        return self.add(key, path)
+
+    def __setitem__(self, key, path):
+        self.add(key, path)
+
+    def __delitem__(self, key):
+        in_memory = key in self.paths
+        if in_memory:
+            self.remove(key)
+        if self.get_stored_index().pop(key, None) is None and not in_memory:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.paths or key in self.get_stored_index()
+
+    def __iter__(self):
+        yield from self.get_stored_index()
+        for key in list(self.paths):
+            if key not in self.get_stored_index():
+                yield key
+
+    def __len__(self):
+        stored = self.get_stored_index()
+        return len(stored) + sum(1 for key in self.paths if key not in stored)
@@ -1,12 +1,30 @@
-from queue import PriorityQueue
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from heapq import heappush, heappop
+from multiprocessing.shared_memory import SharedMemory
+from weakref import WeakKeyDictionary
+import os
+import time
+import numpy as np
 from Scripts.InanimateAgents import *
+from Scripts.Terrain import TerrainGrid
 
+# Object types that agents cannot walk through (default for all pathfinding functions)
+UNWALKABLE_OBJECTS = [Wall, Obstacle, Desk, HelpDesk, Shelf, OutOfBounds]
 
-def get_all_paths(grid):
+# Value of a distance field for cells from which no source can be reached
+UNREACHABLE = -1
+
+# Von Neumann neighbourhood (the grid is 4-connected for walking)
+NEIGHBOR_OFFSETS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+def get_all_paths(grid, method='astar'):
     """
     This functions takes in the model and calculates the ideal path from each cell to the closest and the main exit.
     This will return a dictionary with these paths.
     This will be calculated at the initiation of the model.
+    :param method: 'astar' or 'jps' (see a_star_search)
     """
 
     print("Calculating all possible paths ... ")
@@ -17,65 +35,553 @@ def get_all_paths(grid):
 
     for d in destinations:
         for o in origins:
-            path = a_star_search(grid, o, d)
+            path = a_star_search(grid, o, d, method=method)
             all_paths[(o, d)] = path
 
     print('All paths have been calculated!')
     return all_paths
 
 
-def a_star_search(grid, origin, destination, unwalkable_objects_list=None):
+def a_star_search(grid, origin, destination, unwalkable_objects_list=None, stats=None, method='astar'):
     """
     This function returns the shortest path between pos1 and pos2 on a grid.
     Inspiration from: https://www.redblobgames.com/pathfinding/a-star/implementation.html
+    The search itself runs on flat cell indices of the grid's (cached) SearchSpace, see a_star_search_indices.
+    If the destination cannot be reached, the path is just [origin, destination] (as it has always been).
 
     :param unwalkable_objects_list: list with all object types that are unwalkable
     :param grid: MultiGrid
     :param origin: Tuple
     :param destination: Tuple
+    :param stats: dict (optional) that receives the search statistics, see a_star_search_indices
+    :param method: 'astar' (plain A*) or 'jps' (Jump Point Search, see jump_point_search_indices): both return a
+                   shortest path, but not always the same one
 
     :return: path : list
     """
 
     if unwalkable_objects_list is None:
-        unwalkable_objects_list = [Wall, Obstacle, Desk, HelpDesk, Shelf, OutOfBounds]
+        unwalkable_objects_list = UNWALKABLE_OBJECTS
 
-    frontier = PriorityQueue()
-    frontier.put(origin, False)
-    path = {}  # This will be sth like a linked list
-    cost_so_far = {}
-    path[origin] = None
-    cost_so_far[origin] = 0
+    space = get_search_space(grid, unwalkable_objects_list)
+    return find_path(space, origin, destination, stats=stats, method=method)
 
-    while not frontier.empty():
-        current = frontier.get()
 
-        if current == destination:
+def find_path(space, origin, destination, stats=None, method='astar'):
+    """
+    Runs A* (or Jump Point Search) on a SearchSpace between two positions, see a_star_search.
+    :param space: SearchSpace
+    :param origin: Tuple
+    :param destination: Tuple
+    :param stats: dict (optional) that receives the search statistics, see a_star_search_indices
+    :param method: 'astar' or 'jps'
+    :return: path : list
+    """
+    if method not in SEARCH_METHODS:
+        raise ValueError(f"Unknown search method {method}, use one of {sorted(SEARCH_METHODS)}")
+    if origin == destination:
+        return [origin]
+
+    path = SEARCH_METHODS[method](space, space.to_index(origin), space.to_index(destination), stats=stats)
+
+    if not path:
+        return [origin, destination]
+    return [space.to_pos(index) for index in path]
+
+
+def a_star_search_indices(space, start, goal, stats=None):
+    """
+    A* on the flat cell indices of a SearchSpace. The frontier is a heapq of (f, h, counter, index) tuples, so ties
+    in f are broken towards the cell closest to the goal and then by insertion order. The g-scores and parents live
+    in numpy arrays indexed by cell; outdated heap entries are skipped when popped.
+
+    The returned path is a shortest path: every step costs 1 and the Manhattan distance never overestimates the
+    remaining cost and changes by at most 1 per step (it is consistent), so a cell's g-score is final once the cell is
+    expanded and the goal's g-score is optimal the first time the goal is popped from the frontier.
+
+    :param space: SearchSpace
+    :param start: int: flat index of the origin
+    :param goal: int: flat index of the destination
+    :param stats: dict (optional), receives 'expanded' (number of cells expanded) and 'pushed' (frontier insertions)
+    :return: list of flat indices from start to goal (both included), empty if goal cannot be reached
+    """
+    walkable = space.walkable
+    stride = space.stride
+    offsets = space.offsets
+    goal_y, goal_x = divmod(goal, stride)
+
+    g_score = np.full(space.size, np.iinfo(np.int32).max, dtype=np.int32)
+    parent = np.full(space.size, -1, dtype=np.int32)
+    closed = bytearray(space.size)
+
+    start_y, start_x = divmod(start, stride)
+    h = abs(start_x - goal_x) + abs(start_y - goal_y)
+    g_score[start] = 0
+    counter = 0
+    expanded = 0
+    found = False
+    frontier = [(h, h, counter, start)]
+
+    while frontier:
+        _, _, _, current = heappop(frontier)
+
+        if current == goal:
+            found = True
+            break
+        if closed[current]:
+            continue
+        closed[current] = 1
+        expanded += 1
+
+        new_cost = int(g_score[current]) + 1
+        for offset in offsets:
+            next_index = current + offset
+            if not walkable[next_index] or closed[next_index] or new_cost >= g_score[next_index]:
+                continue
+            g_score[next_index] = new_cost
+            parent[next_index] = current
+            next_y, next_x = divmod(next_index, stride)
+            h = abs(next_x - goal_x) + abs(next_y - goal_y)
+            counter += 1
+            heappush(frontier, (new_cost + h, h, counter, next_index))
+
+    if stats is not None:
+        stats['expanded'] = expanded
+        stats['pushed'] = counter + 1
+
+    if not found:
+        return []
+
+    # Convert path from a linked list (parent array) to proper list
+    path = [goal]
+    while path[-1] != start:
+        path.append(int(parent[path[-1]]))
+    path.reverse()
+    return path
+
+
+def jump_point_search_indices(space, start, goal, stats=None):
+    """
+    Jump Point Search (JPS) for the 4-connected grid, on the flat cell indices of a SearchSpace. It only searches
+    canonical shortest paths: paths that may turn from a vertical into a horizontal move anywhere, but from a
+    horizontal into a vertical move only where an obstacle forces it (the cell diagonally behind the turn is blocked).
+    Every shortest path can be rearranged into a canonical one of the same length (a turn that is not forced can be
+    made one cell earlier), so the result is a shortest path. Instead of single cells the search expands jump points:
+        * moving horizontally, the next cell with a forced turn (from the precomputed jump tables of the space), or
+          the goal
+        * moving vertically, the next cell from which a horizontal jump finds a jump point, or the goal
+    Horizontal jumps are table lookups and vertical jumps scan their column, so long straight stretches of open floor
+    cost neither heap operations nor expansions. A search state is a jump point together with the direction in which
+    it was reached (the direction decides its successors), and its cost is the number of cells walked.
+
+    :param space: SearchSpace
+    :param start: int: flat index of the origin
+    :param goal: int: flat index of the destination
+    :param stats: dict (optional), receives 'expanded' (number of jump points expanded) and 'pushed' (frontier
+                  insertions)
+    :return: list of flat indices from start to goal (both included), empty if goal cannot be reached
+    """
+    walkable = space.walkable
+    stride = space.stride
+    jump_right, wall_right, jump_left, wall_left = space.get_jump_tables()
+    goal_y, goal_x = divmod(goal, stride)
+
+    def jump_horizontal(index, dx):
+        if dx > 0:
+            jump, wall = jump_right[index], wall_right[index]
+            if index < goal < wall and (jump < 0 or goal < jump):
+                return goal
+        else:
+            jump, wall = jump_left[index], wall_left[index]
+            if wall < goal < index and goal > jump:
+                return goal
+        return jump
+
+    def jump_vertical(index, dy):
+        step = dy * stride
+        while True:
+            index += step
+            if not walkable[index]:
+                return -1
+            if index == goal or jump_horizontal(index, 1) >= 0 or jump_horizontal(index, -1) >= 0:
+                return index
+
+    # directions: 0 right, 1 left, 2 down (+y), 3 up (-y); 4 marks the start, which continues in all directions
+    g_score = {start * 5 + 4: 0}
+    parent = {}
+    closed = set()
+    counter = 0
+    expanded = 0
+    found = None
+    start_y, start_x = divmod(start, stride)
+    h = abs(start_x - goal_x) + abs(start_y - goal_y)
+    frontier = [(h, h, counter, start * 5 + 4)]
+
+    while frontier:
+        _, _, _, state = heappop(frontier)
+        current, direction = divmod(state, 5)
+
+        if current == goal:
+            found = state
             break
+        if state in closed:
+            continue
+        closed.add(state)
+        expanded += 1
+
+        if direction == 4:
+            directions = (0, 1, 2, 3)
+        elif direction < 2:  # horizontal: straight on, and turns that an obstacle behind forces
+            dx = 1 if direction == 0 else -1
+            directions = [direction]
+            if walkable[current + stride] and not walkable[current - dx + stride]:
+                directions.append(2)
+            if walkable[current - stride] and not walkable[current - dx - stride]:
+                directions.append(3)
+        else:  # vertical: straight on, and both horizontal turns
+            directions = (direction, 0, 1)
+
+        for next_direction in directions:
+            if next_direction < 2:
+                next_index = jump_horizontal(current, 1 if next_direction == 0 else -1)
+                cost = abs(next_index - current)
+            else:
+                next_index = jump_vertical(current, 1 if next_direction == 2 else -1)
+                cost = abs(next_index - current) // stride
+            if next_index < 0:
+                continue
+            next_state = next_index * 5 + next_direction
+            new_cost = g_score[state] + cost
+            if next_state in closed or new_cost >= g_score.get(next_state, new_cost + 1):
+                continue
+            g_score[next_state] = new_cost
+            parent[next_state] = state
+            next_y, next_x = divmod(next_index, stride)
+            h = abs(next_x - goal_x) + abs(next_y - goal_y)
+            counter += 1
+            heappush(frontier, (new_cost + h, h, counter, next_state))
+
+    if stats is not None:
+        stats['expanded'] = expanded
+        stats['pushed'] = counter + 1
+
+    if found is None:
+        return []
+
+    # Convert the jump points to cells: the cells between two jump points are on a straight line
+    jump_points = [found // 5]
+    while found in parent:
+        found = parent[found]
+        jump_points.append(found // 5)
+    jump_points.reverse()
+
+    path = [start]
+    for a, b in zip(jump_points, jump_points[1:]):
+        step = (1 if b > a else -1) * (1 if a // stride == b // stride else stride)
+        path += range(a + step, b + step, step)
+    return path
+
+
+class SearchSpace:
+    """
+    Walkability of a grid as a flat boolean mask, used by the array-indexed search engines. The raster is padded with
+    one unwalkable cell on every side, so that the 4 neighbours of a cell are always at index +-1 and +-stride and no
+    bound checks are needed. Flat index of position (x, y) is (y + 1) * stride + (x + 1).
+    """
+
+    def __init__(self, walkable):
+        """
+        :param walkable: numpy bool array (height, width), indexed as walkable[y, x]
+        """
+        self.height, self.width = walkable.shape
+        self.stride = self.width + 2
+        self.size = (self.height + 2) * self.stride
+
+        padded = np.zeros((self.height + 2, self.stride), dtype=bool)
+        padded[1:-1, 1:-1] = walkable
+        self.mask = padded.ravel()
+        self.walkable = self.mask.tobytes()  # bytes are faster to index from Python than numpy arrays
+        self.offsets = tuple(dx + dy * self.stride for dx, dy in NEIGHBOR_OFFSETS)
+        self.jump_tables = None  # see get_jump_tables
+
+    def get_jump_tables(self):
+        """
+        Returns the jump tables of jump_point_search_indices (computed on first use), as arrays of flat indices:
+            jump_right: the first cell to the right of a cell with a forced turn when moving right (an obstacle above or
+                        below the previous cell and none above or below the cell itself), -1 if a wall comes first
+            wall_right: the first unwalkable cell to the right of a cell
+            jump_left, wall_left: the same to the left
+        :return: tuple of 4 array.array('q'): jump_right, wall_right, jump_left, wall_left
+        """
+        if self.jump_tables is None:
+            height, stride = self.height + 2, self.stride
+            walkable = self.mask.reshape(height, stride)
+            columns = np.broadcast_to(np.arange(stride), (height, stride))
+            rows = np.arange(height)[:, None] * stride
+
+            def turn_possible(side):  # walkable cells whose neighbour above (-1) or below (+1) is walkable
+                turn = np.zeros_like(walkable)
+                if side < 0:
+                    turn[1:] = walkable[1:] & walkable[:-1]
+                else:
+                    turn[:-1] = walkable[:-1] & walkable[1:]
+                return turn
+
+            above, below = turn_possible(-1), turn_possible(1)
+            tables = []
+            for dx in (1, -1):
+                # a turn is forced where the neighbour above (below) is walkable, but not the one of the previous cell
+                previous_above = np.zeros_like(walkable)
+                previous_below = np.zeros_like(walkable)
+                if dx > 0:
+                    previous_above[:, 1:] = above[:, :-1]
+                    previous_below[:, 1:] = below[:, :-1]
+                else:
+                    previous_above[:, :-1] = above[:, 1:]
+                    previous_below[:, :-1] = below[:, 1:]
+                forced = walkable & ((above & ~previous_above) | (below & ~previous_below))
+
+                jump = self.get_next_cells(forced, columns, dx)
+                wall = self.get_next_cells(~walkable, columns, dx)
+                blocked = (wall < jump) if dx > 0 else (wall > jump)
+                jump = np.where((jump < 0) | (jump >= stride) | blocked, -1, rows + jump)
+                wall = rows + np.clip(wall, 0, stride - 1)
+                tables += [array('q', jump.ravel().tolist()), array('q', wall.ravel().tolist())]
+            self.jump_tables = tuple(tables)
+        return self.jump_tables
+
+    @staticmethod
+    def get_next_cells(mask, columns, dx):
+        """
+        Returns the column of the next cell in direction dx (excluding the cell itself) for which mask is True, per
+        cell; stride (dx = 1) or -1 (dx = -1) if there is none.
+        :param mask: numpy bool array (height, stride)
+        :param columns: numpy int array (height, stride) with the column of every cell
+        :param dx: 1 or -1
+        :return: numpy int array (height, stride)
+        """
+        height, stride = mask.shape
+        if dx > 0:
+            marked = np.where(mask, columns, stride)
+            following = np.minimum.accumulate(marked[:, ::-1], axis=1)[:, ::-1]
+            return np.concatenate([following[:, 1:], np.full((height, 1), stride)], axis=1)
+        marked = np.where(mask, columns, -1)
+        preceding = np.maximum.accumulate(marked, axis=1)
+        return np.concatenate([np.full((height, 1), -1), preceding[:, :-1]], axis=1)
+
+    def to_index(self, pos):
+        """
+        :param pos: Tuple
+        :return: int: flat index
+        """
+        return (pos[1] + 1) * self.stride + pos[0] + 1
+
+    def to_pos(self, index):
+        """
+        :param index: int: flat index
+        :return: Tuple
+        """
+        y, x = divmod(index, self.stride)
+        return x - 1, y - 1
+
+
+# Search engines on flat cell indices, see a_star_search
+SEARCH_METHODS = {'astar': a_star_search_indices, 'jps': jump_point_search_indices}
+
+# Search spaces per grid and set of unwalkable object types (the static objects never change after model set-up)
+_search_spaces = WeakKeyDictionary()
+
+
+def get_search_space(grid, unwalkable_objects_list=None):
+    """
+    Returns the (cached) SearchSpace of a grid for a list of unwalkable object types.
+    :param grid: MultiGrid or TerrainGrid
+    :param unwalkable_objects_list: list with all object types that are unwalkable
+    :return: SearchSpace
+    """
+    if unwalkable_objects_list is None:
+        unwalkable_objects_list = UNWALKABLE_OBJECTS
+
+    spaces = _search_spaces.setdefault(grid, {})
+    key = tuple(unwalkable_objects_list)
+    if key not in spaces:
+        spaces[key] = SearchSpace(get_walkable_mask(grid, unwalkable_objects_list))
+    return spaces[key]
+
+
+def get_walkable_mask(grid, unwalkable_objects_list):
+    """
+    Returns a boolean raster (height, width) that is True for every cell without an unwalkable object.
+    :param grid: MultiGrid or TerrainGrid
+    :param unwalkable_objects_list: list with all object types that are unwalkable
+    :return: numpy bool array, indexed as walkable[y, x]
+    """
+    if isinstance(grid, TerrainGrid):
+        return grid.get_walkable_mask(unwalkable_objects_list)
+
+    walkable = np.ones((grid.height, grid.width), dtype=bool)
+    for x in range(grid.width):
+        for y in range(grid.height):
+            if any(isinstance(n, tuple(unwalkable_objects_list)) for n in grid.get_cell_list_contents([(x, y)])):
+                walkable[y, x] = False
+    return walkable
+
 
-        for next_pos in get_valid_neighbors(grid, current, unwalkable_objects_list):
-            new_cost = cost_so_far[current] + 1
-            if next_pos not in cost_so_far or new_cost < cost_so_far[next_pos]:
-                cost_so_far[next_pos] = new_cost
-                priority = new_cost + get_heuristic_val(next_pos, destination)
-                frontier.put(next_pos, priority)
-                path[next_pos] = current
-
-    # Convert path from a linked list to proper list
-    pos = destination
-    path_list = []
-    # print(f'linked path list:\n{path}')
+def batch_a_star_search(grid, queries, callback, n_workers=None, unwalkable_objects_list=None, report_every=10):
+    """
+    Computes the shortest paths for many (origin, destination) queries. Queries with the same origin form one job, and
+    jobs are fanned out over a ProcessPoolExecutor whose workers all read the walkability mask from one block of shared
+    memory. Every path is handed to callback as soon as its job is finished, so results can be stored (and
+    checkpointed) while the rest is still running.
+
+    :param grid: MultiGrid or TerrainGrid
+    :param queries: list of tuples (origin, destination)
+    :param callback: function(origin, destination, path), called in the calling process for every finished query
+    :param n_workers: int: number of processes, defaults to the number of CPUs. With 1 everything runs in-process.
+    :param unwalkable_objects_list: list with all object types that are unwalkable
+    :param report_every: int: print the throughput after every report_every finished jobs (0 for no reports)
+    :return: None
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    jobs = {}
+    for origin, destination in queries:
+        jobs.setdefault(origin, []).append(destination)
+    jobs = list(jobs.items())
+
+    start_t = time.time()
+    n_done = 0
+
+    def report(n_jobs_done):
+        if report_every and (n_jobs_done % report_every == 0 or n_jobs_done == len(jobs)):
+            duration = max(time.time() - start_t, 1e-9)
+            print(f'\t>> {n_jobs_done}/{len(jobs)} origins, {n_done} paths, {n_done / duration:.1f} paths/s')
+
+    if n_workers == 1 or len(jobs) <= 1:
+        for n_jobs_done, (origin, destinations) in enumerate(jobs, start=1):
+            for destination in destinations:
+                callback(origin, destination, a_star_search(grid, origin, destination, unwalkable_objects_list))
+                n_done += 1
+            report(n_jobs_done)
+        return
+
+    space = get_search_space(grid, unwalkable_objects_list)
+    shared_mask = SharedMemory(create=True, size=space.mask.nbytes)
     try:
-        while pos is not origin:
-            path_list.append(pos)
-            pos = path[pos]
-    except:
-        pass
+        np.ndarray(space.mask.shape, dtype=bool, buffer=shared_mask.buf)[:] = space.mask
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_batch_worker,
+                                 initargs=(shared_mask.name, space.height, space.width)) as executor:
+            futures = [executor.submit(_run_batch_job, origin, destinations) for origin, destinations in jobs]
+            for n_jobs_done, future in enumerate(as_completed(futures), start=1):
+                for origin, destination, path in future.result():
+                    callback(origin, destination, path)
+                    n_done += 1
+                report(n_jobs_done)
+    finally:
+        shared_mask.close()
+        shared_mask.unlink()
+
+
+# Search space of a batch worker process, built from the shared walkability mask by _init_batch_worker
+_worker_space = None
+
+
+def _init_batch_worker(shared_mask_name, height, width):
+    """
+    Initializer of the batch_a_star_search worker processes: builds the search space from the shared mask.
+    """
+    global _worker_space
+    shared_mask = SharedMemory(name=shared_mask_name)
+    padded = np.ndarray((height + 2, width + 2), dtype=bool, buffer=shared_mask.buf)
+    _worker_space = SearchSpace(padded[1:-1, 1:-1])
+    del padded  # release the view on the shared buffer before closing it
+    shared_mask.close()
+
+
+def _run_batch_job(origin, destinations):
+    """
+    Computes the paths from one origin to all given destinations in a batch worker process.
+    :return: list of tuples (origin, destination, path)
+    """
+    return [(origin, destination, find_path(_worker_space, origin, destination)) for destination in destinations]
+
+
+def compute_distance_field(walkable, sources):
+    """
+    Multi-source breadth-first search over the walkable cells of a raster. Returns the number of steps from every cell
+    to its closest source and which source that is. The search expands a whole BFS level at once with numpy operations
+    on flat indices of a raster that is padded with one unwalkable cell on every side (so no bound checks are needed).
+
+    :param walkable: numpy bool array (height, width), indexed as walkable[y, x]
+    :param sources: list of positions (tuples)
+    :return: distance: numpy int32 array (height, width) with UNREACHABLE for unreachable cells
+             label: numpy int32 array (height, width) with the index (in sources) of the closest source, -1 if none
+    """
+    height, width = walkable.shape
+    stride = width + 2
+
+    padded = np.zeros((height + 2, stride), dtype=bool)
+    padded[1:-1, 1:-1] = walkable
+    open_cells = padded.ravel()
+    distance = np.full(open_cells.size, UNREACHABLE, dtype=np.int32)
+    label = np.full(open_cells.size, -1, dtype=np.int32)
+    offsets = np.array([dx + dy * stride for dx, dy in NEIGHBOR_OFFSETS])
+
+    frontier = np.array([(y + 1) * stride + (x + 1) for x, y in sources], dtype=np.int64)
+    frontier, first = np.unique(frontier, return_index=True)
+    distance[frontier] = 0
+    label[frontier] = first
+    open_cells[frontier] = False
+
+    steps = 0
+    while frontier.size > 0:
+        steps += 1
+        candidates = (frontier[:, None] + offsets).ravel()
+        candidate_labels = np.repeat(label[frontier], len(offsets))
+
+        reachable = open_cells[candidates]
+        candidates, first = np.unique(candidates[reachable], return_index=True)
+
+        open_cells[candidates] = False
+        distance[candidates] = steps
+        label[candidates] = candidate_labels[reachable][first]
+        frontier = candidates
+
+    distance = distance.reshape(padded.shape)[1:-1, 1:-1].copy()
+    label = label.reshape(padded.shape)[1:-1, 1:-1].copy()
+    return distance, label
+
+
+def descend_distance_field(distance_field, pos, n_steps):
+    """
+    Moves up to n_steps cells downhill on a distance field, i.e. along a shortest path towards the closest source.
+    Stops early at the source. Positions that cannot reach any source are returned unchanged.
 
-    path_list.append(origin)
-    path_list.reverse()
-    # print(f'proper path:\n{path_list}')
-    return path_list
+    :param distance_field: numpy int array (height, width), see compute_distance_field
+    :param pos: Tuple: current position
+    :param n_steps: int: number of cells to move
+    :return: new position (tuple)
+    """
+    height, width = distance_field.shape
+    x, y = pos
+    distance = int(distance_field[y, x])
+
+    if distance == UNREACHABLE:
+        return pos
+
+    for _ in range(n_steps):
+        if distance == 0:
+            break
+        for dx, dy in NEIGHBOR_OFFSETS:
+            next_x, next_y = x + dx, y + dy
+            if 0 <= next_x < width and 0 <= next_y < height and distance_field[next_y, next_x] == distance - 1:
+                x, y = next_x, next_y
+                distance -= 1
+                break
+
+    return x, y
 
 
 def get_valid_neighbors(grid, pos, unwalkable_objects_list):
@@ -94,22 +600,33 @@ def get_valid_neighbors(grid, pos, unwalkable_objects_list):
 
     for neighbor_pos in neighbor_positions:
 
-        n_list = grid.get_cell_list_contents([neighbor_pos])
+        item_type = get_item_type(grid, neighbor_pos)
 
-        if not n_list:  # if there no other agents in that list
+        # if the cell holds no object of a type as specified in unwalkable_objects_list, it is a valid neighbor
+        if item_type is None or not issubclass(item_type, tuple(unwalkable_objects_list)):
             valid_neighbors.add(neighbor_pos)
-        else:
-            n = n_list[0]  # if there are agents on this list
-            # if not isinstance(n, Wall) and not isinstance(n, Obstacle):
-
-            # if n is not of object type as specificed in unwalkable_objects_list, n is a valid neighbor
-            if not any(map(lambda t: isinstance(n, t), unwalkable_objects_list)):
-                valid_neighbors.add(neighbor_pos)
 
     valid_neighbors = list(valid_neighbors)
     return valid_neighbors
 
 
+def get_item_type(grid, pos):
+    """
+    Returns the class of the object that occupies a cell. On a TerrainGrid this is read from the static terrain raster,
+    on a plain MultiGrid (e.g. ToyModel) it is the class of the first agent in that cell.
+    :param grid: MultiGrid or TerrainGrid
+    :param pos: Tuple
+    :return: class or None (if the cell is empty floor)
+    """
+    if isinstance(grid, TerrainGrid):
+        return grid.get_item_type(pos)
+
+    n_list = grid.get_cell_list_contents([pos])
+    if not n_list:
+        return None
+    return type(n_list[0])
+
+
 def get_heuristic_val(origin, destination):
     """
     Returns the heuristic value for the a_star algorithm. In this case, it's just the Manhattan distance.
@@ -136,14 +653,10 @@ def init_origins(grid):
     for w in range(grid.width):
         for h in range(grid.height):
             pos = (w, h)
-            n_list = grid.get_cell_list_contents([pos])
+            item_type = get_item_type(grid, pos)
 
-            if not n_list:
+            if item_type is None or not issubclass(item_type, (Wall, Obstacle)):
                 origin_list.append(pos)
-            else:
-                n = n_list[0]  # if there are agents on this list
-                if not isinstance(n, Wall) and not isinstance(n, Obstacle):
-                    origin_list.append(pos)
 
     return origin_list
 
@@ -160,14 +673,9 @@ def init_destinations(grid):
     for w in range(grid.width):
         for h in range(grid.height):
             pos = (w, h)
-            n_list = grid.get_cell_list_contents([pos])
-
-            if n_list:
-                n = n_list[0]
-                if isinstance(n, Exit) or \
-                        isinstance(n, HelpDesk) or \
-                        isinstance(n, Desk) or \
-                        isinstance(n, Shelf):
-                    destinations_list.append(pos)
+            item_type = get_item_type(grid, pos)
+
+            if item_type is not None and issubclass(item_type, (Exit, HelpDesk, Desk, Shelf)):
+                destinations_list.append(pos)
 
     return destinations_list
@@ -0,0 +1,198 @@
+"""
+Opt-in instrumentation of model steps: EvacuationModel(profile=True) gets a Profiler as model.profiler, which measures
+the time and number of calls of the phases of a tick (alarm, speed update, environment scan, task do, pathfinding,
+grid moves, ...) and counts events such as path cache hits and misses, A* expansions and the buckets and agents that
+neighbour queries visit. Without profile, model.profiler is NULL_PROFILER, whose methods do nothing.
+The report of a replication is a dict (or json file); write_folded writes the phases in the folded stack format of
+flamegraph.pl and speedscope. To profile one replication from the command line:
+    python -m Scripts.Profiler --n-visitors 100 --engine object --out OutputData/profile
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+class Phase:
+    """
+    Context manager that measures one call of a phase of a Profiler.
+    """
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.profiler.stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        key = tuple(profiler.stack)
+        record = profiler.phases.get(key)
+        if record is None:
+            record = profiler.phases[key] = [0, 0.0, 0.0]  # calls, total time, time in nested phases
+        record[0] += 1
+        record[1] += elapsed
+        profiler.stack.pop()
+        if profiler.stack:
+            parent = profiler.phases.get(tuple(profiler.stack))
+            if parent is None:
+                parent = profiler.phases[tuple(profiler.stack)] = [0, 0.0, 0.0]
+            parent[2] += elapsed
+        return False
+
+
+class Profiler:
+    """
+    Collects the time per phase (per stack of nested phases) and event counters of a model.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.phases = {}  # tuple of nested phase names -> [calls, total time (s), time in nested phases (s)]
+        self.counters = {}  # event name -> count
+        self.stack = []
+
+    def phase(self, name):
+        """
+        Returns a context manager that measures a phase, nested in the phases that are currently measured:
+            with model.profiler.phase('task_do'):
+                ...
+        :param name: str
+        :return: Phase
+        """
+        return Phase(self, name)
+
+    def count(self, name, n=1):
+        """
+        Adds n to an event counter.
+        :param name: str
+        :param n: int
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def get_report(self):
+        """
+        Returns the phases (summed over all stacks they appear in) and the counters.
+        :return: dict with phases (name -> calls, total_s, self_s, mean_us) and counters (name -> count)
+        """
+        phases = {}
+        for stack, (calls, total, nested) in self.phases.items():
+            name = stack[-1]
+            phase = phases.setdefault(name, {'calls': 0, 'total_s': 0.0, 'self_s': 0.0})
+            phase['calls'] += calls
+            phase['self_s'] += total - nested
+            if name not in stack[:-1]:  # recursive phases are counted once
+                phase['total_s'] += total
+        for phase in phases.values():
+            phase['mean_us'] = phase['total_s'] / phase['calls'] * 1e6 if phase['calls'] else 0.0
+        return {'phases': phases, 'counters': dict(self.counters)}
+
+    def show_report(self):
+        """
+        Prints the phases, sorted by their total time, and the counters.
+        """
+        report = self.get_report()
+        print(f"{'phase':<20}{'calls':>10}{'total (s)':>12}{'self (s)':>12}{'mean (us)':>12}")
+        for name, phase in sorted(report['phases'].items(), key=lambda item: -item[1]['total_s']):
+            print(f"{name:<20}{phase['calls']:>10}{phase['total_s']:>12.3f}{phase['self_s']:>12.3f}"
+                  f"{phase['mean_us']:>12.1f}")
+        for name, count in sorted(report['counters'].items()):
+            print(f"{name:<30}{count:>12}")
+
+    def save_report(self, path, meta=None):
+        """
+        Writes the report as json.
+        :param path: file name
+        :param meta: dict (json serializable) with e.g. the parameters of the replication, optional
+        """
+        with open(path, 'w') as handle:
+            json.dump({**self.get_report(), 'meta': meta or {}}, handle, indent=2)
+
+    def write_folded(self, path):
+        """
+        Writes the self time of every stack of phases in microseconds as folded stacks (one 'step;schedule;task_do
+        1234' line per stack), the input format of flamegraph.pl and speedscope.
+        :param path: file name
+        """
+        with open(path, 'w') as handle:
+            for stack, (calls, total, nested) in sorted(self.phases.items()):
+                handle.write(f"{';'.join(stack)} {max(int(round((total - nested) * 1e6)), 0)}\n")
+
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullProfiler:
+    """
+    Profiler that measures nothing, used when profiling is off.
+    """
+
+    enabled = False
+    null_phase = NullPhase()
+
+    def phase(self, name):
+        return self.null_phase
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def main():
+    from Scripts.EvacuationModel import EvacuationModel
+    from Scripts.Enums import ExitType
+
+    parser = argparse.ArgumentParser(description='Profiles one replication of the EvacuationModel.')
+    parser.add_argument('--n-visitors', type=int, default=50)
+    parser.add_argument('--n-officestaff', type=int, default=10)
+    parser.add_argument('--engine', choices=['object', 'vectorized'], default='object')
+    parser.add_argument('--exit-type', default='ABC', help='name of the ExitType, e.g. AB')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-run-length', type=int, default=1000)
+    parser.add_argument('--congestion-replanning', action='store_true', help='reroute around crowds (object engine)')
+    parser.add_argument('--out', default=None, help='folder for report.json and profile.folded')
+    args = parser.parse_args()
+
+    model = EvacuationModel(n_visitors=args.n_visitors, n_officestaff=args.n_officestaff, engine=args.engine,
+                            valid_exits=ExitType[args.exit_type], seed=args.seed,
+                            max_run_length=args.max_run_length, congestion_replanning=args.congestion_replanning,
+                            profile=True)
+    start_t = time.time()
+    for _ in range(args.max_run_length):
+        model.step()
+        if model.is_done():
+            break
+    run_time = round(time.time() - start_t, 2)
+
+    print(f"Evacuation time: {model.get_total_evacuation_time()}, run time: {run_time} s\n")
+    model.profiler.show_report()
+    print(f"\nPath cache: {model.all_paths.get_stats()}")
+    if model.router is not None:
+        print(f"Congestion router: {model.router.get_stats()}")
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+        model.profiler.save_report(os.path.join(args.out, 'report.json'), meta={**vars(args), 'run_time': run_time})
+        model.profiler.write_folded(os.path.join(args.out, 'profile.folded'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Streams the results of replications to chunked columnar files while an experiment runs, instead of keeping them in
+memory until save_data_to_pickle. Every table is a folder of chunk files:
+    replications/: one row per replication (exit type, replication, seed, parameters, evacuation time, wall time)
+    ticks/: one row per tick of a replication (number of safe agents)
+    exits/: one row per exit of a replication (number of persons that left through it)
+Parquet needs pyarrow; with file_format='csv' the same tables are written as csv files.
+"""
+import glob
+import os
+import time
+import uuid
+
+import pandas as pd
+
+TABLES = ('replications', 'ticks', 'exits')
+
+
+def get_result(model, exit_type, replication, seed, run_time):
+    """
+    Returns the result of a finished replication (as returned by ParallelRunner.run_job).
+    :param model: EvacuationModel after its run
+    :param exit_type: ExitType
+    :param replication: int
+    :param seed: int or None
+    :param run_time: float: wall time of the run in seconds
+    :return: dict with exit_type, replication, seed, evacuation_time, run_time, safe_agents (per tick) and exit_usage
+             (exit position -> number of persons)
+    """
+    return {'exit_type': exit_type, 'replication': replication, 'seed': seed,
+            'evacuation_time': model.get_total_evacuation_time(), 'run_time': run_time,
+            'safe_agents': model.get_safe_agents_per_tick(), 'exit_usage': dict(model.exit_usage)}
+
+
+class ResultsSink:
+    """
+    Appends results of replications to the tables of a folder. Rows are buffered and written as a new chunk file per
+    table after every replications_per_chunk replications (and on close), so a crash loses at most the unwritten
+    replications and memory does not grow with the number of replications. Chunk files are written under a temporary
+    name and renamed, such that readers never see half-written chunks.
+    """
+
+    def __init__(self, path='./OutputData/results/', file_format='parquet', replications_per_chunk=1):
+        """
+        :param path: folder of the tables (may already contain chunks of earlier runs)
+        :param file_format: 'parquet' or 'csv'
+        :param replications_per_chunk: int: number of replications per chunk file
+        """
+        if file_format not in ('parquet', 'csv'):
+            raise ValueError(f"Unknown file format {file_format}, use 'parquet' or 'csv'")
+        if file_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401 (used by pandas.DataFrame.to_parquet)
+            except ImportError:
+                raise ImportError("Writing parquet files requires pyarrow (pip install pyarrow), "
+                                  "or use file_format='csv'")
+
+        self.path = path
+        self.file_format = file_format
+        self.replications_per_chunk = replications_per_chunk
+        self.run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"  # tells runs in one folder apart
+        self.n_chunks = 0
+        self.n_buffered = 0
+        self.buffers = {table: [] for table in TABLES}
+        for table in TABLES:
+            os.makedirs(os.path.join(path, table), exist_ok=True)
+
+    def add(self, result, parameters=None):
+        """
+        Adds the result of a replication.
+        :param result: dict, see get_result
+        :param parameters: dict with the parameters of the model (e.g. n_visitors), stored with the replication
+        """
+        key = {'run_id': self.run_id, 'exit_type': result['exit_type'].name, 'replication': result['replication']}
+
+        self.buffers['replications'].append({**key, 'seed': result['seed'], **(parameters or {}),
+                                             'evacuation_time': result['evacuation_time'],
+                                             'run_time': result['run_time'],
+                                             'n_safe_agents': result['safe_agents'][-1] if result['safe_agents'] else 0})
+        self.buffers['ticks'] += [{**key, 'tick': tick, 'safe_agents': n_safe}
+                                  for tick, n_safe in enumerate(result['safe_agents'], start=1)]
+        self.buffers['exits'] += [{**key, 'exit_x': pos[0], 'exit_y': pos[1], 'n_persons': n_persons}
+                                  for pos, n_persons in sorted(result['exit_usage'].items())]
+
+        self.n_buffered += 1
+        if self.n_buffered >= self.replications_per_chunk:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows as a new chunk file per table.
+        """
+        if not self.n_buffered:
+            return
+        self.n_chunks += 1
+        for table, rows in self.buffers.items():
+            if not rows:
+                continue
+            name = f'{self.run_id}-{self.n_chunks:05d}.{self.file_format}'
+            path = os.path.join(self.path, table, name)
+            tmp_path = os.path.join(self.path, table, f'.{name}.tmp')
+            frame = pd.DataFrame(rows)
+            if self.file_format == 'parquet':
+                frame.to_parquet(tmp_path, index=False)
+            else:
+                frame.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        self.buffers = {table: [] for table in TABLES}
+        self.n_buffered = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_results(path='./OutputData/results/', table='replications', columns=None, filters=None):
+    """
+    Reads a table of a results folder into a DataFrame, only loading the requested columns (and, for parquet, only
+    the rows that pass filters). For data that does not fit into memory, pyarrow.dataset.dataset(<path>/<table>) scans
+    the parquet chunks lazily.
+    :param path: folder of the tables
+    :param table: 'replications', 'ticks' or 'exits'
+    :param columns: list of column names, optional
+    :param filters: list of (column, operator, value) tuples, e.g. [('exit_type', '==', 'A')] (parquet only)
+    :return: pandas DataFrame
+    """
+    table_path = os.path.join(path, table)
+    if glob.glob(os.path.join(table_path, '*.parquet')):
+        # pyarrow reads the folder as one dataset (and skips the hidden temporary files)
+        return pd.read_parquet(table_path, columns=columns, filters=filters)
+    csv_files = sorted(glob.glob(os.path.join(table_path, '*.csv')))
+    if csv_files:
+        if filters:
+            raise ValueError('filters are only supported for parquet tables')
+        return pd.concat([pd.read_csv(file, usecols=columns) for file in csv_files], ignore_index=True)
+    return pd.DataFrame(columns=columns)
@@ -0,0 +1,220 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+
+class SpatialIndex:
+    """
+    Bucketed hash grid of the dynamic agents (visitors, staff) on a grid. The grid is divided into square buckets of
+    bucket_size x bucket_size cells, and every bucket keeps the agents that stand in it. A radius query only visits the
+    buckets that overlap the query square and the agents in them, so its cost depends on the number of people nearby
+    instead of on the number of cells in the radius.
+    Agents are kept in insertion order (dicts instead of sets), such that queries are reproducible between runs.
+    """
+
+    def __init__(self, bucket_size=16):
+        """
+        :param bucket_size: int: side length of a bucket in cells
+        """
+        self.bucket_size = bucket_size
+        self.buckets = {}  # (bucket x, bucket y) -> dict with the agents in this bucket as keys
+        self.stats = None  # dict of counters (e.g. Profiler.counters) that queries add their work to, optional
+
+    def get_bucket(self, pos):
+        """
+        Returns the key of the bucket a position belongs to.
+        :param pos: Tuple
+        :return: Tuple
+        """
+        return pos[0] // self.bucket_size, pos[1] // self.bucket_size
+
+    def add(self, agent, pos):
+        """
+        Adds an agent at a position.
+        :param agent: Agent
+        :param pos: Tuple
+        """
+        self.buckets.setdefault(self.get_bucket(pos), {})[agent] = None
+
+    def remove(self, agent, pos):
+        """
+        Removes an agent from the position it was added at.
+        :param agent: Agent
+        :param pos: Tuple
+        """
+        bucket = self.get_bucket(pos)
+        agents = self.buckets[bucket]
+        del agents[agent]
+        if not agents:
+            del self.buckets[bucket]
+
+    def get_agents_in_radius(self, pos, radius, agent_type=None, include_center=False):
+        """
+        Returns the agents in the Moore neighborhood of a position, i.e. within a Chebyshev distance of radius (same
+        cells as MultiGrid.get_neighbors with moore=True on a grid without torus).
+        :param pos: Tuple
+        :param radius: int
+        :param agent_type: class: only return agents of this type (incl. subclasses), optional
+        :param include_center: Boolean: whether agents on pos itself are returned
+        :return: list of agents
+        """
+        x, y = pos
+        min_bx, min_by = self.get_bucket((max(x - radius, 0), max(y - radius, 0)))
+        max_bx, max_by = self.get_bucket((x + radius, y + radius))
+
+        neighbors = []
+        n_checked = 0
+        for bx in range(min_bx, max_bx + 1):
+            for by in range(min_by, max_by + 1):
+                agents = self.buckets.get((bx, by))
+                if not agents:
+                    continue
+                n_checked += len(agents)
+                for agent in agents:
+                    ax, ay = agent.pos
+                    if abs(ax - x) > radius or abs(ay - y) > radius:
+                        continue
+                    if not include_center and ax == x and ay == y:
+                        continue
+                    if agent_type is not None and not isinstance(agent, agent_type):
+                        continue
+                    neighbors.append(agent)
+
+        if self.stats is not None:
+            stats = self.stats
+            stats['neighbor_queries'] = stats.get('neighbor_queries', 0) + 1
+            stats['neighbor_buckets_visited'] = stats.get('neighbor_buckets_visited', 0) + \
+                (max_bx - min_bx + 1) * (max_by - min_by + 1)
+            stats['neighbor_agents_checked'] = stats.get('neighbor_agents_checked', 0) + n_checked
+        return neighbors
+
+    def count_agents_in_radius(self, pos, radius, agent_type=None, include_center=False):
+        """
+        Returns the number of agents that get_agents_in_radius would return.
+        :param pos: Tuple
+        :param radius: int
+        :param agent_type: class, optional
+        :param include_center: Boolean
+        :return: int
+        """
+        return len(self.get_agents_in_radius(pos, radius, agent_type=agent_type, include_center=include_center))
+
+
+class PositionTable:
+    """
+    Positions of the dynamic agents of a grid in one numpy array (one row per agent, kept while the agent moves), such
+    that the positions of all agents are read at once instead of by a loop over the agents.
+    """
+
+    def __init__(self, capacity=256):
+        """
+        :param capacity: int: initial number of rows
+        """
+        self.rows = {}  # agent -> row
+        self.positions = np.zeros((capacity, 2), dtype=np.int64)
+        self.placed = np.zeros(capacity, dtype=bool)  # whether the agent of a row is on the grid
+
+    def add(self, agent, pos):
+        """
+        Sets the position of an agent (a new agent gets the next free row).
+        :param agent: Agent
+        :param pos: Tuple
+        """
+        row = self.rows.get(agent)
+        if row is None:
+            row = self.rows[agent] = len(self.rows)
+            if row == len(self.placed):
+                self.positions = np.concatenate([self.positions, np.zeros_like(self.positions)])
+                self.placed = np.concatenate([self.placed, np.zeros_like(self.placed)])
+        self.positions[row] = pos
+        self.placed[row] = True
+
+    def remove(self, agent, pos):
+        """
+        Marks an agent as not placed (until it is added again, e.g. by a move).
+        :param agent: Agent
+        :param pos: Tuple
+        """
+        self.placed[self.rows[agent]] = False
+
+    def get_rows(self):
+        """
+        Returns the positions and placed flags of all rows in use (views, valid until the next add).
+        :return: numpy int64 array (n, 2), numpy bool array (n,)
+        """
+        n = len(self.rows)
+        return self.positions[:n], self.placed[:n]
+
+
+class CrowdTable:
+    """
+    Summed-area table of the number of persons per cell that only has the columns and rows that hold persons (all
+    other columns and rows add nothing to any sum). Its size depends on the number of persons instead of the size of
+    the map, and a sum over a square still takes four lookups (after a binary search of its bounds).
+    """
+
+    def __init__(self, positions):
+        """
+        :param positions: numpy int array (n, 2) of the persons
+        """
+        xs, column = np.unique(positions[:, 0], return_inverse=True)
+        ys, row = np.unique(positions[:, 1], return_inverse=True)
+        counts = np.zeros((len(ys), len(xs)), dtype=np.int32)
+        np.add.at(counts, (row.ravel(), column.ravel()), 1)
+        self.table = compute_summed_area_table(counts)
+        self.xs, self.ys = xs, ys
+        self.x_list, self.y_list = xs.tolist(), ys.tolist()  # bisect is faster on lists than on arrays
+
+    def sum_in_radius(self, pos, radius):
+        """
+        Returns the number of persons in the Moore neighborhood (incl. the center) of a position.
+        :param pos: Tuple
+        :param radius: int
+        :return: int
+        """
+        x, y = pos
+        x0, x1 = bisect_left(self.x_list, x - radius), bisect_right(self.x_list, x + radius)
+        y0, y1 = bisect_left(self.y_list, y - radius), bisect_right(self.y_list, y + radius)
+        table = self.table
+        return int(table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0])
+
+    def sum_in_radius_many(self, positions, radius):
+        """
+        Returns sum_in_radius for many positions at once.
+        :param positions: numpy int array (n, 2)
+        :param radius: int
+        :return: numpy int64 array (n,)
+        """
+        x0 = np.searchsorted(self.xs, positions[:, 0] - radius, side='left')
+        x1 = np.searchsorted(self.xs, positions[:, 0] + radius, side='right')
+        y0 = np.searchsorted(self.ys, positions[:, 1] - radius, side='left')
+        y1 = np.searchsorted(self.ys, positions[:, 1] + radius, side='right')
+        table = self.table
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+
+def compute_summed_area_table(counts):
+    """
+    Returns the summed-area table (integral image) of a raster, padded with a leading row and column of zeros:
+    table[y, x] is the sum of counts[:y, :x]. A stack of rasters (leading axes) gives a stack of tables.
+    :param counts: numpy array (..., height, width)
+    :return: numpy int64 array (..., height + 1, width + 1)
+    """
+    table = np.zeros(counts.shape[:-2] + (counts.shape[-2] + 1, counts.shape[-1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(counts, axis=-2), axis=-1, out=table[..., 1:, 1:])
+    return table
+
+
+def sum_in_radius(table, pos, radius):
+    """
+    Returns the sum of the raster of a summed-area table over the Moore neighborhood (incl. the center) of a position,
+    clipped to the raster, with four lookups.
+    :param table: summed-area table of compute_summed_area_table
+    :param pos: Tuple
+    :param radius: int
+    :return: int
+    """
+    x, y = pos
+    x0, y0 = max(x - radius, 0), max(y - radius, 0)
+    x1, y1 = min(x + radius + 1, table.shape[1] - 1), min(y + radius + 1, table.shape[0] - 1)
+    return int(table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0])
@@ -1,5 +1,4 @@
-from Scripts.PathFinding import a_star_search
-import random
+from Scripts.PathFinding import descend_distance_field
 from Scripts.Enums import *
 
 
@@ -50,7 +49,7 @@ class CompositeTask:
         remaining_subtasks = []
 
         weights = self.get_weights(all_possible_staff_tasks)
-        random_task = random.choices(all_possible_staff_tasks, weights)[0]
+        random_task = self.model.random.choices(all_possible_staff_tasks, weights)[0]
 
         if random_task == StaffTasks.PROVIDE_HELP:
             remaining_subtasks = [Stay(self.person)]  # Helping could be more complex (interaction with visitor?)
@@ -70,7 +69,7 @@ class CompositeTask:
         remaining_subtasks = []
 
         weights = self.get_weights(all_possible_visitor_tasks)
-        random_task = random.choices(all_possible_visitor_tasks, weights)[0]
+        random_task = self.model.random.choices(all_possible_visitor_tasks, weights)[0]
 
         if random_task == VisitorTasks.STUDY:
             remaining_subtasks = [Walk(self.person, self.destinations, Destination.DESK), Stay(self.person)]
@@ -125,7 +124,9 @@ class CompositeTask:
         # In emergency situation
         else:
 
-            if not self.person.emergency_knowledge.left:
+            # The evacuation task replaces the remaining subtasks once, and is kept (with its walk) until the person left
+            current_subtask = self.remaining_subtasks[0] if self.remaining_subtasks else None
+            if not self.person.emergency_knowledge.left and not isinstance(current_subtask, EvacuationTask):
                 # Old version of evacuating
                 # exit_destination = self.person.emergency_knowledge.entered_via
                 # self.remaining_subtasks = [Walk(self.person, self.destinations, destination=exit_destination)]
@@ -139,6 +140,7 @@ class CompositeTask:
             # If already in exit posiiton, remove from model
             if self.person.pos == self.person.emergency_knowledge.closest_exit:
 
+                self.model.exit_usage[self.person.pos] = self.model.exit_usage.get(self.person.pos, 0) + 1
                 self.model.grid.remove_agent(self.person)
                 self.model.schedule.remove(self.person)
                 self.person.emergency_knowledge.left = True
@@ -158,8 +160,8 @@ class CompositeTask:
         current_subtask.do()
         current_subtask.update()
 
-        # remove finished subtask from remaining substasks
-        if current_subtask.is_done():
+        # remove finished subtask from remaining substasks (a finished evacuation task stays: the person leaves next tick)
+        if current_subtask.is_done() and not isinstance(current_subtask, EvacuationTask):
             self.remaining_subtasks = self.remaining_subtasks[1:]
 
 
@@ -206,37 +208,124 @@ class Walk(BasicTask):
         with its speed being adjusted to whether it is an emergency (i.e., adjusted the Movement mode)
         and the amount of people nearby.
         """
-        # self.person.move_data.path_to_current_dest = a_star_search(self.person.model.grid, self.person.pos, self.destination)
-        if self.person.move_data.path_to_current_dest is None or len(self.person.move_data.path_to_current_dest) <= 1:
+        profiler = self.person.model.profiler
+        self.person.move_data.destination = self.destination
+
+        # Walking to an exit with congestion replanning: descend the exit's route, which avoids crowded cells. Where
+        # the route is being repaired (or has no downhill neighbour), walk the exit distance field instead
+        route = self.get_congestion_route()
+        if route is not None:
+            stride_length = int(self.person.get_current_speed() * 10)
+            with profiler.phase('congestion_descent'):
+                new_pos = route.descend(self.person.pos, stride_length)
+            if new_pos != self.person.pos:
+                self.person.move_data.clear_path()
+                with profiler.phase('grid_move'):
+                    self.person.model.grid.move_agent(agent=self.person, pos=new_pos)
+                return
+
+        # Walking to an exit: descend the model's precomputed exit distance field (no pathfinding needed)
+        exit_distance_field = self.get_exit_distance_field()
+        if exit_distance_field is not None:
+            stride_length = int(self.person.get_current_speed() * 10)
+            with profiler.phase('exit_field_descent'):
+                new_pos = descend_distance_field(exit_distance_field, self.person.pos, stride_length)
+            if exit_distance_field[new_pos[1], new_pos[0]] == 0 and new_pos != self.destination:
+                self.arrive_at_other_exit_cell(new_pos)
+            self.person.move_data.clear_path()
+            with profiler.phase('grid_move'):
+                self.person.model.grid.move_agent(agent=self.person, pos=new_pos)
+            return
+
+        # Walking to a desk, shelf or helpdesk: descend the distance field of the destination (no pathfinding needed)
+        destination_field = self.get_destination_field()
+        if destination_field is not None:
+            stride_length = int(self.person.get_current_speed() * 10)
+            with profiler.phase('destination_field_descent'):
+                new_pos = self.person.model.destination_fields.descend(destination_field, self.person.pos,
+                                                                       stride_length)
+            self.person.move_data.clear_path()
+            if new_pos != self.person.pos:
+                with profiler.phase('grid_move'):
+                    self.person.model.grid.move_agent(agent=self.person, pos=new_pos)
+            return
+
+        move_data = self.person.move_data
+        if move_data.get_remaining_path_length() <= 1:
 
             origin = self.person.pos
             destination = self.destination
+            model = self.person.model
+            all_paths = model.all_paths
+
+            with profiler.phase('pathfinding'):
+                # the cached path from origin, or a cached path to the destination that passes origin (suffix hit)
+                cached = all_paths.lookup(origin, destination)
+                if cached is not None:
+                    path, start = cached
+                    profiler.count('path_cache_suffix_hits' if start else 'path_cache_hits')
+                else:
+                    stats = {} if profiler.enabled else None
+                    path, start = tuple(model.path_search(model.grid, origin, destination, stats=stats)), 0
+                    profiler.count('path_cache_misses')
+                    if stats:
+                        profiler.count('astar_expanded', stats['expanded'])
+
+                    # Save path (for speeding up calculations), as a tuple: paths are shared and never modified
+                    path = all_paths.add((origin, destination), path)
+
+            move_data.set_path(path, start)
+
+        # Calculate how many cells you can travel, and move the cursor on the path by as many (at most to its end)
+        stride_length = int(self.person.get_current_speed() * 10)
+        new_pos = move_data.advance_on_path(stride_length)
 
-            if (origin, destination) in self.person.model.all_paths:
-                self.person.move_data.path_to_current_dest = self.person.model.all_paths[(origin, destination)]
-            else:
-                self.person.move_data.path_to_current_dest = a_star_search(self.person.model.grid, self.person.pos, self.destination)
-
-            # Save path (for speeding up calculations)
+        # Adjust agent-placement on grid
+        if new_pos != self.person.pos:
+            with profiler.phase('grid_move'):
+                self.person.model.grid.move_agent(agent=self.person, pos=new_pos)
 
-            self.person.model.all_paths[(origin, destination)] = self.person.move_data.path_to_current_dest
+    def get_congestion_route(self):
+        """
+        Returns the model's congestion-aware route to this walk's destination, if there is one.
+        :return: ExitRoute or None
+        """
+        model = self.person.model
+        if getattr(model, 'router', None) is None:
+            return None
+        return model.get_congestion_route(self.person.pos, self.destination)
 
-        # Calculate how many cells you can travel
-        stride_length = int(self.person.get_current_speed() * 10)
+    def get_exit_distance_field(self):
+        """
+        Returns the model's exit distance field that leads to this walk's destination, if there is one.
+        :return: numpy array or None
+        """
+        model = self.person.model
+        if not hasattr(model, 'get_exit_distance_field'):
+            return None
+        return model.get_exit_distance_field(self.destination)
 
-        try:
-            # Find cell you should move to
-            new_pos = self.person.move_data.path_to_current_dest[stride_length]
-            # Adjust remaining path
-            self.person.move_data.path_to_current_dest = self.person.move_data.path_to_current_dest[stride_length:]
-        except:
-            # Find cell you should move to (if stride is overreaching destination)
-            new_pos = self.person.move_data.path_to_current_dest[-1]
-            # Adjust remaining path
-            self.person.move_data.path_to_current_dest = [self.person.move_data.path_to_current_dest[-1]]
+    def arrive_at_other_exit_cell(self, pos):
+        """
+        Takes another cell of the exit that this walk leads to as its destination (and as the person's closest exit if
+        the walk leads there), when the descent of the exit distance field reached that cell instead of destination.
+        :param pos: Tuple: reached exit cell
+        """
+        knowledge = self.person.emergency_knowledge
+        if knowledge.closest_exit == self.destination:
+            knowledge.closest_exit = pos
+        self.destination = pos
+        self.person.move_data.destination = pos
 
-        # Adjust agent-placement on grid
-        self.person.model.grid.move_agent(agent=self.person, pos=(int(new_pos[0]),int(new_pos[1])))
+    def get_destination_field(self):
+        """
+        Returns the model's destination field that leads to this walk's destination, if there is one.
+        :return: int or None
+        """
+        model = self.person.model
+        if getattr(model, 'destination_fields', None) is None:
+            return None
+        return model.get_destination_field(self.person.pos, self.destination)
 
     def get_random_destination(self):
         """
@@ -248,14 +337,14 @@ class Walk(BasicTask):
         relevant_destinations = self.destinations[self.destination_type]
 
         # Avoid to get the same destination as you are in at the moment
-        if not self.person.move_data.path_to_current_dest:
+        destination = self.person.move_data.destination
+        if destination is None:
             destination = ()
-        else:
-            destination = self.person.move_data.path_to_current_dest[-1]
-        random_destination = random.choice(relevant_destinations)
+        rng = self.person.model.random
+        random_destination = rng.choice(relevant_destinations)
 
         while destination == random_destination:
-            random_destination = random.choice(relevant_destinations)
+            random_destination = rng.choice(relevant_destinations)
 
         return random_destination
 
@@ -281,7 +370,7 @@ class Stay(BasicTask):
         if duration is not None:
             self.remaining_duration = duration
         else:
-            self.remaining_duration = random.uniform(5, 20)
+            self.remaining_duration = self.person.model.random.uniform(5, 20)
 
     def is_done(self):
         self.person.busy = False
@@ -304,10 +393,23 @@ class EvacuationTask:
         self.person = person
         self.type = None
         self.busy = False
+        self.can_reroute = False  # whether the person may switch to a less crowded exit
 
     def do(self):
         pass
 
+    def reroute(self):
+        """
+        Switches the closest exit of persons who know the exits to the one that is cheapest to reach given the current
+        congestion (in models with congestion_replanning), and returns the exit to walk to.
+        :return: position of exit (tuple)
+        """
+        knowledge = self.person.emergency_knowledge
+        router = getattr(self.person.model, 'router', None)
+        if router is not None and self.can_reroute:
+            knowledge.closest_exit = router.get_best_exit(self.person.pos, knowledge.closest_exit)
+        return knowledge.closest_exit
+
     def is_done(self):
         """
         Returns True if the person reached the final destination.
@@ -326,12 +428,15 @@ class VisitorEvacuation(EvacuationTask):
 
         super().__init__(person)
         self.destinations = self.person.model.destinations
+        self.walk = None  # walk to the current closest exit, replaced only when that exit changes
+        self.can_reroute = self.person.emergency_knowledge.knows_exits
 
     def do(self):
 
-        exit_destination = self.person.emergency_knowledge.closest_exit
-        walk = Walk(self.person, self.destinations, destination=exit_destination)
-        walk.do()
+        exit_destination = self.reroute()
+        if self.walk is None or self.walk.destination != exit_destination:
+            self.walk = Walk(self.person, self.destinations, destination=exit_destination)
+        self.walk.do()
 
 
 class StaffEvacuation(EvacuationTask):
@@ -340,6 +445,9 @@ class StaffEvacuation(EvacuationTask):
 
         super().__init__(person)
         self.destinations = self.person.model.destinations
+        self.walk = None  # walk to the current closest exit, replaced only when that exit changes
+        self.stay = Stay(self.person, duration=0)  # waiting has no duration, it lasts while visitors are close by
+        self.can_reroute = True  # all staff know the exits
 
     def do(self):
 
@@ -348,10 +456,10 @@ class StaffEvacuation(EvacuationTask):
 
         # Wait for visitors to leave the area
         if self.person.are_visitors_close_by(radius=5):
-            stay = Stay(self.person)
-            stay.do()
+            self.stay.do()
         else:
             # Go to exit
-            exit_destination = self.person.emergency_knowledge.closest_exit
-            walk = Walk(self.person, self.destinations, destination=exit_destination)
-            walk.do()
+            exit_destination = self.reroute()
+            if self.walk is None or self.walk.destination != exit_destination:
+                self.walk = Walk(self.person, self.destinations, destination=exit_destination)
+            self.walk.do()
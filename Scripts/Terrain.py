@@ -0,0 +1,120 @@
+import numpy as np
+from mesa.space import MultiGrid
+
+import Scripts.InanimateAgents as IA
+from Scripts.Enums import CellType
+from Scripts.SpatialIndex import SpatialIndex, PositionTable
+
+# Inanimate agent class that each (non-floor) cell type of the terrain raster stands for
+CELL_TYPE_TO_ITEM = {CellType.WALL: IA.Wall,
+                     CellType.OBSTACLE: IA.Obstacle,
+                     CellType.OUT_OF_BOUNDS: IA.OutOfBounds,
+                     CellType.DESK: IA.Desk,
+                     CellType.DESK_INTERACTIVE: IA.DeskInteractive,
+                     CellType.HELPDESK: IA.HelpDesk,
+                     CellType.HELPDESK_INTERACTIVE_FOR_HELPER: IA.HelpdeskInteractiveForHelper,
+                     CellType.HELPDESK_INTERACTIVE_FOR_HELPEE: IA.HelpdeskInteractiveForHelpee,
+                     CellType.OFFICE: IA.Office,
+                     CellType.SHELF: IA.Shelf,
+                     CellType.SHELF_INTERACTIVE: IA.ShelfInteractive,
+                     CellType.EXIT: IA.Exit,
+                     CellType.EXITA: IA.ExitA,
+                     CellType.EXITB: IA.ExitB,
+                     CellType.EXITC: IA.ExitC}
+
+# Entity_category names (as used in object_colours.tsv) to cell types
+ENTITY_TO_CELL_TYPE = {item.__name__: cell_type for cell_type, item in CELL_TYPE_TO_ITEM.items()}
+
+
+def get_cell_type(entity_category):
+    """
+    Returns the cell type for an Entity_category of object_colours.tsv. Empty categories (NaN) are walkable floor.
+    :param entity_category: str or NaN
+    :return: CellType
+    """
+    if isinstance(entity_category, str):
+        return ENTITY_TO_CELL_TYPE.get(entity_category, CellType.FLOOR)
+    return CellType.FLOOR
+
+
+def get_cell_types_of_items(item_classes):
+    """
+    Returns all cell types whose inanimate agent class is (a subclass of) one of the given classes.
+    :param item_classes: list of Item classes, e.g. [Wall, Obstacle]
+    :return: list of CellType
+    """
+    item_classes = tuple(item_classes)
+    return [cell_type for cell_type, item in CELL_TYPE_TO_ITEM.items() if issubclass(item, item_classes)]
+
+
+class TerrainGrid(MultiGrid):
+    """
+    MultiGrid that keeps the static library objects (walls, desks, shelves, exits, ...) in a uint8 raster of cell types
+    instead of one Item agent per cell. Only the dynamic agents (visitors, staff, alarm) are placed on the grid itself.
+    The raster is indexed as terrain[y, x], such that the flat index of a position is y * width + x.
+    The dynamic agents are additionally kept in a SpatialIndex that is updated whenever an agent is placed, moved or
+    removed, so neighbour queries (get_agents_in_radius) do not have to visit every cell of the radius. The positions of
+    the agents of tracked_type are also kept in a PositionTable (agent_positions).
+    """
+
+    def __init__(self, terrain, torus=False, tracked_type=None):
+        """
+        :param terrain: numpy uint8 array of shape (height, width) with CellType values
+        :param torus: Boolean
+        :param tracked_type: class whose agents (incl. subclasses) are kept in agent_positions, optional
+        """
+        height, width = terrain.shape
+        super().__init__(width=width, height=height, torus=torus)
+        self.terrain = terrain
+        self.agent_index = SpatialIndex()
+        self.tracked_type = tracked_type
+        self.agent_positions = PositionTable()
+
+    def _place_agent(self, pos, agent):
+        super()._place_agent(pos, agent)
+        self.agent_index.add(agent, pos)
+        if self.tracked_type is not None and isinstance(agent, self.tracked_type):
+            self.agent_positions.add(agent, pos)
+
+    def _remove_agent(self, pos, agent):
+        super()._remove_agent(pos, agent)
+        self.agent_index.remove(agent, pos)
+        if self.tracked_type is not None and isinstance(agent, self.tracked_type):
+            self.agent_positions.remove(agent, pos)
+
+    def get_agents_in_radius(self, pos, radius, agent_type=None, include_center=False):
+        """
+        Returns the dynamic agents in the Moore neighborhood of a position, looked up in the spatial index.
+        Equivalent to filtering get_neighbors(pos, moore=True, include_center, radius) by agent_type (without torus).
+        :param pos: Tuple
+        :param radius: int
+        :param agent_type: class: only return agents of this type (incl. subclasses), optional
+        :param include_center: Boolean
+        :return: list of agents
+        """
+        return self.agent_index.get_agents_in_radius(pos, radius, agent_type=agent_type, include_center=include_center)
+
+    def get_cell_type(self, pos):
+        """
+        Returns the static cell type of a position.
+        :param pos: Tuple
+        :return: CellType
+        """
+        return CellType(self.terrain[pos[1], pos[0]])
+
+    def get_item_type(self, pos):
+        """
+        Returns the inanimate agent class that the cell type of a position stands for (None for floor).
+        :param pos: Tuple
+        :return: Item class or None
+        """
+        return CELL_TYPE_TO_ITEM.get(self.get_cell_type(pos))
+
+    def get_walkable_mask(self, unwalkable_objects_list):
+        """
+        Returns a boolean raster (height, width) that is True for every cell that is not of an unwalkable type.
+        :param unwalkable_objects_list: list with all object types that are unwalkable
+        :return: numpy bool array
+        """
+        unwalkable_cell_types = get_cell_types_of_items(unwalkable_objects_list)
+        return ~np.isin(self.terrain, unwalkable_cell_types)
@@ -6,6 +6,9 @@ from mesa.datacollection import DataCollector
 from Scripts.AnimateAgents import *
 from Scripts.InanimateAgents import *
 from Scripts.Enums import *
+from Scripts.Profiler import NULL_PROFILER
+from Scripts.PathCache import PathCache
+from Scripts.PathFinding import a_star_search
 
 
 class ToyModel(Model):
@@ -28,6 +31,8 @@ class ToyModel(Model):
         self.n_staff = 0
         self.n_visitors = n_visitors
         self.safe_agents = set()
+        self.profiler = NULL_PROFILER  # see Profiler.py
+        self.exit_usage = {}  # exit position -> number of persons that left through it
 
         self.grid = MultiGrid(width=width, height=height, torus=False)
         self.schedule = RandomActivation(self)
@@ -55,7 +60,8 @@ class ToyModel(Model):
         self.spawn_staff()
 
         # Saving calculated paths in dict key=(start pos, end pos), value=path
-        self.all_paths = {}
+        self.all_paths = PathCache(width=self.grid.width)
+        self.path_search = a_star_search
 
         self.datacollector = DataCollector(model_reporters={"safe_agents": self.get_nr_of_safe_agents})
 
@@ -93,6 +99,9 @@ class ToyModel(Model):
     def get_nr_of_safe_agents(self, dummy=1):
         return len(self.safe_agents)
 
+    def get_safe_agents_per_tick(self):
+        return list(self.datacollector.model_vars['safe_agents'])
+
     def step(self):
 
         self.end_time += 1
@@ -299,7 +308,7 @@ class ToyModel(Model):
             visitor = Visitor(self.next_id(), self, female_ratio=self.female_ratio, adult_ratio=self.adult_ratio,
                               familiarity=self.familiarity)
 
-            pos = random.choice(spawnable_positions)
+            pos = self.random.choice(spawnable_positions)
 
             self.grid.place_agent(agent=visitor, pos=pos)
             self.schedule.add(visitor)
@@ -0,0 +1,566 @@
+"""
+Vectorized engine: steps all persons of an EvacuationModel at once with numpy array operations, instead of calling
+Visitor.step and Staff.step one by one. Positions, speeds, evacuation flags, alarm timers, stopping times, tasks and the
+remaining paths of all persons live in arrays (one row per person), and every tick the alarm countdown, the speed
+update, the evacuation contagion, the staff informing visitors and the stride movement advance the whole population.
+Only rare events (sampling a new task, computing a path, leaving the building) are handled per person.
+
+Select it with EvacuationModel(engine='vectorized'). The persons are still created (and sampled) as agents, their state
+is copied into the arrays once, and agents that leave are removed from the grid and schedule as before.
+One engine can also step the persons of several models (replications) together, see BatchRunner.py: their rows are
+stacked, and every row knows the replication it belongs to.
+Differences to the object engine: all persons see the state of the start of the tick (the object engine activates
+them one after another in random order), and the alarm counts down before the persons act.
+
+Compare both engines from the repository root with:
+    python -m Scripts.VectorizedEngine --n-replications 10
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from Scripts.AnimateAgents import Person, Staff
+from Scripts.Enums import Destination, ExitType, VisitorTasks
+from Scripts.PathFinding import NEIGHBOR_OFFSETS, UNREACHABLE
+from Scripts.DestinationFields import FIELD_UNREACHABLE
+from Scripts.SpatialIndex import compute_summed_area_table
+
+# Current activity of a person that is not evacuating
+IDLE = 0  # no task left, samples a new one
+WALK = 1  # walks along its path to its destination
+STAY = 2  # stays until its stay timer ran out
+
+# Exit groups whose (single group) distance fields evacuating persons descend, see EvacuationModel.get_exit_distance_field
+FIELD_EXIT_TYPES = [ExitType.A, ExitType.B, ExitType.C]
+
+# Destination of each visitor task (all of them are followed by a stay)
+TASK_DESTINATIONS = {VisitorTasks.STUDY: Destination.DESK,
+                     VisitorTasks.GET_BOOK: Destination.SHELF,
+                     VisitorTasks.GET_HELP: Destination.HELPDESK}
+
+
+class PathBuffer:
+    """
+    All paths of a run, concatenated into one growing (n, 2) array. A person's remaining path is the slice between its
+    cursor (current position) and the end of its path.
+    """
+
+    def __init__(self, capacity=1024):
+        self.cells = np.zeros((capacity, 2), dtype=np.int64)
+        self.size = 0
+
+    def append(self, path):
+        """
+        Appends a path and returns where it starts and ends in the buffer.
+        :param path: list of positions
+        :return: start: int, end: int
+        """
+        start = self.size
+        end = start + len(path)
+        if end > len(self.cells):
+            cells = np.zeros((max(2 * len(self.cells), end), 2), dtype=np.int64)
+            cells[:self.size] = self.cells[:self.size]
+            self.cells = cells
+        if path:
+            self.cells[start:end] = path
+        self.size = end
+        return start, end
+
+
+class VectorizedEngine:
+
+    def __init__(self, models):
+        """
+        Copies the state of all persons of some models into arrays.
+        :param models: list of EvacuationModel on the same map (after spawning their visitors and staff)
+        """
+        self.models = models
+        model = models[0]  # the exit distance fields are the same for all models on a map
+        self.agents = []
+        replication = []
+        for r, replication_model in enumerate(models):
+            persons = [agent for agent in replication_model.schedule.agents if isinstance(agent, Person)]
+            self.agents.extend(persons)
+            replication.extend([r] * len(persons))
+        self.replication = np.array(replication, dtype=np.int64)
+        n = len(self.agents)
+
+        self.is_staff = np.array([isinstance(agent, Staff) for agent in self.agents], dtype=bool)
+        self.default_walking_speed = np.array([a.move_data.default_walking_speed for a in self.agents], dtype=float)
+        self.default_running_speed = np.array([a.move_data.default_running_speed for a in self.agents], dtype=float)
+        self.walking_speed = self.default_walking_speed.copy()
+        self.running_speed = self.default_running_speed.copy()
+
+        knowledge = [agent.emergency_knowledge for agent in self.agents]
+        self.had_safety_training = np.array([k.had_safety_training for k in knowledge], dtype=bool)
+        self.is_evacuating = np.array([k.is_evacuating for k in knowledge], dtype=bool)
+        self.informed_by_staff = np.array([k.informed_by_staff for k in knowledge], dtype=bool)
+        self.alarm_timer = np.array([k.alarm_timer for k in knowledge], dtype=np.int64)
+        self.alarm_timer_max = np.array([k.alarm_timer_max for k in knowledge], dtype=np.int64)
+        self.stopping_time = np.array([k.stopping_time for k in knowledge], dtype=np.int64)
+        self.closest_exit = np.array([k.closest_exit for k in knowledge], dtype=np.int64).reshape(n, 2)
+
+        self.pos = np.array([agent.pos for agent in self.agents], dtype=np.int64).reshape(n, 2)
+        self.active = np.ones(n, dtype=bool)
+        self.exit_time = np.full(n, -1, dtype=np.int64)
+
+        # tasks: activity, destination of the walk and duration of the stay that follows it
+        self.activity = np.full(n, IDLE, dtype=np.int8)
+        self.destination = np.full((n, 2), -1, dtype=np.int64)  # -1: no walk yet
+        self.destination_field = np.full(n, -1, dtype=np.int64)  # field of the destination, see DestinationFields
+        self.destination_fields = model.destination_fields
+        self.stay_duration = np.zeros(n, dtype=float)
+        self.stay_remaining = np.zeros(n, dtype=float)
+
+        # remaining paths
+        self.paths = PathBuffer()
+        self.path_cursor = np.zeros(n, dtype=np.int64)
+        self.path_end = np.zeros(n, dtype=np.int64)
+
+        # exit distance fields of the single exit groups, and which of them leads to each person's closest exit
+        self.exit_fields = np.stack([model.exit_distance_fields[exit_type] for exit_type in FIELD_EXIT_TYPES])
+        self.exit_lookup = {}
+        for group, exit_type in enumerate(FIELD_EXIT_TYPES):
+            for pos in model.exit_field_sources[exit_type]:
+                self.exit_lookup.setdefault(tuple(pos), group)
+        self.exit_group = np.full(n, -1, dtype=np.int64)
+        self.update_exit_groups(np.arange(n))
+
+        for i, agent in enumerate(self.agents):
+            self.copy_task(i, agent)
+
+    def copy_task(self, i, agent):
+        """
+        Copies the current (not yet started) visitor task of an agent, i.e. [Walk, Stay] as sampled by CompositeTask.
+        :param i: int: row of the agent
+        :param agent: Person
+        """
+        subtasks = agent.current_task.remaining_subtasks
+        if len(subtasks) == 2 and hasattr(subtasks[0], 'destination'):
+            self.activity[i] = WALK
+            self.destination[i] = subtasks[0].destination
+            self.destination_field[i] = self.get_destination_field_id(subtasks[0].destination)
+            self.stay_duration[i] = subtasks[1].remaining_duration
+
+    def update_exit_groups(self, rows):
+        """
+        Looks up the exit group (distance field) of the closest exit of some persons.
+        :param rows: numpy int array
+        """
+        for i in rows:
+            self.exit_group[i] = self.exit_lookup.get(tuple(self.closest_exit[i].tolist()), -1)
+
+    def step(self):
+        """
+        Advances all persons by one tick.
+        """
+        alarm_activated = np.zeros(len(self.models), dtype=bool)
+        for r, model in enumerate(self.models):
+            if not model.alarm.is_activated:
+                model.alarm.step()
+            alarm_activated[r] = model.alarm.is_activated
+        alarm = alarm_activated[self.replication]
+
+        visitors = self.active & ~self.is_staff
+        staff = self.active & self.is_staff
+        profiler = self.models[0].profiler  # phases of all replications are measured together
+
+        with profiler.phase('speed_update'):
+            self.update_speeds()
+        self.is_evacuating[staff & alarm] = True
+        with profiler.phase('environment_scan'):
+            self.update_visitors(visitors, alarm)
+        with profiler.phase('inform_visitors'):
+            waiting = self.inform_visitors(staff & self.is_evacuating, visitors)
+
+        # evacuating persons that stand on their exit leave, the others walk towards it
+        evacuating = self.active & self.is_evacuating
+        at_exit = evacuating & np.all(self.pos == self.closest_exit, axis=1)
+        with profiler.phase('leave'):
+            self.leave(np.flatnonzero(at_exit))
+        with profiler.phase('exit_field_descent'):
+            self.evacuate(evacuating & ~at_exit & ~waiting)
+
+        with profiler.phase('task_do'):
+            self.do_tasks(visitors & ~self.is_evacuating)
+
+    def update_speeds(self):
+        """
+        Sets the walking and running speed of all persons from the number of persons within 6 dm (excluding their own
+        cell), as MovementData.update_speed does, with one summed-area table of the tick.
+        """
+        rows = np.flatnonzero(self.active)
+        nr_of_neighbors = self.count_in_radius(rows, rows, radius=6)
+
+        for speed, default_speed in ((self.walking_speed, self.default_walking_speed),
+                                     (self.running_speed, self.default_running_speed)):
+            crowded_speed = np.ceil(default_speed[rows] / np.maximum(nr_of_neighbors, 1) * 10) / 10
+            speed[rows] = np.where(nr_of_neighbors <= 0, default_speed[rows],
+                                   np.where(nr_of_neighbors >= 8, 0.1, crowded_speed))
+
+    def update_visitors(self, visitors, alarm):
+        """
+        After the alarm, visitors without safety training that were not informed by staff first finish their stopping
+        time. The others count the alarm time and start evacuating if it is up or if most visitors around evacuate.
+        :param visitors: numpy bool array: mask of the visitors in the building
+        :param alarm: numpy bool array: mask of the persons whose alarm is activated
+        """
+        stopping = visitors & alarm & ~self.informed_by_staff & (self.stopping_time > 0) & ~self.had_safety_training
+        self.stopping_time[stopping] -= 1
+
+        scanning = visitors & ~stopping
+        self.alarm_timer[scanning & alarm] += 1
+        self.update_visitor_contagion(scanning)
+        self.is_evacuating |= scanning & (self.alarm_timer >= self.alarm_timer_max)
+
+    def update_visitor_contagion(self, scanning):
+        """
+        Visitors start evacuating if at least half of the visitors within 5 m (excluding their own cell) evacuate, see
+        Person.scan_environment_for_evacuation.
+        :param scanning: numpy bool array: mask of the visitors that scan their environment
+        """
+        rows = np.flatnonzero(scanning)
+        visitors = np.flatnonzero(self.active & ~self.is_staff)
+        evacuating = visitors[self.is_evacuating[visitors]]
+        if len(rows) == 0 or len(evacuating) == 0:
+            return
+
+        nr_of_visitors = self.count_in_radius(rows, visitors, radius=50)
+        nr_of_evacuating = self.count_in_radius(rows, evacuating, radius=50)
+        evacuating_ratio = nr_of_evacuating / np.maximum(nr_of_visitors, 1)
+        self.is_evacuating[rows[evacuating_ratio >= 0.5]] = True
+
+    def count_in_radius(self, rows, counted, radius):
+        """
+        Returns for some persons how many of the counted persons (of the same replication) stand in their Moore
+        neighborhood (excluding their own cell), with one summed-area table of the counted persons per replication.
+        :param rows: numpy int array: persons to return the counts for
+        :param counted: numpy int array: persons to count
+        :param radius: int
+        :return: numpy int array
+        """
+        if len(counted) == 0:
+            return np.zeros(len(rows), dtype=np.int64)
+
+        # the table only has to cover the bounding box of the counted persons
+        min_x, min_y = self.pos[counted].min(axis=0)
+        max_x, max_y = self.pos[counted].max(axis=0)
+        height, width = max_y - min_y + 1, max_x - min_x + 1
+        occupancy = np.zeros((len(self.models), height, width), dtype=np.int32)
+        np.add.at(occupancy, (self.replication[counted], self.pos[counted, 1] - min_y, self.pos[counted, 0] - min_x), 1)
+        table = compute_summed_area_table(occupancy)
+
+        r = self.replication[rows]
+        x, y = self.pos[rows, 0] - min_x, self.pos[rows, 1] - min_y
+        x0, y0 = np.clip(x - radius, 0, width), np.clip(y - radius, 0, height)
+        x1, y1 = np.clip(x + radius + 1, 0, width), np.clip(y + radius + 1, 0, height)
+        own_cell = np.zeros(len(rows), dtype=np.int64)
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        own_cell[inside] = occupancy[r[inside], y[inside], x[inside]]
+        return table[r, y1, x1] - table[r, y0, x1] - table[r, y1, x0] + table[r, y0, x0] - own_cell
+
+    def inform_visitors(self, informing, visitors, radius=5):
+        """
+        Evacuating staff tell the visitors within radius (that were not informed yet) to evacuate to their own closest
+        exit, and wait while visitors are close by, see StaffEvacuation.
+        :param informing: numpy bool array: mask of the informing staff
+        :param visitors: numpy bool array: mask of the visitors in the building
+        :param radius: int
+        :return: waiting: numpy bool array: mask of the staff that wait for visitors
+        """
+        waiting = np.zeros(len(self.agents), dtype=bool)
+        visitor_rows = np.flatnonzero(visitors)
+
+        for i in np.flatnonzero(informing):
+            distance = np.abs(self.pos[visitor_rows] - self.pos[i]).max(axis=1)
+            close = (distance <= radius) & (distance > 0) & (self.replication[visitor_rows] == self.replication[i])
+            if not np.any(close):
+                continue
+            waiting[i] = True
+
+            informed = visitor_rows[close & ~self.informed_by_staff[visitor_rows]]
+            self.is_evacuating[informed] = True
+            self.informed_by_staff[informed] = True
+            self.closest_exit[informed] = self.closest_exit[i]
+            self.exit_group[informed] = self.exit_group[i]
+
+        return waiting
+
+    def leave(self, rows):
+        """
+        Removes persons that reached their exit from the building (and from the grid and schedule of the model).
+        :param rows: numpy int array
+        """
+        for i in rows:
+            agent = self.agents[i]
+            model = self.models[self.replication[i]]
+            exit_pos = tuple(self.pos[i].tolist())  # agent.pos is only updated by sync_agents
+            model.exit_usage[exit_pos] = model.exit_usage.get(exit_pos, 0) + 1
+            model.grid.remove_agent(agent)
+            model.schedule.remove(agent)
+            agent.emergency_knowledge.left = True
+            model.safe_agents.add(agent)
+            self.exit_time[i] = model.end_time
+        self.active[rows] = False
+
+    def evacuate(self, moving):
+        """
+        Moves evacuating persons towards their closest exit with their running speed: down the exit distance field of
+        its group if they can reach it, otherwise along a path (see Walk.do). Persons that reach another cell of their
+        exit take that cell as their closest exit.
+        :param moving: numpy bool array
+        """
+        rows = np.flatnonzero(moving)
+        stride_length = (self.running_speed[rows] * 10).astype(np.int64)
+
+        x, y = self.pos[rows, 0], self.pos[rows, 1]
+        group = self.exit_group[rows]
+        on_field = (group >= 0) & (self.exit_fields[np.maximum(group, 0), y, x] != UNREACHABLE)
+
+        self.descend_exit_fields(rows[on_field], stride_length[on_field])
+        self.path_cursor[rows[on_field]] = self.path_end[rows[on_field]]  # the field replaces the path
+        field_rows = rows[on_field]
+        arrived = field_rows[self.exit_fields[group[on_field], self.pos[field_rows, 1], self.pos[field_rows, 0]] == 0]
+        self.closest_exit[arrived] = self.pos[arrived]
+
+        self.follow_paths(rows[~on_field], self.closest_exit[rows[~on_field]], stride_length[~on_field])
+
+    def do_tasks(self, normal):
+        """
+        Advances the tasks of visitors that are not evacuating: idle visitors sample a new task, walking visitors move
+        along their path with their walking speed and start staying at their destination, staying visitors count down.
+        :param normal: numpy bool array
+        """
+        staying = normal & (self.activity == STAY)
+        self.stay_remaining[staying] -= 1
+        self.activity[staying & (self.stay_remaining <= 0)] = IDLE
+
+        walking = np.flatnonzero(normal & (self.activity == WALK) & np.any(self.pos != self.destination, axis=1))
+        stride_length = (self.walking_speed[walking] * 10).astype(np.int64)
+        on_field = self.get_on_destination_field(walking)
+        with self.models[0].profiler.phase('destination_field_descent'):
+            self.descend_destination_fields(walking[on_field], stride_length[on_field])
+        self.follow_paths(walking[~on_field], self.destination[walking[~on_field]], stride_length[~on_field])
+        arrived = walking[np.all(self.pos[walking] == self.destination[walking], axis=1)]
+        self.activity[arrived] = STAY
+        self.stay_remaining[arrived] = self.stay_duration[arrived]
+
+        for i in np.flatnonzero(normal & (self.activity == IDLE) & ~staying):
+            self.sample_task(i)
+
+    def sample_task(self, i):
+        """
+        Samples a new visitor task [Walk, Stay] for one person, as CompositeTask.generate_visitor_sub_tasks does.
+        :param i: int
+        """
+        model = self.models[self.replication[i]]
+        destinations = model.destinations
+        tasks = list(TASK_DESTINATIONS)
+        weights = [len(destinations[TASK_DESTINATIONS[task]]) for task in tasks]
+        task = model.random.choices(tasks, weights)[0]
+        self.stopping_time[i] = task.value
+
+        # avoid the destination of the previous walk
+        previous = tuple(self.destination[i].tolist()) if self.destination[i, 0] >= 0 else ()
+        relevant_destinations = destinations[TASK_DESTINATIONS[task]]
+        destination = model.random.choice(relevant_destinations)
+        while destination == previous:
+            destination = model.random.choice(relevant_destinations)
+
+        self.activity[i] = WALK
+        self.destination[i] = destination
+        self.destination_field[i] = self.get_destination_field_id(destination)
+        self.stay_duration[i] = model.random.uniform(5, 20)
+
+    def get_destination_field_id(self, destination):
+        """
+        Returns the destination field of a destination (see DestinationFields), or -1 if it has none.
+        :param destination: Tuple
+        :return: int
+        """
+        if self.destination_fields is None:
+            return -1
+        return self.destination_fields.get_field_id(destination)
+
+    def get_on_destination_field(self, rows):
+        """
+        Returns which persons can walk down the field of their destination, as Walk.get_destination_field does.
+        :param rows: numpy int array
+        :return: numpy bool array
+        """
+        field = self.destination_field[rows]
+        on_field = field >= 0
+        if np.any(on_field):
+            distance = self.destination_fields.get_distances(field[on_field], self.pos[rows[on_field], 0],
+                                                             self.pos[rows[on_field], 1])
+            on_field[on_field] = distance != FIELD_UNREACHABLE
+        return on_field
+
+    def descend_destination_fields(self, rows, n_steps):
+        """
+        Moves persons up to n_steps cells down the field of their destination, for all of them at once.
+        :param rows: numpy int array
+        :param n_steps: numpy int array
+        """
+        if len(rows) == 0:
+            return
+        self.pos[rows, 0], self.pos[rows, 1] = self.destination_fields.descend_many(
+            self.destination_field[rows], self.pos[rows, 0], self.pos[rows, 1], n_steps)
+        self.path_cursor[rows] = self.path_end[rows]  # the field replaces the path
+
+    def follow_paths(self, rows, destinations, stride_length):
+        """
+        Moves persons stride_length cells along their remaining path, after giving a new path to the destination to
+        the persons that have (almost) no path left.
+        :param rows: numpy int array
+        :param destinations: numpy int array (len(rows), 2)
+        :param stride_length: numpy int array
+        """
+        needs_path = self.path_end[rows] - self.path_cursor[rows] <= 1
+        for i, destination in zip(rows[needs_path], destinations[needs_path]):
+            model = self.models[self.replication[i]]
+            path = self.get_path(model, tuple(self.pos[i].tolist()), tuple(destination.tolist()))
+            self.path_cursor[i], self.path_end[i] = self.paths.append(path)
+
+        has_path = self.path_end[rows] > self.path_cursor[rows]
+        rows, stride_length = rows[has_path], stride_length[has_path]
+        self.path_cursor[rows] = np.minimum(self.path_cursor[rows] + stride_length, self.path_end[rows] - 1)
+        self.pos[rows] = self.paths.cells[self.path_cursor[rows]]
+
+    @staticmethod
+    def get_path(model, origin, destination):
+        """
+        Returns the path between two positions from the model's path cache (or computes and stores it), as Walk.do does.
+        :param model: EvacuationModel
+        :param origin: Tuple
+        :param destination: Tuple
+        :return: list of positions
+        """
+        all_paths = model.all_paths
+        profiler = model.profiler
+        cached = all_paths.lookup(origin, destination)
+        if cached is not None:
+            path, start = cached
+            profiler.count('path_cache_suffix_hits' if start else 'path_cache_hits')
+            return path[start:] if start else path
+        stats = {} if profiler.enabled else None
+        with profiler.phase('pathfinding'):
+            path = model.path_search(model.grid, origin, destination, stats=stats)
+        profiler.count('path_cache_misses')
+        if stats:
+            profiler.count('astar_expanded', stats['expanded'])
+        return all_paths.add((origin, destination), path)
+
+    def descend_exit_fields(self, rows, n_steps):
+        """
+        Moves persons up to n_steps cells down the distance field of their exit group, for all of them at once
+        (same steps as PathFinding.descend_distance_field).
+        :param rows: numpy int array
+        :param n_steps: numpy int array
+        """
+        if len(rows) == 0:
+            return
+        group = self.exit_group[rows]
+        _, height, width = self.exit_fields.shape
+        x, y = self.pos[rows, 0].copy(), self.pos[rows, 1].copy()
+        distance = self.exit_fields[group, y, x].astype(np.int64)
+
+        for step in range(int(n_steps.max())):
+            going = (step < n_steps) & (distance > 0)
+            if not np.any(going):
+                break
+            moved = np.zeros(len(rows), dtype=bool)
+            for dx, dy in NEIGHBOR_OFFSETS:
+                next_x, next_y = x + dx, y + dy
+                candidate = going & ~moved & (next_x >= 0) & (next_x < width) & (next_y >= 0) & (next_y < height)
+                candidate[candidate] = self.exit_fields[group[candidate], next_y[candidate],
+                                                        next_x[candidate]] == distance[candidate] - 1
+                x = np.where(candidate, next_x, x)
+                y = np.where(candidate, next_y, y)
+                moved |= candidate
+            distance = np.where(moved, distance - 1, distance)
+
+        self.pos[rows, 0] = x
+        self.pos[rows, 1] = y
+
+    def get_person_state(self, replication=0):
+        """
+        Returns the positions and current speeds of the persons of a replication that are in the building.
+        :param replication: int: index of the model in self.models
+        :return: numpy int array (n, 2) and numpy float array (n,)
+        """
+        rows = np.flatnonzero(self.active & (self.replication == replication))
+        speeds = np.where(self.is_evacuating[rows], self.running_speed[rows], self.walking_speed[rows])
+        return self.pos[rows], speeds
+
+    def sync_agents(self):
+        """
+        Writes the array state back into the agents and moves them on the grid (e.g. before drawing the model).
+        """
+        for i in np.flatnonzero(self.active):
+            agent = self.agents[i]
+            knowledge = agent.emergency_knowledge
+            knowledge.is_evacuating = bool(self.is_evacuating[i])
+            knowledge.informed_by_staff = bool(self.informed_by_staff[i])
+            knowledge.alarm_timer = int(self.alarm_timer[i])
+            knowledge.stopping_time = int(self.stopping_time[i])
+            knowledge.closest_exit = tuple(self.closest_exit[i].tolist())
+            agent.move_data.walking_speed = float(self.walking_speed[i])
+            agent.move_data.running_speed = float(self.running_speed[i])
+            pos = tuple(self.pos[i].tolist())
+            if agent.pos != pos:
+                self.models[self.replication[i]].grid.move_agent(agent, pos)
+
+
+def compare_engines(n_replications=10, max_run_length=1000, **model_kwargs):
+    """
+    Runs replications with both engines and returns their evacuation times. As the engines activate persons
+    differently, the runs are not identical; their evacuation times should follow the same distribution.
+    :param n_replications: int
+    :param max_run_length: int
+    :param model_kwargs: arguments of EvacuationModel
+    :return: dict with engine name as key and a list of evacuation times and the run time (s) as value
+    """
+    from Scripts.EvacuationModel import EvacuationModel  # EvacuationModel imports this module
+
+    results = {}
+    for engine in ('object', 'vectorized'):
+        start_t = time.time()
+        evacuation_times = []
+        for _ in range(n_replications):
+            model = EvacuationModel(engine=engine, **model_kwargs)
+            for _ in range(max_run_length):
+                model.step()
+                if model.is_done():
+                    break
+            evacuation_times.append(model.get_total_evacuation_time())
+        results[engine] = (evacuation_times, round(time.time() - start_t, 1))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the vectorized engine to the object engine.')
+    parser.add_argument('--n-replications', type=int, default=10)
+    parser.add_argument('--max-run-length', type=int, default=1000)
+    parser.add_argument('--n-visitors', type=int, default=50)
+    parser.add_argument('--valid-exits', default='ABC', choices=[exit_type.name for exit_type in ExitType])
+    parser.add_argument('--tolerance', type=float, default=0.1, help='maximum relative difference of the means')
+    args = parser.parse_args()
+
+    results = compare_engines(n_replications=args.n_replications, max_run_length=args.max_run_length,
+                              n_visitors=args.n_visitors, valid_exits=ExitType[args.valid_exits])
+    means = {}
+    for engine, (evacuation_times, run_time) in results.items():
+        means[engine] = float(np.mean(evacuation_times))
+        print(f"{engine}: mean evacuation time {means[engine]:.1f} (std {np.std(evacuation_times):.1f}), "
+              f"run time {run_time} s")
+
+    difference = abs(means['vectorized'] - means['object']) / max(means['object'], 1)
+    print(f"Relative difference of the means: {difference:.3f}")
+    return 0 if difference <= args.tolerance else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
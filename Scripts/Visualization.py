@@ -1,9 +1,52 @@
+import numpy as np
 from mesa.visualization.modules import CanvasGrid, ChartModule
 from mesa.visualization.ModularVisualization import ModularServer
 # from Scripts.ToyModel import *    # TODO S: temporary switch off
 from Scripts.AnimateAgents import *
 from Scripts.InanimateAgents import *
 from Scripts.EvacuationModel import get_border_dims
+from Scripts.Terrain import TerrainGrid, CELL_TYPE_TO_ITEM
+
+
+class TerrainCanvasGrid(CanvasGrid):
+    """
+    CanvasGrid that also draws the static terrain raster of a TerrainGrid (walls, desks, shelves, exits, ...), since
+    those library objects are no agents on the grid. The terrain portrayals are built once and reused for every frame.
+    """
+
+    def __init__(self, portrayal_method, item_portrayal_method, grid_width, grid_height, canvas_width=500,
+                 canvas_height=500):
+        super().__init__(portrayal_method, grid_width, grid_height, canvas_width, canvas_height)
+        self.item_portrayal_method = item_portrayal_method
+        self.terrain_state = None
+
+    def render(self, model):
+        grid_state = super().render(model)
+
+        if isinstance(model.grid, TerrainGrid):
+            if self.terrain_state is None:
+                self.terrain_state = self.render_terrain(model.grid)
+            for layer, portrayals in self.terrain_state.items():
+                grid_state[layer] = portrayals + grid_state[layer]
+
+        return grid_state
+
+    def render_terrain(self, grid):
+        """
+        Creates the portrayals of all terrain cells that have a shape to draw.
+        :param grid: TerrainGrid
+        :return: dict with layer as key and list of portrayals as value
+        """
+        terrain_state = {}
+        for cell_type, item_type in CELL_TYPE_TO_ITEM.items():
+            portrayal = self.item_portrayal_method(item_type)
+            if "Shape" not in portrayal:
+                continue
+            ys, xs = np.nonzero(grid.terrain == cell_type)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                terrain_state.setdefault(portrayal["Layer"], []).append(dict(portrayal, x=x, y=y))
+        return terrain_state
+
 
 def show_visualization(model, img_map_path, n_visitors, female_ratio, adult_ratio,
                        familiarity, n_officestaff, valid_exits):
@@ -11,56 +54,69 @@ def show_visualization(model, img_map_path, n_visitors, female_ratio, adult_rati
     Creates an animation, given a model type (e.g. EvacuationModel)
     """
 
-    def agent_portrayal(agent):
+    def item_portrayal(item_type):
         """
-        This function determines how agents should look like (color, shape, etc.)
+        This function determines how static library objects (Item classes) should look like
         """
 
         portrayal = {"Filled": "true",
                      "Layer": 1}
 
-        if isinstance(agent, Wall) or isinstance(agent, Obstacle):
+        if issubclass(item_type, Wall) or issubclass(item_type, Obstacle):
             portrayal["Shape"] = "rect"
             portrayal["Color"] = "gray"
             portrayal["h"] = 1
             portrayal["w"] = 1
             portrayal["Name"] = 'wall'
 
-        if isinstance(agent, Desk):
+        if issubclass(item_type, Desk):
             portrayal["Shape"] = "rect"
             portrayal["Color"] = "Black"
             portrayal["h"] = 1
             portrayal["w"] = 1
             portrayal["Name"] = 'desk'
 
-        # if isinstance(agent, DeskInteractive):
+        # if issubclass(item_type, DeskInteractive):
         #     portrayal["Shape"] = "rect"
         #     portrayal["Color"] = "orange"
         #     portrayal["h"] = 1
         #     portrayal["w"] = 1
         #     portrayal["Name"] = 'chair'
 
-        if isinstance(agent, Shelf):
+        if issubclass(item_type, Shelf):
             portrayal["Shape"] = "rect"
             portrayal["Color"] = "green"
             portrayal["h"] = 1
             portrayal["w"] = 1
             portrayal["Name"] = 'shelf'
 
-        if isinstance(agent, HelpDesk):
+        if issubclass(item_type, HelpDesk):
             portrayal["Shape"] = "rect"
             portrayal["Color"] = "purple"
             portrayal["h"] = 1
             portrayal["w"] = 1
             portrayal["Name"] = 'Helpdesk'
 
-        if isinstance(agent, ExitA) or isinstance(agent, ExitB) or isinstance(agent, ExitC):
+        if issubclass(item_type, ExitA) or issubclass(item_type, ExitB) or issubclass(item_type, ExitC):
             portrayal["Shape"] = "rect"
             portrayal["Color"] = "red"
             portrayal["h"] = 1
             portrayal["w"] = 1
             portrayal["Name"] = 'exit'
 
+        return portrayal
+
+    def agent_portrayal(agent):
+        """
+        This function determines how agents should look like (color, shape, etc.)
+        """
+
+        if isinstance(agent, Item):
+            return item_portrayal(type(agent))
+
+        portrayal = {"Filled": "true",
+                     "Layer": 1}
+
         if isinstance(agent, Visitor):
             portrayal["Shape"] = "circle"
             portrayal["Color"] = "red"
@@ -96,13 +152,14 @@ def show_visualization(model, img_map_path, n_visitors, female_ratio, adult_rati
     if img_map_path is not None:
         height, width = get_border_dims(img_map_path)
         px_rep = 3
-        canvas = CanvasGrid(agent_portrayal, width, height, int(round(width*px_rep,0)), int(round(height*px_rep,0)))
+        canvas = TerrainCanvasGrid(agent_portrayal, item_portrayal, width, height, int(round(width*px_rep,0)),
+                                   int(round(height*px_rep,0)))
         server = ModularServer(model,
                                [canvas, chart],
                                "Evacuation Model",
                                {"img_path": img_map_path,"familiarity":familiarity, "n_officestaff":n_officestaff,
                                 "n_visitors":n_visitors, "valid_exits":valid_exits, "female_ratio": female_ratio,
-                                "adult_ratio":adult_ratio})
+                                "adult_ratio":adult_ratio, "sync_agents": True})
     else:
         width = 20
         height = 15